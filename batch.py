@@ -0,0 +1,188 @@
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+
+import bin.image_processor as image_processor
+from bin import parallel
+from bin.result_cache import ResultCache
+from bin.tiff_reader import TiffStack
+from bin.tiff_writer import BIGTIFF_THRESHOLD, PRESETS, write_tiff
+
+
+_processor = None
+_cache = None
+
+
+def parse_op(text):
+    name, _, params = text.partition(':')
+    if name not in image_processor.OPERATIONS:
+        raise argparse.ArgumentTypeError(f"unknown operation: {name}")
+    merged = dict(image_processor.DEFAULT_PARAMS[name])
+    if params:
+        merged.update(json.loads(params))
+    return name, merged
+
+
+def load_recipe(path):
+    with open(path, encoding='utf-8') as f:
+        recipe = json.load(f)
+    ops = []
+    for step in recipe:
+        name, params = (step['name'], step.get('params', {})) if isinstance(step, dict) else step
+        ops.append(parse_op(f"{name}:{json.dumps(params)}"))
+    return ops
+
+
+def iter_images(root, patterns):
+    # depth-first scandir walk so the first jobs start before the tree is listed
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in reversed(entries):
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+        for entry in entries:
+            if entry.is_file() and any(fnmatch.fnmatch(entry.name.lower(), p) for p in patterns):
+                yield entry.path
+
+
+def _init_worker(cache_dir=None):
+    global _processor, _cache
+    # files are already spread over processes, bands would only oversubscribe the cores
+    cv2.setNumThreads(1)
+    parallel.set_threads(1)
+    _processor = image_processor.ImageProcessor()
+    # results are shared with the viewer, a page processed here opens there without recomputing
+    _cache = ResultCache(cache_dir or None) if cache_dir is not None else None
+
+
+def process_file(src, dst, ops, compression='deflate', preset='balanced'):
+    start = time.perf_counter()
+    stack = TiffStack(src)
+    stats = {'load': 0.0, 'process': 0.0, 'pixels': 0, 'cached': 0, 'pages': 0}
+
+    def results():
+        # one page at a time, each is written before the next one is read
+        for index in range(len(stack)):
+            t0 = time.perf_counter()
+            result = _cache.get(src, index, ops) if _cache is not None else None
+            if result is None:
+                page = stack.read_page(index)
+                t1 = time.perf_counter()
+                result = _processor.apply_operations(page, ops)
+                del page
+                if _cache is not None:
+                    _cache.put(src, index, ops, result)
+            else:
+                stats['cached'] += 1
+                t1 = time.perf_counter()
+            stats['load'] += t1 - t0
+            stats['process'] += time.perf_counter() - t1
+            stats['pixels'] += result.shape[0] * result.shape[1]
+            stats['pages'] += 1
+            yield result
+
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    # the raw size of the source decides BigTIFF, compression only makes the output smaller
+    sizes = [page.nbytes if page is not None else 0 for page in stack.pages]
+    write_tiff(dst, results(), compression=compression, preset=preset,
+               bigtiff=sum(sizes) > BIGTIFF_THRESHOLD, workers=1)
+    total = time.perf_counter() - start
+    return {
+        'file': src,
+        'pages': stats['pages'],
+        'cached': stats['cached'],
+        'megapixels': stats['pixels'] / 1e6,
+        'load': stats['load'],
+        'process': stats['process'],
+        'save': total - stats['load'] - stats['process'],
+        'total': total,
+    }
+
+
+def run(args, ops, out=sys.stdout):
+    patterns = [p.lower() for p in args.pattern]
+    max_inflight = args.max_inflight or 2 * args.workers
+    done = failed = 0
+    megapixels = 0.0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(getattr(args, 'cache', None),)) as pool:
+        pending = {}
+
+        def drain(return_when):
+            nonlocal done, failed, megapixels
+            finished, _ = wait(pending, return_when=return_when)
+            for future in finished:
+                src = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"FAILED {src}: {e}", file=out, flush=True)
+                    continue
+                done += 1
+                megapixels += result['megapixels']
+                print(f"{result['file']}  pages={result['pages']}  cached={result['cached']}  {result['megapixels']:.1f} MP  "
+                      f"load={result['load'] * 1000:.0f}ms  process={result['process'] * 1000:.0f}ms  "
+                      f"save={result['save'] * 1000:.0f}ms  total={result['total'] * 1000:.0f}ms",
+                      file=out, flush=True)
+
+        for src in iter_images(args.input, patterns):
+            dst = os.path.join(args.output, os.path.relpath(src, args.input))
+            if args.skip_existing and os.path.exists(dst):
+                continue
+            # bound the number of frames in flight so memory stays flat
+            while len(pending) >= max_inflight:
+                drain(FIRST_COMPLETED)
+            pending[pool.submit(process_file, src, dst, ops, getattr(args, 'compression', 'deflate'),
+                               getattr(args, 'preset', 'balanced'))] = src
+        while pending:
+            drain(FIRST_COMPLETED)
+    elapsed = time.perf_counter() - start
+    print(f"{done} files ({failed} failed), {megapixels:.1f} MP in {elapsed:.2f}s: "
+          f"{done / elapsed if elapsed else 0:.2f} files/s, {megapixels / elapsed if elapsed else 0:.1f} MP/s",
+          file=out, flush=True)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply an ImageProcessor op chain to a directory of TIFFs")
+    parser.add_argument("input", help="input directory, searched recursively")
+    parser.add_argument("output", help="output directory, mirrors the input tree")
+    parser.add_argument("--op", dest="ops", action="append", type=parse_op, default=[],
+                        help='operation as NAME or NAME:JSON, e.g. --op log --op \'contrast:{"auto": true}\'')
+    parser.add_argument("--recipe", help="JSON file with a list of [name, params] steps")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-inflight", type=int, default=0,
+                        help="maximum number of files queued or processing (default 2x workers)")
+    parser.add_argument("--pattern", action="append", default=None,
+                        help="file name pattern, may be repeated (default *.tif, *.tiff)")
+    parser.add_argument("--compression", choices=('none', 'deflate'), default='deflate',
+                        help="output compression, written like the viewer's save (default deflate)")
+    parser.add_argument("--preset", choices=tuple(PRESETS), default='balanced',
+                        help="deflate speed / size preset (default balanced)")
+    parser.add_argument("--skip-existing", action="store_true")
+    parser.add_argument("--cache", nargs='?', const='', default=None, metavar="DIR",
+                        help="reuse and store processed pages in the result cache shared with the viewer "
+                             "(default location unless DIR is given)")
+    args = parser.parse_args(argv)
+    args.pattern = args.pattern or ["*.tif", "*.tiff"]
+    ops = (load_recipe(args.recipe) if args.recipe else []) + args.ops
+    if not ops:
+        parser.error("no operations given, use --op or --recipe")
+    return run(args, ops)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
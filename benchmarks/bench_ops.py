@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import cv2
+
+import bin.image_processor as image_processor
+from bin import parallel
+from bin.tiff_reader import TiffStack
+from bin.tiff_writer import write_tiff
+from benchmarks.synthetic import make_image, write_synthetic
+
+
+DTYPES = {'uint8': np.uint8, 'uint16': np.uint16}
+LAYOUTS = {'gray': 1, 'rgb': 3, 'rgba': 4}
+
+
+def measure(fn, repeat):
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {'seconds': statistics.median(times), 'min': min(times), 'peak_bytes': peak}
+
+
+def op_cases(image):
+    processor = image_processor.ImageProcessor()
+    bandpass = dict(image_processor.DEFAULT_PARAMS['bandpass'])
+    contrast = {'auto': False, 'brightness': 10, 'contrast': 1.2}
+    cached = image_processor.ImageProcessor()
+    cached.apply_banpass_filter(image, bandpass)
+    return {
+        'log': lambda: processor.apply_log_transform(image),
+        'invert': lambda: processor.apply_invert(image),
+        'contrast_auto': lambda: processor.adjust_contrast(image, {'auto': True, 'brightness': 0, 'contrast': 1.0}),
+        'contrast_manual': lambda: processor.adjust_contrast(image, contrast),
+        'chain_log_contrast': lambda: processor.apply_operations(
+            image, [('log', {}), ('contrast', {'auto': True, 'brightness': 0, 'contrast': 1.0}), ('contrast', contrast)]),
+        'bandpass': lambda: image_processor.ImageProcessor().apply_banpass_filter(image, bandpass),
+        'bandpass_cached': lambda: cached.apply_banpass_filter(image, dict(bandpass, large_cutoff=bandpass['large_cutoff'] + 1)),
+    }
+
+
+def io_cases(viewer, path, image, workdir):
+    out_path = os.path.join(workdir, 'saved.tif')
+    def display():
+        viewer._display_image(image, path)
+        viewer.view.grab()
+    return {
+        'load': lambda: TiffStack(path).read_page(0).max(),
+        'load_decoded': lambda: TiffStack(path)._decode(0),
+        'save': lambda: write_tiff(out_path, [image]),
+        'save_deflate': lambda: write_tiff(out_path, [image], compression='deflate'),
+        'display': display,
+    }
+
+
+def run(args):
+    from PyQt6.QtWidgets import QApplication
+    from main import TIFFViewer
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    viewer = TIFFViewer()
+    viewer.resize(1024, 768)
+    viewer.show()
+    app.processEvents()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            for dtype_name in args.dtypes:
+                for layout in args.layouts:
+                    case = f"{layout}-{dtype_name}-{size:g}MP"
+                    image = make_image(size, LAYOUTS[layout], DTYPES[dtype_name])
+                    path = os.path.join(workdir, f"{case}.tif")
+                    write_synthetic(path, size, LAYOUTS[layout], DTYPES[dtype_name])
+                    cases = dict(op_cases(image))
+                    cases.update(io_cases(viewer, path, image, workdir))
+                    for name, fn in cases.items():
+                        if args.ops and name not in args.ops:
+                            continue
+                        result = measure(fn, args.repeat)
+                        result.update(case=case, op=name, megapixels=size, dtype=dtype_name, layout=layout)
+                        results.append(result)
+                        print(f"{case:<22} {name:<20} {result['seconds'] * 1000:9.1f} ms  "
+                              f"peak {result['peak_bytes'] / 2**20:8.1f} MiB", flush=True)
+                    app.processEvents()
+        if 'stack' in (args.ops or ['stack']):
+            path = os.path.join(workdir, 'stack.tif')
+            write_synthetic(path, args.sizes[0], 1, np.uint16, pages=args.pages)
+            def step_stack():
+                stack = TiffStack(path)
+                for index in range(len(stack)):
+                    stack.read_page(index).max()
+            result = measure(step_stack, args.repeat)
+            result.update(case=f"stack-uint16-{args.sizes[0]:g}MPx{args.pages}", op='stack_read',
+                          megapixels=args.sizes[0] * args.pages, dtype='uint16', layout='gray')
+            results.append(result)
+            print(f"{result['case']:<22} {'stack_read':<20} {result['seconds'] * 1000:9.1f} ms  "
+                  f"peak {result['peak_bytes'] / 2**20:8.1f} MiB", flush=True)
+    viewer.close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    # a result regresses when it is slower than the baseline by more than threshold
+    previous = {(r['case'], r['op']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get((result['case'], result['op']))
+        if old is None or old['seconds'] <= 0:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        if ratio > 1 + threshold:
+            regressions.append((result['case'], result['op'], old['seconds'], result['seconds'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ImageProcessor ops and load/save/display paths")
+    parser.add_argument("--sizes", type=lambda s: [float(v) for v in s.split(',')], default=[1.0, 4.0],
+                        help="comma separated megapixel sizes, e.g. 1,16,64,256")
+    parser.add_argument("--dtypes", type=lambda s: s.split(','), default=list(DTYPES))
+    parser.add_argument("--layouts", type=lambda s: s.split(','), default=list(LAYOUTS))
+    parser.add_argument("--ops", type=lambda s: s.split(','), default=None, help="only run these ops")
+    parser.add_argument("--pages", type=int, default=16, help="pages in the multi-page stack case")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None,
+                        help="threads for band-split ops (default VIT_THREADS or the core count)")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown relative to the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    parallel.set_threads(args.threads)
+    results = run(args)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'threads': parallel.threads(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for case, op, old, new, ratio in regressions:
+            print(f"REGRESSION {case} {op}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms ({ratio:.2f}x)")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from benchmarks.bench_ops import compare
+from benchmarks.synthetic import make_image
+from bin.processing_client import ProcessingClient
+
+# what a script pays per call without the server: a fresh interpreter importing the processor
+COLD_CALL = (
+    "import sys, numpy as np; sys.path.insert(0, {root!r}); import bin.image_processor as p; "
+    "from bin.processing_server import parse_operations; image = np.load({path!r}); "
+    "np.save({out!r}, p.apply_operations(image, parse_operations({ops!r})))"
+)
+
+
+def start_server(path, workers):
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--socket', path,
+                             '--workers', str(workers)], stdout=subprocess.PIPE, text=True)
+    if not proc.stdout.readline():
+        raise RuntimeError("server.py did not start")
+    return proc
+
+
+def run(args):
+    results = []
+    workdir = tempfile.mkdtemp(prefix='vit-server-')
+    socket_path = os.path.join(workdir, 'server.sock')
+    server = start_server(socket_path, args.workers)
+    try:
+        with ProcessingClient(socket_path) as client:
+            for size in args.sizes:
+                image = make_image(size, 1, np.uint16)
+                case = f"gray-uint16-{size:g}MP"
+                for op in args.ops:
+                    ops = [(op, {})]
+                    client.process(image, ops)
+                    times = []
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        client.process(image, ops)
+                        times.append(time.perf_counter() - start)
+                    results.append({'case': case, 'op': f'server_{op}', 'seconds': statistics.median(times),
+                                    'min': min(times)})
+                    if args.cold:
+                        path = os.path.join(workdir, 'frame.npy')
+                        np.save(path, image)
+                        code = COLD_CALL.format(root=ROOT, path=path, ops=ops, out=path + '.out.npy')
+                        times = []
+                        for _ in range(max(1, args.repeat // 10)):
+                            start = time.perf_counter()
+                            subprocess.run([sys.executable, '-c', code], check=True)
+                            times.append(time.perf_counter() - start)
+                        results.append({'case': case, 'op': f'cold_{op}', 'seconds': statistics.median(times),
+                                        'min': min(times)})
+            stats = client.stats()
+    finally:
+        server.terminate()
+        server.wait()
+    for result in results:
+        print(f"{result['case']:<22} {result['op']:<20} {result['seconds'] * 1000:9.2f} ms")
+    print(f"server latency p50 {stats['latency_ms']['p50']:.2f} ms, p95 {stats['latency_ms']['p95']:.2f} ms")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark per-call latency through the processing server")
+    parser.add_argument("--sizes", type=lambda s: [float(v) for v in s.split(',')], default=[0.25, 4.0])
+    parser.add_argument("--ops", type=lambda s: s.split(','), default=['contrast', 'bandpass'])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--cold", action="store_true", help="also time one fresh interpreter per call")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown relative to the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for case, op, old, new, ratio in regressions:
+            print(f"REGRESSION {case} {op}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms ({ratio:.2f}x)")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_ops import compare
+
+
+def launch(args, timeout):
+    # wall clock from spawning a fresh interpreter to each milestone main.py reports
+    env = dict(os.environ, VIT_STARTUP_REPORT='exit')
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    start = time.time()
+    proc = subprocess.run([sys.executable, os.path.join(ROOT, 'main.py')] + args, env=env, cwd=ROOT,
+                          capture_output=True, text=True, timeout=timeout)
+    milestones = {}
+    for line in proc.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 3 and parts[0] == 'startup':
+            milestones[parts[1]] = float(parts[2]) - start
+    if 'window' not in milestones:
+        raise RuntimeError(f"main.py did not report startup:\n{proc.stderr}")
+    return milestones
+
+
+def run(args):
+    results = []
+    cases = {'empty': []}
+    workdir = tempfile.mkdtemp(prefix='vit-startup-')
+    if args.megapixels:
+        import numpy as np
+        from benchmarks.synthetic import write_synthetic
+        for compression, name in ((1, 'raw'), (8, 'deflate')):
+            path = os.path.join(workdir, f'{name}.tif')
+            write_synthetic(path, args.megapixels, 1, np.uint16, compression=compression)
+            cases[f'{name}-{args.megapixels:g}MP'] = [path]
+    for case, files in cases.items():
+        # the first launch warms the OS file cache, it is not counted
+        launch(files, args.timeout)
+        runs = [launch(files, args.timeout) for _ in range(args.repeat)]
+        for milestone in ('window', 'pixels'):
+            times = [r[milestone] for r in runs if milestone in r]
+            if not times:
+                continue
+            result = {'case': case, 'op': milestone, 'seconds': statistics.median(times), 'min': min(times)}
+            results.append(result)
+            print(f"{case:<22} {milestone:<8} {result['seconds'] * 1000:8.1f} ms  (min {result['min'] * 1000:.1f} ms)")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark time-to-first-window and time-to-first-pixels")
+    parser.add_argument("--megapixels", type=float, default=16.0,
+                        help="size of the image opened from argv, 0 to only time an empty start")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown relative to the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for case, op, old, new, ratio in regressions:
+            print(f"REGRESSION {case} {op}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms ({ratio:.2f}x)")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+import numpy as np
+import cv2
+
+from bin.tiff_writer import write_pages
+
+
+def make_image(megapixels, channels=1, dtype=np.uint8, seed=0):
+    # smooth gradients plus blobs and noise, so filters and compression see structure
+    rng = np.random.default_rng(seed)
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = max(1, int(megapixels * 1e6 // width))
+    peak = np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else 1.0
+    small = rng.random((max(2, height // 64), max(2, width // 64), channels), dtype=np.float32)
+    base = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    base = base.reshape(height, width, channels)
+    base += rng.standard_normal((height, width, channels), dtype=np.float32) * 0.05
+    np.clip(base, 0, 1, out=base)
+    base *= peak
+    image = base.astype(dtype)
+    if channels == 1:
+        image = image[:, :, 0]
+    if channels == 4:
+        image[:, :, 3] = peak
+    return image
+
+
+def write_synthetic(path, megapixels, channels=1, dtype=np.uint8, pages=1, seed=0, compression=1):
+    frames = [make_image(megapixels, channels, dtype, seed + i) for i in range(pages)]
+    write_pages(path, frames, [cv2.IMWRITE_TIFF_COMPRESSION, compression])
+    return frames
@@ -0,0 +1,259 @@
+import numpy as np
+
+
+POINT, BOX, POLYGON, POLYLINE = range(4)
+KINDS = {'point': POINT, 'box': BOX, 'polygon': POLYGON, 'polyline': POLYLINE}
+_MIN_VERTICES = {POINT: 1, BOX: 2, POLYGON: 3, POLYLINE: 2}
+
+
+def _grow(array, size):
+    if size <= len(array):
+        return array
+    grown = np.empty((max(size, 2 * len(array), 64),) + array.shape[1:], array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _segment_distance(x, y, vertices):
+    a = vertices[:-1].astype(np.float64)
+    d = vertices[1:] - a
+    length = np.einsum('ij,ij->i', d, d)
+    t = ((x - a[:, 0]) * d[:, 0] + (y - a[:, 1]) * d[:, 1]) / np.where(length > 0, length, 1)
+    t = np.clip(t, 0, 1)
+    return float(np.min(np.hypot(a[:, 0] + t * d[:, 0] - x, a[:, 1] + t * d[:, 1] - y)))
+
+
+def _inside(x, y, vertices):
+    x0, y0 = vertices[:, 0], vertices[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    crosses = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        at = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return bool(np.count_nonzero(crosses & (x < at)) % 2)
+
+
+class AnnotationStore:
+    def __init__(self, cell_size=256):
+        self.cell_size = cell_size
+        self.labels = []
+        self._label_ids = {}
+        self.clear()
+
+    def clear(self):
+        # one row per annotation, vertices of all shapes packed in a single array
+        self._kind = np.empty(0, np.uint8)
+        self._label = np.empty(0, np.int32)
+        self._bbox = np.empty((0, 4), np.float32)
+        self._start = np.empty(0, np.int64)
+        self._length = np.empty(0, np.int32)
+        self._alive = np.empty(0, bool)
+        self._vertices = np.empty((0, 2), np.float32)
+        self._count = 0
+        self._vertex_count = 0
+        self._live = 0
+        self._cells = {}
+        self.removed = []
+
+    def __len__(self):
+        return self._live
+
+    @property
+    def capacity(self):
+        return self._count
+
+    def label_id(self, name):
+        if name not in self._label_ids:
+            self._label_ids[name] = len(self.labels)
+            self.labels.append(name)
+        return self._label_ids[name]
+
+    def _cell_range(self, x0, y0, x1, y1):
+        size = self.cell_size
+        return int(x0 // size), int(y0 // size), int(x1 // size), int(y1 // size)
+
+    @classmethod
+    def from_arrays(cls, kinds, labels, lengths, vertices, label_names, bbox=None, cell_size=256):
+        # bulk construction, the arrays are adopted as they are (e.g. copy-on-write memmaps)
+        store = cls(cell_size)
+        for name in label_names:
+            store.label_id(name)
+        count = len(kinds)
+        store._kind = kinds
+        store._label = labels
+        store._length = lengths
+        store._vertices = vertices
+        store._start = np.zeros(count, np.int64)
+        np.cumsum(lengths[:-1], out=store._start[1:])
+        if bbox is None:
+            bbox = np.empty((count, 4), np.float32)
+            if count:
+                bbox[:, :2] = np.minimum.reduceat(vertices, store._start)
+                bbox[:, 2:] = np.maximum.reduceat(vertices, store._start)
+        store._bbox = bbox
+        store._alive = np.ones(count, bool)
+        store._count = store._live = count
+        store._vertex_count = int(lengths.sum())
+        store._index_rows(np.arange(count))
+        return store
+
+    def _index_rows(self, rows):
+        cells = (self._bbox[rows] // self.cell_size).astype(np.int64)
+        single = (cells[:, 0] == cells[:, 2]) & (cells[:, 1] == cells[:, 3])
+        # rows inside one cell are grouped in bulk, the rest cell by cell
+        if np.any(single):
+            members = rows[single]
+            keys = (cells[single, 0] << 32) + (cells[single, 1] + (1 << 31))
+            order = np.argsort(keys)
+            keys = keys[order]
+            bounds = np.flatnonzero(np.diff(keys)) + 1
+            starts = np.concatenate(([0], bounds)).tolist()
+            ends = bounds.tolist() + [len(keys)]
+            members = members[order].tolist()
+            for key, start, end in zip(keys[starts].tolist(), starts, ends):
+                cell = (key >> 32, (key & 0xffffffff) - (1 << 31))
+                self._cells.setdefault(cell, []).extend(members[start:end])
+        for index, (cx0, cy0, cx1, cy1) in zip(rows[~single].tolist(), cells[~single].tolist()):
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    self._cells.setdefault((cx, cy), []).append(index)
+
+    def arrays(self, start=0, stop=None):
+        # column slices for rows [start, stop), vertices included
+        stop = self._count if stop is None else stop
+        first = self._start[start] if start < stop else 0
+        last = self._start[stop - 1] + self._length[stop - 1] if start < stop else 0
+        return {
+            'kind': self._kind[start:stop],
+            'label': self._label[start:stop],
+            'length': self._length[start:stop],
+            'bbox': self._bbox[start:stop],
+            'vertices': self._vertices[first:last],
+        }
+
+    def compact(self):
+        # drop removed rows, returns the old -> new id map (-1 for dropped rows)
+        alive = self._alive[:self._count]
+        remap = np.full(self._count, -1, np.int64)
+        remap[alive] = np.arange(self._live)
+        keep = np.repeat(alive, self._length[:self._count])
+        vertices = self._vertices[:self._vertex_count][keep]
+        compacted = AnnotationStore.from_arrays(
+            self._kind[:self._count][alive].copy(), self._label[:self._count][alive].copy(),
+            self._length[:self._count][alive].copy(), vertices, self.labels,
+            self._bbox[:self._count][alive].copy(), self.cell_size)
+        self.__dict__.update(compacted.__dict__)
+        self.removed = []
+        return remap
+
+    def add(self, kind, points, label=''):
+        kind = KINDS.get(kind, kind)
+        points = np.asarray(points, np.float32).reshape(-1, 2)
+        if kind not in _MIN_VERTICES or len(points) < _MIN_VERTICES[kind]:
+            raise ValueError(f"无效的标注: {kind}, {len(points)} 个顶点")
+        if kind == POINT:
+            points = points[:1]
+        elif kind == BOX:
+            points = np.array([points.min(axis=0), points.max(axis=0)], np.float32)
+        index = self._count
+        self._count += 1
+        for name in ('_kind', '_label', '_bbox', '_start', '_length', '_alive'):
+            setattr(self, name, _grow(getattr(self, name), self._count))
+        start = self._vertex_count
+        self._vertex_count += len(points)
+        self._vertices = _grow(self._vertices, self._vertex_count)
+        self._vertices[start:self._vertex_count] = points
+        self._kind[index] = kind
+        self._label[index] = self.label_id(label)
+        self._bbox[index] = (*points.min(axis=0), *points.max(axis=0))
+        self._start[index] = start
+        self._length[index] = len(points)
+        self._alive[index] = True
+        self._live += 1
+        cx0, cy0, cx1, cy1 = self._cell_range(*self._bbox[index])
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                self._cells.setdefault((cx, cy), []).append(index)
+        return index
+
+    def remove(self, ids):
+        for index in np.atleast_1d(ids):
+            index = int(index)
+            if not self._alive[index]:
+                continue
+            self._alive[index] = False
+            self._live -= 1
+            self.removed.append(index)
+            cx0, cy0, cx1, cy1 = self._cell_range(*self._bbox[index])
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    cell = self._cells[(cx, cy)]
+                    cell.remove(index)
+                    if not cell:
+                        del self._cells[(cx, cy)]
+
+    def ids(self):
+        return np.flatnonzero(self._alive[:self._count])
+
+    def kind(self, index):
+        return int(self._kind[index])
+
+    def label(self, index):
+        return self.labels[self._label[index]]
+
+    def label_ids(self, ids):
+        return self._label[ids]
+
+    def kinds(self, ids):
+        return self._kind[ids]
+
+    def bbox(self, index):
+        return self._bbox[index]
+
+    def bboxes(self, ids):
+        return self._bbox[ids]
+
+    def points(self, index):
+        start = self._start[index]
+        return self._vertices[start:start + self._length[index]]
+
+    def query(self, x0, y0, x1, y1):
+        # ids of live annotations whose bounding box intersects the rectangle
+        cx0, cy0, cx1, cy1 = self._cell_range(x0, y0, x1, y1)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) >= len(self._cells):
+            candidates = self.ids()
+        else:
+            found = [self._cells[(cx, cy)]
+                     for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1)
+                     if (cx, cy) in self._cells]
+            if not found:
+                return np.empty(0, np.int64)
+            candidates = np.unique(np.concatenate(found))
+        bbox = self._bbox[candidates]
+        hit = (bbox[:, 0] <= x1) & (bbox[:, 2] >= x0) & (bbox[:, 1] <= y1) & (bbox[:, 3] >= y0)
+        return candidates[hit]
+
+    def distance(self, index, x, y):
+        kind = self._kind[index]
+        points = self.points(index)
+        if kind == POINT:
+            return float(np.hypot(points[0, 0] - x, points[0, 1] - y))
+        if kind == BOX:
+            (left, top), (right, bottom) = points
+            points = np.array([[left, top], [right, top], [right, bottom], [left, bottom]], np.float32)
+            kind = POLYGON
+        if kind == POLYGON:
+            if _inside(x, y, points):
+                return 0.0
+            return _segment_distance(x, y, np.vstack((points, points[:1])))
+        return _segment_distance(x, y, points)
+
+    def hit_test(self, x, y, tolerance=0.0):
+        # topmost (most recently added) annotation within tolerance, -1 if none
+        best, best_distance = -1, None
+        for index in self.query(x - tolerance, y - tolerance, x + tolerance, y + tolerance)[::-1]:
+            distance = self.distance(index, x, y)
+            if distance <= tolerance and (best_distance is None or distance < best_distance):
+                best, best_distance = int(index), distance
+                if distance == 0:
+                    break
+        return best
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+
+
+def cache_root(name):
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'vector-image-tagging', name)
+
+
+def file_key(path):
+    # a changed file gets a new key, its stale entries age out through eviction
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+class DiskCache:
+    # one file per key under a size cap; reads refresh the mtime, eviction removes the
+    # least recently used entries
+    suffix = ''
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def entry(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest + self.suffix)
+
+    def touch(self, entry):
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+    def store(self, entry, write):
+        # write(tmp_path) fills a temporary file that then replaces the entry atomically
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            write(tmp)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, entry)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_bytes()
+            else:
+                self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(self.suffix):
+                    yield os.path.join(dirpath, name)
+
+    def _scan_bytes(self):
+        total = 0
+        for f in self._files():
+            try:
+                total += os.path.getsize(f)
+            except OSError:
+                continue
+        return total
+
+    def _evict(self):
+        # least recently used first; stop at 90% to leave headroom
+        entries = []
+        for f in self._files():
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, f in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(f)
+            except OSError:
+                continue
+            total -= size
+        self._bytes = total
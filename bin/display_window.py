@@ -0,0 +1,97 @@
+import numpy as np
+import cv2
+
+from bin import parallel
+from bin.histogram import image_statistics
+from bin.tracing import span
+
+
+def _color(image):
+    if image.ndim == 3 and image.shape[2] == 4:
+        return image[:, :, :3], image[:, :, 3:]
+    return image, None
+
+
+def histogram_range(image):
+    return image_statistics(image).range()
+
+
+class DisplayWindow:
+    def __init__(self, on_change=None):
+        # on_change runs whenever the range changes, so pixels rendered with the old one are dropped
+        self.low = 0.0
+        self.high = 255.0
+        self.on_change = on_change
+        self._lut = None
+        self._lut_key = None
+
+    @property
+    def range(self):
+        return self.low, self.high
+
+    def set_range(self, low, high):
+        low, high = float(low), float(high)
+        if (low, high) == (self.low, self.high):
+            return
+        self.low, self.high = low, high
+        if self.on_change is not None:
+            self.on_change()
+
+    def auto(self, image):
+        self.set_range(*histogram_range(image))
+
+    def full_range(self, image):
+        if np.issubdtype(image.dtype, np.integer):
+            self.set_range(0, np.iinfo(image.dtype).max)
+        else:
+            self.auto(image)
+
+    def is_identity(self, dtype):
+        return dtype == np.uint8 and self.low == 0 and self.high == 255
+
+    def lut(self, dtype):
+        key = (np.dtype(dtype), self.low, self.high)
+        if self._lut_key != key:
+            table = np.arange(np.iinfo(dtype).max + 1, dtype=np.float32)
+            table -= self.low
+            table *= 255.0 / max(self.high - self.low, 1e-12)
+            self._lut = np.clip(np.rint(table), 0, 255).astype(np.uint8)
+            self._lut_key = key
+        return self._lut
+
+    def apply(self, image):
+        # uint8 view of the image for display; the source data is never touched
+        if self.is_identity(image.dtype):
+            return image
+        with span('convert.window', image):
+            return self._apply(image)
+
+    def _apply(self, image):
+        lut = self.lut(image.dtype) if image.dtype in (np.uint8, np.uint16) else None
+        scale = 255.0 / max(self.high - self.low, 1e-12)
+
+        def band(src, dst):
+            # colour and alpha go straight into their channels of the output
+            color, alpha = _color(src)
+            target = dst if alpha is None else dst[:, :, :3]
+            if src.dtype == np.uint8 and alpha is None:
+                cv2.LUT(color, lut, dst=target)
+            elif src.dtype == np.uint8:
+                target[...] = cv2.LUT(color, lut)
+            elif src.dtype == np.uint16:
+                np.take(lut, color, out=target, mode='clip')
+            else:
+                values = color.astype(np.float32)
+                values -= self.low
+                values *= scale
+                target[...] = np.clip(values, 0, 255, out=values)
+            if alpha is None:
+                return
+            if alpha.dtype == np.uint16:
+                dst[:, :, 3:] = alpha >> 8
+            elif alpha.dtype != np.uint8:
+                dst[:, :, 3:] = np.clip(alpha, 0, 1) * 255
+            else:
+                dst[:, :, 3:] = alpha
+
+        return parallel.map_rows(band, image, np.empty(image.shape, np.uint8))
@@ -0,0 +1,158 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import cv2
+
+from bin import memory, parallel
+from bin.tracing import span
+
+
+def fft_size(n):
+    # leave room for a mirrored margin, then round up to a 2^a*3^b*5^c length
+    return cv2.getOptimalDFTSize(n + n // 4)
+
+
+def _mask_values(fy, fx, shape, params):
+    # ImageJ style Gaussian bandpass, fy/fx are frequencies in cycles per pixel
+    r2 = fy * fy + fx * fx
+    mask = np.ones(r2.shape, np.float32)
+    large = params['large_cutoff']
+    small = params['small_cutoff']
+    if large > 0:
+        mask -= np.exp(-r2 * (2.0 * large) ** 2)
+    if small > 0:
+        mask *= np.exp(-r2 * (2.0 * small) ** 2)
+    if params['suppress_stripes']:
+        sharpness = (100.0 - params['tolerance']) / 100.0
+        rows = fy * shape[0]
+        cols = fx * shape[1]
+        mask *= 1 - np.exp(-(cols * cols) * sharpness ** 2)
+        mask *= 1 - np.exp(-(rows * rows) * sharpness ** 2)
+    return mask
+
+
+def rfft2(image):
+    # the same passes np.fft.rfft2 makes, rows first then columns, each split into bands
+    spectrum = np.empty((image.shape[0], image.shape[1] // 2 + 1) + image.shape[2:], np.complex64)
+
+    def rows(src, out):
+        out[...] = np.fft.rfft(src, axis=1)
+
+    def columns(src, out):
+        out[...] = np.fft.fft(src, axis=0)
+
+    parallel.map_rows(rows, image, spectrum)
+    return parallel.map_columns(columns, spectrum, spectrum)
+
+
+def irfft2(spectrum, mask, shape, crop):
+    # inverse of spectrum * mask; only the rows and columns inside crop are transformed
+    # back along the last axis, straight into the output
+    product = np.empty(spectrum.shape, np.complex64)
+
+    def column_band(left, right):
+        out = product[:, left:right]
+        out[...] = np.fft.ifft(spectrum[:, left:right] * mask[:, left:right], axis=0)
+
+    parallel.for_bands(column_band, spectrum.shape[1], spectrum.nbytes)
+    rows, cols = crop
+    inner = product[rows]
+    result = np.empty((inner.shape[0], cols.stop - cols.start) + spectrum.shape[2:], np.float32)
+
+    def row_band(src, out):
+        out[...] = np.fft.irfft(src, n=shape[1], axis=1)[:, cols]
+
+    return parallel.map_rows(row_band, inner, result)
+
+
+def _mask_key(shape, params):
+    return (tuple(shape), float(params['large_cutoff']), float(params['small_cutoff']),
+            bool(params['suppress_stripes']), float(params['tolerance']))
+
+
+class BandpassFilter:
+    def __init__(self, max_masks=8):
+        self.max_masks = max_masks
+        self._source = None
+        self._spectrum = None
+        self._crop = None
+        self._shape = None
+        self._masks = OrderedDict()
+        self._lock = threading.RLock()
+        memory.register_cache(self)
+
+    def spectrum(self, image):
+        if self._source is not None and self._source() is image:
+            return self._spectrum
+        color = image[:, :, :3] if image.ndim == 3 and image.shape[2] == 4 else image
+        height, width = color.shape[:2]
+        pad_h, pad_w = fft_size(height), fft_size(width)
+        top, left = (pad_h - height) // 2, (pad_w - width) // 2
+        padded = cv2.copyMakeBorder(np.ascontiguousarray(color, dtype=np.float32),
+                                    top, pad_h - height - top, left, pad_w - width - left,
+                                    cv2.BORDER_REFLECT_101)
+        self._spectrum = None
+        with span('fft.forward', padded):
+            self._spectrum = rfft2(padded)
+        self._crop = (slice(top, top + height), slice(left, left + width))
+        self._shape = (pad_h, pad_w)
+        # weak, so the cache never keeps a frame (or the buffer under it) alive
+        self._source = weakref.ref(image)
+        return self._spectrum
+
+    def mask(self, shape, params):
+        key = _mask_key(shape, params)
+        if key in self._masks:
+            self._masks.move_to_end(key)
+            return self._masks[key]
+        fy = np.fft.fftfreq(shape[0]).astype(np.float32)[:, None]
+        fx = np.fft.rfftfreq(shape[1]).astype(np.float32)[None, :]
+        with span('fft.mask', shape=list(shape)):
+            mask = _mask_values(fy, fx, shape, params)
+        # keep the DC term so the mean intensity survives filtering
+        mask[0, 0] = 1
+        self._masks[key] = mask
+        while len(self._masks) > self.max_masks:
+            self._masks.popitem(last=False)
+        return mask
+
+    def filter(self, image, params, progress=None):
+        with self._lock:
+            spectrum = self.spectrum(image)
+            shape, crop = self._shape, self._crop
+            if progress is not None:
+                progress(0.5)
+            mask = self.mask(shape, params)
+        if spectrum.ndim == 3:
+            mask = mask[:, :, None]
+        with span('fft.inverse', spectrum):
+            return irfft2(spectrum, mask, shape, crop)
+
+    def filter_image(self, image, params, size=512):
+        shape = (fft_size(image.shape[0]), fft_size(image.shape[1]))
+        step_y = max(1, shape[0] // size)
+        step_x = max(1, shape[1] // size)
+        fy = np.fft.fftshift(np.fft.fftfreq(shape[0]))[::step_y].astype(np.float32)[:, None]
+        fx = np.fft.fftshift(np.fft.fftfreq(shape[1]))[::step_x].astype(np.float32)[None, :]
+        mask = _mask_values(fy, fx, shape, params)
+        return (np.clip(mask, 0, 1) * 255).astype(np.uint8)
+
+    def clear(self):
+        with self._lock:
+            self._source = None
+            self._spectrum = None
+            self._masks.clear()
+
+    def memory_usage(self):
+        spectrum = self._spectrum.nbytes if self._spectrum is not None else 0
+        return spectrum + sum(mask.nbytes for mask in list(self._masks.values()))
+
+    def release(self):
+        # under memory pressure; a filter that is running keeps its cache
+        if self._lock.acquire(blocking=False):
+            try:
+                self.clear()
+            finally:
+                self._lock.release()
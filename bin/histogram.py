@@ -0,0 +1,187 @@
+import threading
+import weakref
+
+import cv2
+import numpy as np
+
+from bin import parallel
+from bin.tracing import span
+
+
+FLOAT_BINS = 65536
+_MINMAX_TYPES = tuple(np.dtype(t) for t in (np.int8, np.int16, np.int32, np.float32, np.float64))
+
+
+def _color(image):
+    if image.ndim == 3 and image.shape[2] == 4:
+        return image[:, :, :3]
+    return image
+
+
+def _min_max(values):
+    if values.dtype in _MINMAX_TYPES:
+        low, high, _, _ = cv2.minMaxLoc(values)
+        return low, high
+    return float(values.min()), float(values.max())
+
+
+class ImageStatistics:
+    # one histogram per colour channel; uint8/uint16 get a bin per value, anything
+    # else FLOAT_BINS bins between the exact channel extremes
+    def __init__(self, counts, lows, highs, origins, widths, exact):
+        self.counts = counts
+        self.lows = lows
+        self.highs = highs
+        self.origins = origins
+        self.widths = widths
+        self.exact = exact
+
+    @classmethod
+    def compute(cls, image):
+        color = _color(image)
+        channels = 1 if color.ndim == 2 else color.shape[2]
+        if color.size == 0:
+            zeros = np.zeros(channels)
+            return cls(np.zeros((channels, 1), np.int64), zeros, zeros, zeros, np.ones(channels), True)
+        with span('stats.histogram', image):
+            if color.dtype in (np.uint8, np.uint16):
+                return cls._integer(color, channels)
+            return cls._binned(color, channels)
+
+    @classmethod
+    def _integer(cls, color, channels):
+        levels = np.iinfo(color.dtype).max + 1
+
+        def band(top, bottom):
+            # calcHist counts in float32, summing per band keeps large totals exact
+            rows = color[top:bottom]
+            return [cv2.calcHist([rows], [c], None, [levels], [0, levels]).ravel() for c in range(channels)]
+
+        counts = np.zeros((channels, levels), np.int64)
+        for result in parallel.for_bands(band, color.shape[0], color.nbytes):
+            counts += np.asarray(result, np.int64)
+        lows, highs = np.zeros(channels), np.zeros(channels)
+        for c in range(channels):
+            present = np.flatnonzero(counts[c])
+            lows[c], highs[c] = present[0], present[-1]
+        return cls(counts, lows, highs, np.zeros(channels), np.ones(channels), True)
+
+    @classmethod
+    def _binned(cls, color, channels):
+        counts = np.zeros((channels, FLOAT_BINS), np.int64)
+        lows, highs, widths = np.zeros(channels), np.zeros(channels), np.ones(channels)
+        for c in range(channels):
+            plane = color if channels == 1 else color[:, :, c]
+            plane = np.ascontiguousarray(plane).reshape(-1, 1)
+            extremes = parallel.for_bands(lambda top, bottom: _min_max(plane[top:bottom]), plane.shape[0], plane.nbytes)
+            low, high = min(e[0] for e in extremes), max(e[1] for e in extremes)
+            lows[c], highs[c] = low, high
+            if high > low:
+                # calcHist only bins 8/16 bit or float32 data
+                widths[c] = (high - low) / FLOAT_BINS
+                edge = float(np.nextafter(np.float32(high), np.float32(np.inf)))
+
+                def band(top, bottom):
+                    values = plane[top:bottom]
+                    if values.dtype != np.float32:
+                        values = values.astype(np.float32)
+                    return cv2.calcHist([values], [0], None, [FLOAT_BINS], [low, edge]).ravel()
+
+                for result in parallel.for_bands(band, plane.shape[0], plane.nbytes):
+                    counts[c] += result.astype(np.int64)
+            else:
+                counts[c, 0] = plane.shape[0]
+        return cls(counts, lows, highs, lows.copy(), widths, False)
+
+    @property
+    def channels(self):
+        return len(self.counts)
+
+    @property
+    def total(self):
+        return int(self.counts[0].sum())
+
+    def ranges(self):
+        return [(float(low), float(high)) for low, high in zip(self.lows, self.highs)]
+
+    def range(self):
+        return float(self.lows.min()), float(self.highs.max())
+
+    def bin_values(self, c):
+        # the value each bin stands for: exact for integers, the bin centre otherwise
+        offset = 0.0 if self.exact else 0.5
+        return self.origins[c] + (np.arange(self.counts.shape[1]) + offset) * self.widths[c]
+
+    def _pooled(self, channel):
+        if channel is not None:
+            return self.counts[channel], self.bin_values(channel)
+        if self.exact:
+            return self.counts.sum(axis=0), self.bin_values(0)
+        # channels binned over different ranges are merged by sorting their bin centres
+        values = np.concatenate([self.bin_values(c) for c in range(self.channels)])
+        order = np.argsort(values, kind='stable')
+        return self.counts.ravel()[order], values[order]
+
+    def percentile(self, q, channel=None):
+        # q in percent like np.percentile, channel None pools all colour channels
+        counts, values = self._pooled(channel)
+        cumulative = np.cumsum(counts)
+        if cumulative[-1] == 0:
+            return 0.0
+        rank = q / 100.0 * (cumulative[-1] - 1)
+        index = min(int(np.searchsorted(cumulative, rank, side='right')), len(values) - 1)
+        low, high = self.range() if channel is None else (self.lows[channel], self.highs[channel])
+        return float(min(max(values[index], low), high))
+
+    def saturated(self, fraction=0.01, channel=None):
+        # clip points leaving fraction/2 of the pixels saturated at each end
+        half = fraction * 50.0
+        return self.percentile(half, channel), self.percentile(100.0 - half, channel)
+
+    def mean(self, channel=None):
+        counts, values = self._pooled(channel)
+        total = counts.sum()
+        return float(counts @ values / total) if total else 0.0
+
+    def std(self, channel=None):
+        counts, values = self._pooled(channel)
+        total = counts.sum()
+        if not total:
+            return 0.0
+        mean = counts @ values / total
+        return float(np.sqrt(counts @ (values - mean) ** 2 / total))
+
+
+class _Cache:
+    # working images are never mutated in place, so the array object is its version
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, image):
+        key = id(image)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]() is image:
+                return entry[1]
+        stats = ImageStatistics.compute(image)
+        try:
+            ref = weakref.ref(image, lambda _, key=key: self._drop(key))
+        except TypeError:
+            return stats
+        with self._lock:
+            self._entries[key] = (ref, stats)
+        return stats
+
+    def _drop(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]() is None:
+                del self._entries[key]
+
+
+_cache = _Cache()
+
+
+def image_statistics(image):
+    return _cache.get(image)
@@ -0,0 +1,109 @@
+def _track(image, kind):
+    # bin.memory pulls in numpy, which is kept off the startup path
+    from bin import memory
+    return memory.track(image, kind)
+
+
+class OperationHistory:
+    # states are kept as memory Buffers only, so the manager can spill those not on screen
+    def __init__(self, apply_ops, checkpoint_interval=4, memory_budget=1024 * 1024 * 1024):
+        self.apply_ops = apply_ops
+        self.checkpoint_interval = checkpoint_interval
+        self.memory_budget = memory_budget
+        self.entries = []
+        # the display window each state was shown with, index 0 is the original
+        self.windows = [None]
+        self.checkpoints = {}
+        self.cursor = 0
+        self._recent = {}
+
+    def reset(self, image, window=None):
+        original = _track(image, 'original')
+        self.entries = []
+        self.windows = [window]
+        self.checkpoints = {0: original}
+        self.cursor = 0
+        self._recent = {}
+
+    @property
+    def can_undo(self):
+        return self.cursor > 0
+
+    @property
+    def can_redo(self):
+        return self.cursor < len(self.entries)
+
+    @property
+    def window(self):
+        return self.windows[self.cursor]
+
+    @window.setter
+    def window(self, window):
+        self.windows[self.cursor] = window
+
+    def push(self, name, params, result, window=None):
+        del self.entries[self.cursor:]
+        del self.windows[self.cursor + 1:]
+        self.checkpoints = {k: v for k, v in self.checkpoints.items() if k <= self.cursor}
+        self.entries.append((name, dict(params)))
+        self.windows.append(window)
+        self.cursor += 1
+        result = _track(result, 'state')
+        if self.cursor % self.checkpoint_interval == 0:
+            self.checkpoints[self.cursor] = result
+        self._recent = {self.cursor: result}
+        self._enforce_budget()
+
+    def undo(self):
+        if not self.can_undo:
+            return None
+        return self.move_to(self.cursor - 1)
+
+    def redo(self):
+        if not self.can_redo:
+            return None
+        return self.move_to(self.cursor + 1)
+
+    def move_to(self, index, image=None):
+        # keep the state being left so that the opposite step is free
+        current = self._recent.get(self.cursor)
+        if image is None:
+            image = self.state(index)
+        buffer = _track(image, 'state')
+        self._recent = {index: buffer}
+        if current is not None:
+            self._recent[self.cursor] = current
+        self.cursor = index
+        self._enforce_budget()
+        return buffer.array
+
+    def state(self, index):
+        if index in self._recent:
+            return self._recent[index].array
+        base = max(k for k in self.checkpoints if k <= index)
+        image = self.checkpoints[base].array
+        pending = []
+        # replay in runs between resets so the processor can fuse them
+        for name, params in self.entries[base:index]:
+            if name == 'reset':
+                image, pending = self.checkpoints[0].array, []
+            else:
+                pending.append((name, params))
+        if pending:
+            image = self.apply_ops(image, pending)
+        return image
+
+    def memory_usage(self):
+        # spilled states live on disk and do not count
+        buffers = {id(b): b for k, b in self.checkpoints.items() if k > 0}
+        buffers.update({id(b): b for b in self._recent.values()})
+        buffers.pop(id(self.checkpoints.get(0)), None)
+        return sum(b.nbytes for b in buffers.values() if b.resident)
+
+    def _enforce_budget(self):
+        # drop the checkpoints furthest from the cursor, the original is always kept
+        while self.memory_usage() > self.memory_budget:
+            candidates = [k for k in self.checkpoints if k > 0]
+            if not candidates:
+                break
+            del self.checkpoints[max(candidates, key=lambda k: abs(k - self.cursor))]
@@ -0,0 +1,77 @@
+import numpy as np
+from PyQt6 import sip
+from PyQt6.QtGui import QImage, QPixmap
+
+from bin.tracing import span
+
+
+# what reaches the bridge is 8 bits per channel RGB(A) or grey, see to_display
+_FORMATS = {
+    1: QImage.Format.Format_Grayscale8,
+    3: QImage.Format.Format_RGB888,
+    4: QImage.Format.Format_RGBA8888,
+}
+
+
+def _rows_are_packed(array):
+    # pixels and channels must be contiguous within a row, rows may be padded
+    itemsize = array.itemsize
+    if array.ndim == 3 and array.strides[2] != itemsize:
+        return False
+    pixel = itemsize * (array.shape[2] if array.ndim == 3 else 1)
+    return array.strides[1] == pixel and array.strides[0] >= pixel * array.shape[1]
+
+
+class ImageBuffer:
+    def __init__(self, array):
+        if array.ndim not in (2, 3):
+            raise ValueError(f"不支持的图像维度: {array.ndim}")
+        self.array = array
+        self._qimage = None
+
+    @property
+    def channels(self):
+        return 1 if self.array.ndim == 2 else self.array.shape[2]
+
+    @property
+    def format(self):
+        if self.array.dtype != np.uint8:
+            return None
+        return _FORMATS.get(self.channels)
+
+    def qimage(self):
+        # a view over the array memory, valid for as long as this buffer or the QImage lives
+        if self._qimage is not None:
+            return self._qimage
+        if self.format is None:
+            raise ValueError(f"不支持的图像格式: {self.array.dtype} x{self.channels}")
+        if not _rows_are_packed(self.array):
+            self.array = np.ascontiguousarray(self.array)
+        height, width = self.array.shape[:2]
+        address = self.array.__array_interface__['data'][0]
+        size = self.array.strides[0] * (height - 1) + width * self.array.itemsize * self.channels
+        qimage = QImage(sip.voidptr(address, size), width, height, self.array.strides[0], self.format)
+        qimage._buffer = self
+        self._qimage = qimage
+        return qimage
+
+    def pixmap(self):
+        with span('convert.pixmap', self.array):
+            return QPixmap.fromImage(self.qimage())
+
+
+def to_display(image):
+    # collapse anything Qt cannot show directly to 8 bits per channel
+    if image.dtype == np.uint8:
+        return image
+    if image.dtype == np.uint16:
+        return (image >> 8).astype(np.uint8)
+    return (np.clip(image, 0, 1) * 255).astype(np.uint8)
+
+
+def array_to_qimage(image):
+    return ImageBuffer(to_display(image)).qimage()
+
+
+def array_to_pixmap(image):
+    return ImageBuffer(to_display(image)).pixmap()
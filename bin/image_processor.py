@@ -1,172 +1,370 @@
 import numpy as np
-from PyQt6.QtGui import QImage, QPixmap
-from PyQt6.QtWidgets import QMessageBox
 import cv2
 
+from bin import memory, parallel
+from bin.fft_filter import BandpassFilter
+from bin.histogram import ImageStatistics, image_statistics
+from bin.tracing import span
+
+
+def _split_alpha(image):
+    if image.ndim == 3 and image.shape[2] == 4:
+        return image[:, :, :3], image[:, :, 3:]
+    return image, None
+
+
+def _merge_alpha(color, alpha):
+    if alpha is None:
+        return color
+    return np.concatenate((color, alpha), axis=2)
+
+
+def _peak(dtype, max_val=1.0):
+    if np.issubdtype(dtype, np.integer):
+        return float(np.iinfo(dtype).max)
+    return float(max_val)
+
+
+def _clip_bounds(info, dtype):
+    # for 32-bit integers the nearest float to min/max can lie outside the range and
+    # would wrap on the cast, step it back inside
+    low, high = np.array(info.min, dtype), np.array(info.max, dtype)
+    if float(low) < info.min:
+        low = np.nextafter(low, dtype.type(0))
+    if float(high) > info.max:
+        high = np.nextafter(high, dtype.type(0))
+    return low, high
+
+
+def _to_dtype(values, dtype):
+    if values.dtype == dtype:
+        return values
+    if not np.issubdtype(dtype, np.integer):
+        return values.astype(dtype)
+    low, high = _clip_bounds(np.iinfo(dtype), values.dtype)
+
+    def convert(src, out):
+        np.rint(src, out=src)
+        np.clip(src, low, high, out=src)
+        out[...] = src
+
+    return parallel.map_rows(convert, values, np.empty(values.shape, dtype))
+
+
+def _working(values):
+    # float32 cannot hold every 32-bit integer
+    if values.dtype.kind in 'iu' and values.dtype.itemsize >= 4:
+        return values.astype(np.float64)
+    return values.astype(np.float32)
+
+
+def _log_values(values, max_val, peak):
+    result = _working(values)
+    np.maximum(result, 0, out=result)
+    np.log1p(result, out=result)
+    result *= peak / np.log1p(max_val)
+    return result
+
+
+def _auto_contrast_mono(values, min_val, max_val, peak):
+    result = _working(values)
+    if max_val > min_val:
+        result -= min_val
+        result *= peak / (max_val - min_val)
+    return result
+
+
+def _manual_contrast_mono(values, brightness, contrast, peak):
+    # brightness is a percentage of full scale, contrast pivots on mid-grey
+    mid = (peak + 1) / 2 if peak > 1 else peak / 2
+    result = _working(values)
+    result -= mid
+    result *= contrast
+    result += mid + brightness / 100.0 * peak
+    return result
+
+
+def contrast_window(image, params):
+    # input values the contrast stage maps to black and white, for the dialog's histogram
+    stats = image_statistics(image)
+    low, high = stats.range()
+    if params['auto']:
+        return low, high
+    peak = _peak(image.dtype, high)
+    mid = (peak + 1) / 2 if peak > 1 else peak / 2
+    contrast = max(params['contrast'], 1e-6)
+    offset = mid + params['brightness'] / 100.0 * peak
+    return mid - offset / contrast, mid + (peak - offset) / contrast
+
+
+def _invert_values(values, peak):
+    result = _working(values)
+    np.subtract(peak, result, out=result)
+    return result
+
+
+def _channels(color):
+    if color.ndim == 2:
+        return [color]
+    return [color[:, :, c] for c in range(color.shape[2])]
+
+
+def channel_ranges(image):
+    return image_statistics(image).ranges()
+
+
+def _contrast_mono(values, params, value_range, peak):
+    if params['auto']:
+        return _auto_contrast_mono(values, value_range[0], value_range[1], peak)
+    return _manual_contrast_mono(values, params['brightness'], params['contrast'], peak)
+
+
+def _pointwise_stage(values, name, params, ranges, dtype):
+    # values holds one array per colour channel, ranges their current (min, max)
+    peak = _peak(dtype, max(r[1] for r in ranges))
+    if name == 'log':
+        max_val = max(r[1] for r in ranges)
+        if max_val <= 0:
+            return values
+        return [_to_dtype(_log_values(v, max_val, peak), dtype) for v in values]
+    if name == 'contrast':
+        return [_to_dtype(_contrast_mono(v, params, r, peak), dtype) for v, r in zip(values, ranges)]
+    if name == 'invert':
+        return [_to_dtype(_invert_values(v, peak), dtype) for v in values]
+    raise ValueError(f"not a pointwise operation: {name}")
+
+
+# a table entry per value is only small (and starts at 0) for unsigned 8/16-bit images,
+# anything else takes the float band path
+LUT_TYPES = (np.dtype(np.uint8), np.dtype(np.uint16))
+
+
+def compile_pointwise(operations, dtype, ranges):
+    # every stage is monotone, so the extremes of a channel stay at the images' own
+    # min/max entries and each stage sees the same statistics as unfused execution
+    table = np.arange(np.iinfo(dtype).max + 1, dtype=dtype)
+    values = [table] * len(ranges)
+    ends = [(int(r[0]), int(r[1])) for r in ranges]
+    current = ranges
+    for name, params in operations:
+        values = _pointwise_stage(values, name, params, current, dtype)
+        current = [tuple(sorted((float(v[lo]), float(v[hi])))) for v, (lo, hi) in zip(values, ends)]
+    return np.stack(values, axis=1)
+
+
+def _lut_band(src, out, lut):
+    color, alpha = _split_alpha(src)
+    if alpha is not None:
+        out[:, :, 3:] = alpha
+    if color.dtype == np.uint8:
+        table = np.ascontiguousarray(lut.reshape(1, -1, lut.shape[1]))
+        if alpha is None:
+            cv2.LUT(color, table, dst=out)
+        else:
+            out[:, :, :3] = cv2.LUT(color, table)
+    elif color.ndim == 2:
+        np.take(lut[:, 0], color, out=out, mode='clip')
+    else:
+        for c, channel in enumerate(_channels(color)):
+            np.take(lut[:, c], channel, out=out[:, :, c], mode='clip')
+
+
+def apply_lut(image, lut):
+    # row bands in parallel, alpha is copied into the same preallocated output
+    out = np.empty(image.shape, lut.dtype)
+    return parallel.map_rows(lambda src, dst: _lut_band(src, dst, lut), image, out)
+
+
+def apply_pointwise(image, operations, ranges=None):
+    color, alpha = _split_alpha(image)
+    if color.size == 0 or not operations:
+        return image
+    if ranges is None:
+        ranges = channel_ranges(image)
+    if image.dtype in LUT_TYPES:
+        return apply_lut(image, compile_pointwise(operations, image.dtype, ranges))
+    result = np.empty(image.shape, image.dtype)
+    if alpha is not None:
+        result[:, :, 3:] = alpha
+    values = _channels(color)
+    for index, (name, params) in enumerate(operations):
+        # every stage sees the whole image's ranges, so bands match an unsplit pass
+        last = index == len(operations) - 1
+        out = _channels(result[:, :, :3] if alpha is not None else result) if last else \
+            [np.empty(v.shape, image.dtype) for v in values]
+
+        def stage(top, bottom, values=values, out=out, name=name, params=params, ranges=ranges):
+            for o, r in zip(out, _pointwise_stage([v[top:bottom] for v in values], name, params, ranges, image.dtype)):
+                o[top:bottom] = r
+
+        parallel.for_bands(stage, color.shape[0], color.nbytes)
+        values = out
+        if not last:
+            ranges = [(float(np.min(v)), float(np.max(v))) for v in values]
+    return result
+
+
+def log_transform(image):
+    return apply_pointwise(image, [('log', {})])
+
+
+def adjust_contrast(image, params, ranges=None):
+    return apply_pointwise(image, [('contrast', params)], ranges)
+
+
+def invert(image):
+    return apply_pointwise(image, [('invert', {})])
+
+
+def banpass_filter(image, params, bandpass=None, progress=None):
+    bandpass = bandpass or BandpassFilter()
+    color, alpha = _split_alpha(image)
+    if color.size == 0:
+        return image
+    filtered = bandpass.filter(image, params, progress)
+    if progress is not None:
+        progress(0.9)
+    peak = _peak(image.dtype, image_statistics(image).range()[1])
+    if params['autoscale']:
+        # filtered is rescaled in place below, so its statistics are not cached
+        stats = ImageStatistics.compute(filtered)
+        min_val, max_val = stats.saturated(0.01) if params['saturate'] else stats.range()
+        if max_val > min_val:
+            factor = peak / (max_val - min_val)
+
+            def rescale(src, out):
+                src -= min_val
+                src *= factor
+
+            parallel.map_rows(rescale, filtered, filtered)
+    elif not np.issubdtype(image.dtype, np.integer):
+        parallel.map_rows(lambda src, out: np.clip(src, 0, peak, out=out), filtered, filtered)
+    return _merge_alpha(_to_dtype(filtered, image.dtype), alpha)
+
+
+DEFAULT_PARAMS = {
+    'log': {},
+    'invert': {},
+    'contrast': {'auto': True, 'brightness': 0, 'contrast': 1.0},
+    'bandpass': {'large_cutoff': 40.0, 'small_cutoff': 3.0, 'suppress_stripes': False,
+                 'tolerance': 15.0, 'autoscale': True, 'saturate': False, 'display_filter': False},
+}
+
+
+OPERATIONS = {
+    'log': lambda image, params: log_transform(image),
+    'invert': lambda image, params: invert(image),
+    'contrast': adjust_contrast,
+    'bandpass': banpass_filter,
+}
+
+
+POINTWISE = {'log', 'invert', 'contrast'}
+
+# parameters that only change what is shown next to the result, not the result
+DISPLAY_PARAMS = {'bandpass': ('display_filter',)}
+
+
+def canonical_operations(operations):
+    # defaults filled in and display-only keys dropped, so equal chains compare equal
+    chain = []
+    for name, params in operations:
+        if name == 'reset':
+            chain = []
+            continue
+        params = dict(DEFAULT_PARAMS.get(name, {}), **params)
+        for key in DISPLAY_PARAMS.get(name, ()):
+            params.pop(key, None)
+        chain.append([name, {key: params[key] for key in sorted(params)}])
+    return chain
+
+
+# parameters measured in pixels, they shrink with a downsampled preview
+SPATIAL_PARAMS = {'bandpass': ('large_cutoff', 'small_cutoff')}
+
+
+def scale_operations(operations, scale):
+    scaled = []
+    for name, params in operations:
+        if name in SPATIAL_PARAMS and scale != 1:
+            params = dict(params)
+            for key in SPATIAL_PARAMS[name]:
+                params[key] = params[key] / scale
+        scaled.append((name, params))
+    return scaled
+
+
+def operations_halo(operations):
+    # full resolution pixels of context a neighbourhood op needs beyond a crop's edge
+    return max((2.0 * params['large_cutoff'] for name, params in operations if name == 'bandpass'), default=0.0)
+
+
+def apply_operations(image, operations, bandpass=None, progress=None):
+    # consecutive pointwise ops are fused into a single lookup table pass
+    operations = list(operations)
+    i = 0
+    while i < len(operations):
+        if progress is not None:
+            progress(i / len(operations))
+        name, params = operations[i]
+        if name in POINTWISE:
+            j = i
+            while j < len(operations) and operations[j][0] in POINTWISE:
+                j += 1
+            with span('process.pointwise', image, ops=[op[0] for op in operations[i:j]]):
+                image = apply_pointwise(image, operations[i:j])
+            i = j
+            continue
+        if name == 'bandpass':
+            step = None
+            if progress is not None:
+                step = lambda value, i=i: progress((i + value) / len(operations))
+            with span('process.bandpass', image):
+                image = banpass_filter(image, params, bandpass, step)
+        else:
+            with span(f'process.{name}', image):
+                image = OPERATIONS[name](image, params)
+        i += 1
+    return image
+
 
 class ImageProcessor:
     def __init__(self):
-        self.original_pixmap = None
-    
-    def set_orginal_image(self, pixmap):
-        self.original_pixmap = pixmap.copy() if pixmap else None
-    
-    def apply_log_transform(self, pixmap):
-        if pixmap is None:
+        self.original_image = None
+        self.bandpass = BandpassFilter()
+        #Previews get their own spectrum cache so the full image's survives
+        self.preview_bandpass = BandpassFilter()
+
+    def set_orginal_image(self, image):
+        #Tracked, so it can be spilled while other states are on screen
+        self.original_image = memory.track(image, 'original')
+
+    def apply_log_transform(self, image):
+        if image is None:
             return None
-        image = pixmap.toImage()
-        width, height, format = image.width(), image.height(), image.format()
-        if format in(QImage.Format.Format_RGB32, QImage.Format.Format_ARGB32):
-            return self._rgb_log(image, width, height)
-        elif format == QImage.Format.Format_Grayscale8:
-            return self._grayscale_log(image, width, height)
-        else:
-            image = image.convertToFormat(QImage.Format.Format_RGB32)
-            return self._rgb_log(image, width, height)
-    
-    def _rgb_log(self, img, width, height):
-        print("Performing Log On RGB ")
-        if isinstance(img, QPixmap):
-            img = img.toImage()
-        if img.format() not in (QImage.Format.Format_RGB32, QImage.Format.Format_RGBA8888):
-            img = img.convertToFormat(QImage.Format.Format_RGB32)
-        ptr = img.bits()
-        ptr.setsize(img.sizeInBytes())
-        if img.format() == QImage.Format.Format_RGBA8888:
-            arr = np.frombuffer(ptr, np.uint8).reshape((height, width, 4))
-            channels = 4
-        else:
-            arr  = np.frombuffer(ptr, np.uint8).reshape((height, width, 4))[:, :, :3]
-            channels =3
-        if arr.size ==0:
-            return QPixmap.fromImage(img)
-        
-        max_val = np.max(arr)
-        
-        if max_val <=0:
-            return QPixmap.fromImage(img)
-        try:
-            log_max = np.log1p(max_val)
-            c = 255.0/log_max
-            result = np.zeros((height, width, 3), dtype=np.uint8)
-            for i in range(3):
-                channel = arr[:,:,i].astype(np.float32)
-                log_channel = np.log1p(channel)
-                result[:,:,i] = np.clip(c*log_channel, 0, 255)
-            bytes_per_line = 3*width
-            processed = QImage(result.data, width, height, bytes_per_line, QImage.Format.Format_RGB888)
-            return QPixmap.fromImage(processed)
-        except Exception as e:
-            print("Error")
-     
-    def _grayscale_log(self, img, width, height):
-        ptr = img.bits()
-        ptr.setsize(img.sizeInBytes())
-        arr = np.frombuffer(ptr, np.uint8).reshape((height, width))
-        max_val = np.max(arr)
-        
-        c = 255/np.log(1+max_val)
-        result = np.clip(c*np.log(1+arr),0,255).astype(np.uint8)
-        
-        processed = QImage(result.date, width, height, img.bytesPerLine(), QImage.Format.Format_Grayscale8)
-        return QPixmap.fromImage(processed)
-    
-    def apply_banpass_filter(self, pixmap, params):
-        qimage = pixmap.toImage()
-        qimage = qimage.convertToFormat(QImage.Format.Format_Grayscale8)
-        
-        ptr=qimage.bits()
-        ptr.setsize(qimage.sizeInBytes())
-        arr = np.frombuffer(ptr, np.uint8).reshape((qimage.height(), qimage.width()))
-        blurred = cv2.GaussianBlur(arr, (5, 5), 0)
-        img_filtered = cv2.addWeighted(arr, 1.5, blurred, -0.5, 0)
-        fft = np.fft.fft2(arr.astype(np.float32))
-        fft_shift = np.fft.fftshift(fft)
-        
-        rows, cols = arr.shape
-        crow,ccol = rows//2, cols//2
-        """
-        mask = np.ones((rows, cols), np.float32)
-        
-        if params['large_cutoff']>0:
-            radius = min(params['large_cutoff'], min(rows, cols)//2)
-            y,x = np.ogrid[:rows, :cols]
-            mask_area = (x-ccol)**2 + (y-crow)**2 <= radius **2
-            mask[mask_area] = 0
-            
-        if params['small_cutoff']>0:
-            radius = min(params['small_cutoff'], min(rows, cols)//2)
-            y,x = np.ogrid[:rows, :cols]
-            mask_area = (x -ccol)**2+(y-crow) ** 2<= radius ** 2
-            mask[mask_area] = 0
-            
-                # Add debug logging
-        print(f"Bandpass filter: large={params['large_cutoff']}, small={params['small_cutoff']}")
-        print(f"FFT min: {np.min(np.abs(fft_shift))}, max: {np.max(np.abs(fft_shift))}")
-        
-        fft_filtered = fft_shift*mask
-        
-        ifft_shift = np.fft.ifftshift(fft_filtered)
-        img_filtered = np.fft.ifft2(ifft_shift)
-        img_filtered = np.abs(img_filtered) 
-        
-        if params['autoscale']:
-            min_val = np.min(img_filtered)
-            max_val = np.max(img_filtered)
-            if max_val>min_val:
-                img_filtered = 255*(img_filtered-min_val)/(max_val-min_val)
-                if params['saturate']:
-                    img_filtered = np.clip(img_filtered,0,255)"""
-        img_filtered=img_filtered.astype(np.uint8)
-        processed = QImage(img_filtered.data, cols, rows, cols, QImage.Format.Format_Grayscale8)
-        return QPixmap.fromImage(processed)
-
-    def adjust_contrast(self, pixmap, params):
-        qimage = pixmap.toImage()
-        
-        ptr = qimage.bits()
-        ptr.setsize(qimage.sizeInBytes())
-
-        if qimage.format() == QImage.Format.Format_Grayscale8:
-            arr = np.frombuffer(ptr, np.uint8).reshape((qimage.height(), qimage.width()))
-            channels = 1
-        else:
-            arr = np.frombuffer(ptr, np.uint8).reshape((qimage.height(), qimage.width(), 4))
-            channels =3
-        if params['auto']:
-            if channels == 1:
-                arr = self._auto_contrast_mono(arr)
-            else:
-                for c in range(channels):
-                    arr[:,:,c]  = self._auto_contrast_mono(arr[:,:,c])
-        else:
-            brightness = params['brightness']
-            contrast = params['contrast']
-            if channels == 1:
-                arr = self._manual_contrast_mono(arr, brightness, contrast)
-            else:
-                for c in range(channels):
-                    arr[:,:,c] = self._manual_contrast_mono(arr[:,:,c], brightness, contrast)
-        
-        if channels == 1:
-            processd = QImage(arr.data, qimage.width(), qimage.height(), qimage.bytesPerLine(), QImage.Format.Format_Grayscale8)
-        else:
-            processd = QImage(arr.data, qimage.width(), qimage.height(), qimage.bytesPerLine(), QImage.Format.Format_RGBA8888)
-        
-        return QPixmap.fromImage(processd)
-    
-    def _auto_contrast_mono(self, arr):
-        min_val = np.min(arr)
-        max_val = np.max(arr) 
-        if max_val > min_val:
-            return np.clip((arr-min_val)/(max_val-min_val)*255, 0, 255).astype(np.uint8)
-        return arr
-    
-    def _manual_contrast_mono(self, arr, b, c):
-        arr = arr.astype(np.float32)
-        arr = (arr-128)*c + 128
-        arr = arr * b
-        return np.clip(arr, 0, 255).astype(np.uint8)    
-            
+        return log_transform(image)
+
+    def apply_invert(self, image):
+        return invert(image)
+
+    def apply_banpass_filter(self, image, params, progress=None):
+        return banpass_filter(image, params, self.bandpass, progress)
+
+    def bandpass_filter_image(self, image, params):
+        return self.bandpass.filter_image(image, params)
+
+    def adjust_contrast(self, image, params, ranges=None):
+        return adjust_contrast(image, params, ranges)
+
+    def apply_operations(self, image, operations, progress=None):
+        return apply_operations(image, operations, self.bandpass, progress)
+
+    def preview(self, proxy, operations, ranges=None):
+        #ranges are the full image's, so auto contrast matches the final result
+        operations = scale_operations(operations, proxy.scale)
+        if ranges is not None and all(name in POINTWISE for name, _ in operations):
+            return proxy.inner(apply_pointwise(proxy.image, operations, ranges))
+        return proxy.inner(apply_operations(proxy.image, operations, self.preview_bandpass))
+
     def reset_image(self):
-        return self.original_pixmap.copy() if self.original_pixmap else None
\ No newline at end of file
+        return self.original_image.array if self.original_image is not None else None
@@ -0,0 +1,173 @@
+import threading
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, target, generation, signals):
+        self.target = target
+        self.generation = generation
+        self._signals = signals
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def set_progress(self, value):
+        # also a cancellation point for long running work
+        self.check()
+        self._signals.progress.emit(self.target, self.generation, int(value * 100))
+
+    def publish(self, value):
+        # hands an intermediate result (e.g. a preview) to the GUI thread before the job ends
+        self.check()
+        self._signals.partial.emit(self.target, self.generation, value)
+
+
+class _Signals(QObject):
+    progress = pyqtSignal(str, int, int)
+    partial = pyqtSignal(str, int, object)
+    finished = pyqtSignal(str, int, object)
+    failed = pyqtSignal(str, int, str)
+    cancelled = pyqtSignal(str, int)
+
+
+class _Task(QRunnable):
+    def __init__(self, fn, job, signals):
+        super().__init__()
+        self.fn = fn
+        self.job = job
+        self.signals = signals
+
+    def run(self):
+        job = self.job
+        try:
+            job.check()
+            result = self.fn(job)
+            job.check()
+        except JobCancelled:
+            self.signals.cancelled.emit(job.target, job.generation)
+        except Exception as e:
+            self.signals.failed.emit(job.target, job.generation, str(e))
+        else:
+            self.signals.finished.emit(job.target, job.generation, result)
+
+
+class JobRunner(QObject):
+    progress = pyqtSignal(str, int)
+    failed = pyqtSignal(str, str)
+    busy_changed = pyqtSignal(bool)
+
+    def __init__(self, parent=None, max_threads=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        if max_threads:
+            self.pool.setMaxThreadCount(max_threads)
+        self._signals = _Signals(self)
+        self._signals.progress.connect(self._on_progress)
+        self._signals.partial.connect(self._on_partial)
+        self._signals.finished.connect(self._on_finished)
+        self._signals.failed.connect(self._on_failed)
+        self._signals.cancelled.connect(self._on_cancelled)
+        self._generation = 0
+        self._jobs = {}
+        self._callbacks = {}
+        self._partials = {}
+        self._abandoned = {}
+
+    def submit(self, target, fn, on_finished=None, on_partial=None, on_abandoned=None):
+        # a newer request for the same target supersedes the running one; on_abandoned runs
+        # when a job ends without delivering its result (failed, cancelled or superseded)
+        previous = self._jobs.get(target)
+        if previous is not None:
+            previous.cancel()
+            self._abandon(target)
+        was_busy = self.is_busy()
+        self._generation += 1
+        job = Job(target, self._generation, self._signals)
+        self._jobs[target] = job
+        self._callbacks[target] = on_finished
+        self._partials[target] = on_partial
+        self._abandoned[target] = on_abandoned
+        self.pool.start(_Task(fn, job, self._signals))
+        if not was_busy:
+            self.busy_changed.emit(True)
+        return job
+
+    def cancel(self, target=None):
+        targets = [target] if target is not None else list(self._jobs)
+        for name in targets:
+            job = self._jobs.pop(name, None)
+            self._callbacks.pop(name, None)
+            self._partials.pop(name, None)
+            if job is not None:
+                job.cancel()
+                self._abandon(name)
+        if not self._jobs:
+            self.busy_changed.emit(False)
+
+    def is_busy(self, target=None):
+        if target is None:
+            return bool(self._jobs)
+        return target in self._jobs
+
+    def _abandon(self, target):
+        callback = self._abandoned.pop(target, None)
+        if callback is not None:
+            callback()
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
+
+    def _is_current(self, target, generation):
+        job = self._jobs.get(target)
+        return job is not None and job.generation == generation
+
+    def _done(self, target):
+        self._jobs.pop(target, None)
+        callback = self._callbacks.pop(target, None)
+        self._partials.pop(target, None)
+        if not self._jobs:
+            self.busy_changed.emit(False)
+        return callback
+
+    def _on_progress(self, target, generation, value):
+        if self._is_current(target, generation):
+            self.progress.emit(target, value)
+
+    def _on_partial(self, target, generation, value):
+        if self._is_current(target, generation):
+            callback = self._partials.get(target)
+            if callback is not None:
+                callback(value)
+
+    def _on_finished(self, target, generation, result):
+        if not self._is_current(target, generation):
+            return
+        self._abandoned.pop(target, None)
+        callback = self._done(target)
+        if callback is not None:
+            callback(result)
+
+    def _on_failed(self, target, generation, message):
+        if self._is_current(target, generation):
+            self._done(target)
+            self._abandon(target)
+            self.failed.emit(target, message)
+
+    def _on_cancelled(self, target, generation):
+        if self._is_current(target, generation):
+            self._done(target)
+            self._abandon(target)
@@ -0,0 +1,254 @@
+import hashlib
+import itertools
+import mmap
+import os
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bin.disk_cache import cache_root
+from bin.tracing import span
+
+
+_lock = threading.Lock()
+_manager = None
+_clock = itertools.count()
+
+
+def default_budget():
+    # VIT_MEMORY_MB, otherwise half of the physical memory
+    value = os.environ.get('VIT_MEMORY_MB')
+    if value:
+        return int(float(value) * 1024 * 1024)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (AttributeError, ValueError, OSError):
+        return 4 << 30
+
+
+def default_spill_dir():
+    # not the temp dir, which is often a tmpfs and so memory itself
+    return os.environ.get('VIT_SPILL_DIR') or cache_root('spill')
+
+
+def file_backed(array):
+    # a mapped file costs page cache the kernel can drop, not process memory
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        if isinstance(array, memoryview):
+            array = array.obj
+        else:
+            array = getattr(array, 'base', None)
+    return False
+
+
+def _layout(array):
+    # views of one buffer only match when they cover the same memory the same way
+    return (array.__array_interface__['data'][0], array.shape, array.strides, array.dtype.str)
+
+
+def fingerprint(array):
+    # about 64x64 samples, enough to tell frames apart before comparing them in full
+    sample = array[::max(1, array.shape[0] // 64)]
+    if array.ndim > 1:
+        sample = sample[:, ::max(1, array.shape[1] // 64)]
+    digest = hashlib.blake2b(np.ascontiguousarray(sample).tobytes(), digest_size=16).digest()
+    return array.shape, array.dtype.str, digest
+
+
+class Buffer:
+    # one tracked image. Holders keep only the Buffer and read .array when they need the
+    # pixels: a spill or a deduplicated copy frees memory only once no holder has the
+    # ndarray itself. .array is the array, or after a spill a read-only map of it whose
+    # pages come back on demand
+    def __init__(self, array, kind, stamp):
+        self._array = array
+        self.kind = kind
+        self.fingerprint = stamp
+        self.nbytes = array.nbytes
+        self.pins = 0
+        self.used = next(_clock)
+        self.spilling = False
+
+    @property
+    def array(self):
+        self.used = next(_clock)
+        return self._array
+
+    @property
+    def resident(self):
+        return not file_backed(self._array)
+
+    def pin(self):
+        self.pins += 1
+
+    def unpin(self):
+        self.pins -= 1
+        if self.pins <= 0:
+            self.pins = 0
+            manager().enforce()
+
+
+class MemoryManager:
+    # every large frame is tracked once; identical copies share a Buffer and, while the
+    # process is over budget, unpinned buffers are spilled least recently used first and
+    # rebuildable caches are released
+    def __init__(self, budget=None, spill_dir=None):
+        self.budget = budget or default_budget()
+        self.spill_dir = spill_dir or default_spill_dir()
+        self.shared_bytes = 0
+        self._buffers = {}
+        self._caches = weakref.WeakSet()
+        self._lock = threading.RLock()
+        self._writer = None
+
+    def buffers(self):
+        with self._lock:
+            buffers = [ref() for ref in self._buffers.values()]
+        return [b for b in buffers if b is not None]
+
+    def _forget(self, key, ref):
+        with self._lock:
+            if self._buffers.get(key) is ref:
+                del self._buffers[key]
+
+    def _register(self, buffer):
+        key = _layout(buffer._array)
+        self._buffers[key] = weakref.ref(buffer, lambda ref, key=key: self._forget(key, ref))
+
+    def track(self, array, kind='image', pin=False):
+        # Tracking freezes the array: its writeable flag is cleared, so a write raises
+        # instead of changing the pixels every holder of the Buffer sees (copy-on-write,
+        # pass a copy to keep a writable one). The Buffer returned may be an existing one
+        # holding the same pixels, the caller should then drop its own array. A Buffer is
+        # returned as it is. pin=True pins it before the budget is checked, so a frame
+        # going on screen is never picked for spilling on the way in.
+        if array is None:
+            return None
+        with self._lock:
+            buffer = array if isinstance(array, Buffer) else self._find(array)
+            if buffer is None:
+                array.flags.writeable = False
+                buffer = Buffer(array, kind, fingerprint(array))
+                self._register(buffer)
+            if pin:
+                buffer.pin()
+        self.enforce()
+        return buffer
+
+    def _find(self, array):
+        ref = self._buffers.get(_layout(array))
+        buffer = ref() if ref is not None else None
+        if buffer is not None:
+            return buffer
+        stamp = fingerprint(array)
+        for other in self.buffers():
+            if other.fingerprint == stamp and np.array_equal(other._array, array):
+                self.shared_bytes += array.nbytes
+                return other
+        return None
+
+    def register_cache(self, cache):
+        # cache.memory_usage() and cache.release() for data that can be rebuilt
+        self._caches.add(cache)
+
+    def usage(self):
+        resident = spilled = 0
+        for buffer in self.buffers():
+            if buffer.resident:
+                resident += buffer.nbytes
+            else:
+                spilled += buffer.nbytes
+        caches = sum(cache.memory_usage() for cache in list(self._caches))
+        return {
+            'resident': resident,
+            'caches': caches,
+            'spilled': spilled,
+            'shared': self.shared_bytes,
+            'budget': self.budget,
+        }
+
+    def enforce(self):
+        with self._lock:
+            buffers = self.buffers()
+            caches = list(self._caches)
+            over = sum(b.nbytes for b in buffers if b.resident and not b.spilling) - self.budget
+            over += sum(cache.memory_usage() for cache in caches)
+            if over <= 0:
+                return
+            cold = [b for b in buffers if not b.pins and not b.spilling and b.resident]
+            for buffer in sorted(cold, key=lambda b: b.used):
+                if over <= 0:
+                    return
+                buffer.spilling = True
+                over -= buffer.nbytes
+                self._spill_later(buffer)
+        for cache in sorted(caches, key=lambda c: c.memory_usage(), reverse=True):
+            if over <= 0:
+                break
+            size = cache.memory_usage()
+            cache.release()
+            over -= size - cache.memory_usage()
+
+    def _spill_later(self, buffer):
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='spill')
+        self._writer.submit(self._spill, weakref.ref(buffer))
+
+    def _spill(self, ref):
+        buffer = ref()
+        if buffer is None:
+            return
+        array = buffer._array
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            fd, path = tempfile.mkstemp(suffix='.npy', dir=self.spill_dir)
+            try:
+                with span('memory.spill', array), os.fdopen(fd, 'wb') as f:
+                    np.save(f, array, allow_pickle=False)
+                mapped = np.load(path, mmap_mode='r')
+            finally:
+                # the map keeps the data, the name is not needed and nothing is left after a crash
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        except OSError:
+            buffer.spilling = False
+            return
+        with self._lock:
+            buffer.spilling = False
+            if buffer.pins:
+                # pinned while it was written, it is on screen again and stays in memory
+                return
+            # the old address may be reused by a new array, so the entry moves to the map's
+            ref = self._buffers.get(_layout(array))
+            if ref is not None and ref() is buffer:
+                del self._buffers[_layout(array)]
+            buffer._array = mapped
+            self._register(buffer)
+
+    def wait(self):
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+
+def manager():
+    global _manager
+    with _lock:
+        if _manager is None:
+            _manager = MemoryManager()
+        return _manager
+
+
+def track(array, kind='image', pin=False):
+    return manager().track(array, kind, pin)
+
+
+def register_cache(cache):
+    manager().register_cache(cache)
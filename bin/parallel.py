@@ -0,0 +1,96 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# bands smaller than this are not worth a thread hop
+MIN_BAND_BYTES = 1 << 20
+
+_lock = threading.Lock()
+_local = threading.local()
+_pool = None
+_threads = None
+
+
+def default_threads():
+    value = os.environ.get('VIT_THREADS')
+    if value:
+        return max(1, int(value))
+    return os.cpu_count() or 1
+
+
+def threads():
+    return _threads or default_threads()
+
+
+def set_threads(count):
+    # None goes back to VIT_THREADS / the core count; the pool is rebuilt on next use
+    global _pool, _threads
+    with _lock:
+        _threads = count
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def _executor():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=threads(), thread_name_prefix='band')
+        return _pool
+
+
+def bands(height, count, align=1):
+    # row ranges of near equal size, starts on multiples of align
+    count = max(1, min(count, height // align or 1))
+    step = -(-height // count)
+    step = -(-step // align) * align
+    return [(top, min(top + step, height)) for top in range(0, height, step)]
+
+
+def _band_count(nbytes, length):
+    if getattr(_local, 'inside', False):
+        # already on a band worker, nesting would only queue behind ourselves
+        return 1
+    return max(1, min(threads(), nbytes // MIN_BAND_BYTES, length))
+
+
+def _call(fn, start, stop):
+    _local.inside = True
+    try:
+        return fn(start, stop)
+    finally:
+        _local.inside = False
+
+
+def for_bands(fn, length, nbytes, align=1):
+    # fn(start, stop) per band of rows (or columns), results in band order
+    ranges = bands(length, _band_count(nbytes, length), align)
+    if len(ranges) == 1:
+        return [fn(*ranges[0])]
+    pool = _executor()
+    futures = [pool.submit(_call, fn, start, stop) for start, stop in ranges]
+    return [future.result() for future in futures]
+
+
+def map_rows(fn, src, out, align=1):
+    # fn(src_band, out_band) fills out_band in place; for row-local ops, results are
+    # written straight into out so nothing is stitched afterwards
+    for_bands(lambda top, bottom: fn(src[top:bottom], out[top:bottom]), src.shape[0], src.nbytes, align)
+    return out
+
+
+def map_columns(fn, src, out):
+    # as map_rows for ops that are independent per column, e.g. a transform along axis 0
+    for_bands(lambda left, right: fn(src[:, left:right], out[:, left:right]), src.shape[1], src.nbytes)
+    return out
+
+
+def take(table, src, out=None):
+    # table[src] in row bands; indices are in range, so mode='clip' only skips the buffering
+    if out is None:
+        out = np.empty(src.shape, table.dtype)
+    return map_rows(lambda s, o: np.take(table, s, out=o, mode='clip'), src, out)
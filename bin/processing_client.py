@@ -0,0 +1,88 @@
+import itertools
+import json
+import socket
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from bin.processing_server import default_socket_path
+
+
+class ProcessingError(Exception):
+    pass
+
+
+class ProcessingClient:
+    # talks to a running processing server; frames go through two shared memory
+    # segments that are reused while they are big enough
+    def __init__(self, path=None, timeout=None):
+        self.path = path or default_socket_path()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(self.path)
+        self._file = self._sock.makefile('rwb')
+        self._segments = {}
+        self._ids = itertools.count(1)
+        self.last_reply = None
+
+    def _segment(self, role, nbytes):
+        shm = self._segments.get(role)
+        if shm is not None and shm.size >= nbytes:
+            return shm
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        shm = self._segments[role] = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        return shm
+
+    def call(self, command, **fields):
+        request = dict(fields, cmd=command, id=next(self._ids))
+        self._file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ProcessingError("服务已断开")
+        reply = json.loads(line)
+        if not reply.get('ok'):
+            raise ProcessingError(reply.get('error', ''))
+        return reply
+
+    def process(self, image, operations, out=None):
+        # results have the input's shape and dtype for every op the processor has
+        image = np.ascontiguousarray(image)
+        source = self._segment('input', image.nbytes)
+        target = self._segment('output', image.nbytes)
+        view = np.ndarray(image.shape, image.dtype, buffer=source.buf)
+        view[...] = image
+        del view
+        reply = self.call('process', ops=[[name, params] for name, params in operations],
+                          input={'name': source.name, 'shape': list(image.shape), 'dtype': image.dtype.str},
+                          output={'name': target.name})
+        result = np.ndarray(reply['shape'], np.dtype(reply['dtype']), buffer=target.buf)
+        if out is None:
+            out = result.copy()
+        else:
+            out[...] = result
+        del result
+        self.last_reply = reply
+        return out
+
+    def stats(self):
+        return self.call('stats')['stats']
+
+    def ping(self):
+        self.call('ping')
+
+    def close(self):
+        for shm in self._segments.values():
+            shm.close()
+            shm.unlink()
+        self._segments.clear()
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
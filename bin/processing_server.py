@@ -0,0 +1,203 @@
+import asyncio
+import collections
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import bin.image_processor as image_processor
+from bin.tracing import span
+
+
+def default_socket_path():
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(base, f'vector-image-tagging-{os.getuid()}.sock')
+
+
+def attach(name):
+    # segments belong to the client, attaching must not hand them to this process's
+    # resource tracker or they would be unlinked when the server exits
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def frame(shm, shape, dtype):
+    shape, dtype = tuple(shape), np.dtype(dtype)
+    if int(np.prod(shape)) * dtype.itemsize > shm.size:
+        raise ValueError("共享内存小于图像大小")
+    return np.ndarray(shape, dtype, buffer=shm.buf)
+
+
+def parse_operations(operations):
+    chain = []
+    for name, params in operations:
+        if name not in image_processor.OPERATIONS:
+            raise ValueError(f"未知操作: {name}")
+        chain.append((name, dict(image_processor.DEFAULT_PARAMS[name], **(params or {}))))
+    return chain
+
+
+class ProcessingServer:
+    # op chains on frames passed through shared memory, one JSON message per line over
+    # a Unix socket; workers keep their ImageProcessor so FFT masks stay cached
+    def __init__(self, path=None, workers=None, history=1000):
+        self.path = path or default_socket_path()
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='process')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = collections.deque(maxlen=history)
+        self.started = time.time()
+
+    def _processor(self):
+        processor = getattr(self._local, 'processor', None)
+        if processor is None:
+            processor = self._local.processor = image_processor.ImageProcessor()
+        return processor
+
+    def _process(self, request, submitted):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        source = target = None
+        image = result = out = None
+        try:
+            spec = request['input']
+            operations = parse_operations(request['ops'])
+            source = attach(spec['name'])
+            image = frame(source, spec['shape'], spec['dtype'])
+            with span('server.process', image, ops=[name for name, _ in operations]):
+                result = self._processor().apply_operations(image, operations)
+            output = request.get('output') or {'name': spec['name']}
+            target = source if output['name'] == spec['name'] else attach(output['name'])
+            out = frame(target, result.shape, result.dtype)
+            out[...] = result
+            return {
+                'shape': list(result.shape),
+                'dtype': result.dtype.str,
+                'queue_ms': (started - submitted) * 1000,
+                'run_ms': (time.perf_counter() - started) * 1000,
+            }
+        finally:
+            # views must go before the segments can be closed
+            del image, result, out
+            for shm in {id(s): s for s in (source, target) if s is not None}.values():
+                try:
+                    shm.close()
+                except BufferError:
+                    # a failed op's traceback can still hold a view, the mapping goes with it
+                    pass
+            with self._lock:
+                self.running -= 1
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+
+        return {
+            'workers': self.workers,
+            'queued': self.queued,
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'uptime': time.time() - self.started,
+            'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'max': latencies[-1] if latencies else 0.0},
+        }
+
+    async def _run(self, request):
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        try:
+            reply = await loop.run_in_executor(self._pool, self._process, request, submitted)
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        self.latencies.append((time.perf_counter() - submitted) * 1000)
+        return reply
+
+    async def _reply(self, writer, lock, request):
+        reply = {'id': request.get('id')}
+        try:
+            command = request.get('cmd', 'process')
+            if command == 'process':
+                reply.update(await self._run(request))
+            elif command == 'stats':
+                reply['stats'] = self.stats()
+            elif command != 'ping':
+                raise ValueError(f"未知命令: {command}")
+            reply['ok'] = True
+        except Exception as e:
+            reply.update(ok=False, error=str(e) or type(e).__name__)
+        async with lock:
+            writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        # requests on one connection may overlap, replies carry the request id
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                if not isinstance(request, dict):
+                    request = {'cmd': 'invalid'}
+                task = asyncio.create_task(self._reply(writer, lock, request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def serve(self, ready=None):
+        if os.path.exists(self.path):
+            # a socket file left by a crashed server is replaced, a live one is not
+            try:
+                _, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                os.remove(self.path)
+            else:
+                writer.close()
+                raise RuntimeError(f"服务已在运行: {self.path}")
+        server = await asyncio.start_unix_server(self._handle, self.path)
+        os.chmod(self.path, 0o600)
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stopped.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # not the main thread, the caller stops the loop itself
+                pass
+        if ready is not None:
+            ready()
+        try:
+            async with server:
+                await stopped.wait()
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            if os.path.exists(self.path):
+                os.remove(self.path)
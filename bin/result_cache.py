@@ -0,0 +1,77 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bin.disk_cache import DiskCache, cache_root, file_key
+from bin.image_processor import canonical_operations
+from bin.tracing import span
+
+
+# bump when an op's output changes so stale results are never served
+VERSION = 1
+
+
+def default_cache_dir():
+    return cache_root('results')
+
+
+def default_max_bytes():
+    return int(float(os.environ.get('VIT_RESULT_CACHE_MB', 4096)) * 1024 * 1024)
+
+
+class ResultCache(DiskCache):
+    # processed pages keyed by source file, page and canonical op chain, stored as
+    # .npy so a hit is memory-mapped rather than read
+    suffix = '.npy'
+
+    def __init__(self, root=None, max_bytes=None):
+        super().__init__(root or default_cache_dir(), default_max_bytes() if max_bytes is None else max_bytes)
+        self._writer = None
+
+    def key(self, path, page, operations):
+        # None for an empty chain, the source itself is not cached
+        chain = canonical_operations(operations)
+        if not chain:
+            return None
+        return json.dumps([VERSION, file_key(path), page, chain], sort_keys=True, separators=(',', ':'))
+
+    def get(self, path, page, operations):
+        try:
+            key = self.key(path, page, operations)
+            if key is None:
+                return None
+            entry = self.entry(key)
+            with span('cache.load', path=path):
+                image = np.load(entry, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        self.touch(entry)
+        return image
+
+    def put(self, path, page, operations, image):
+        self._put(self.key(path, page, operations), image)
+
+    def put_later(self, path, page, operations, image):
+        # images are never modified after they are made, so they can be written behind the caller
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='result-cache')
+        return self._writer.submit(self._put, self.key(path, page, operations), image)
+
+    def _put(self, key, image):
+        # an entry over half the cap would only evict everything else
+        if key is None or image.nbytes > self.max_bytes // 2:
+            return
+        with span('cache.store', image):
+            self.store(self.entry(key), lambda tmp: _save(tmp, image))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+
+def _save(path, image):
+    with open(path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(image), allow_pickle=False)
@@ -0,0 +1,174 @@
+import csv
+import json
+import os
+import shutil
+import struct
+
+import numpy as np
+
+from bin.annotations import AnnotationStore, KINDS
+from bin.tracing import span
+
+
+VERSION = 1
+_COLUMNS = {'kind': np.uint8, 'label': np.int32, 'length': np.int32, 'bbox': np.float32, 'vertices': np.float32}
+_KIND_NAMES = {v: k for k, v in KINDS.items()}
+
+# journal record: op, kind, label id or row id, vertex count or byte length
+_RECORD = struct.Struct('<BBxxiI')
+_ADD, _REMOVE, _LABEL = 1, 2, 3
+
+
+def sidecar_path(image_path):
+    return image_path + '.tags'
+
+
+class _PageState:
+    def __init__(self, rows=0, labels=0, removed=0, journal_records=0):
+        self.rows = rows
+        self.labels = labels
+        self.removed = removed
+        self.journal_records = journal_records
+
+
+class AnnotationSidecar:
+    # one directory per page: columnar .npy base files plus an append-only journal
+    def __init__(self, root, compact_ratio=0.5, compact_min=4096):
+        self.root = root
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self._pages = {}
+
+    def _page_dir(self, page):
+        return os.path.join(self.root, f'page-{page:04d}')
+
+    def _recover(self, directory):
+        # a compaction interrupted between the two renames leaves only the old copy
+        if not os.path.isdir(directory) and os.path.isdir(directory + '.old'):
+            os.replace(directory + '.old', directory)
+        for leftover in (directory + '.tmp', directory + '.old'):
+            if os.path.isdir(leftover):
+                shutil.rmtree(leftover, ignore_errors=True)
+
+    def load(self, page=0):
+        directory = self._page_dir(page)
+        self._recover(directory)
+        with span('load.annotations', page=page) as s:
+            store = self._load_base(directory)
+            records = self._replay(os.path.join(directory, 'journal.bin'), store)
+            s.set(rows=store.capacity, records=records)
+        self._pages[page] = _PageState(store.capacity, len(store.labels), len(store.removed), records)
+        return store
+
+    def _load_base(self, directory):
+        meta_path = os.path.join(directory, 'meta.json')
+        if not os.path.exists(meta_path):
+            return AnnotationStore()
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != VERSION:
+            raise ValueError(f"不支持的标注文件版本: {meta.get('version')}")
+        columns = {}
+        for name in _COLUMNS:
+            # copy-on-write maps: pages are read lazily and edits stay private
+            columns[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode='c')
+        return AnnotationStore.from_arrays(
+            columns['kind'], columns['label'], columns['length'], columns['vertices'],
+            meta['labels'], columns['bbox'])
+
+    def _replay(self, path, store):
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = records = 0
+        while offset + _RECORD.size <= len(data):
+            op, kind, value, count = _RECORD.unpack_from(data, offset)
+            size = count * 8 if op == _ADD else count
+            end = offset + _RECORD.size + size
+            if end > len(data):
+                break
+            payload = data[offset + _RECORD.size:end]
+            if op == _ADD:
+                store.add(kind, np.frombuffer(payload, np.float32).reshape(-1, 2), store.labels[value])
+            elif op == _REMOVE:
+                store.remove([value])
+            elif op == _LABEL:
+                store.label_id(payload.decode('utf-8'))
+            offset = end
+            records += 1
+        if offset < len(data):
+            # drop a record torn by a crash so that later appends stay aligned
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        return records
+
+    def save(self, store, page=0):
+        # appends what changed since the last save, returns the id remap if it compacted
+        state = self._pages.setdefault(page, _PageState())
+        directory = self._page_dir(page)
+        os.makedirs(directory, exist_ok=True)
+        chunks = []
+        for name in store.labels[state.labels:]:
+            encoded = name.encode('utf-8')
+            chunks.append(_RECORD.pack(_LABEL, 0, 0, len(encoded)))
+            chunks.append(encoded)
+        arrays = store.arrays(state.rows)
+        offset = 0
+        for kind, label, length in zip(arrays['kind'].tolist(), arrays['label'].tolist(), arrays['length'].tolist()):
+            chunks.append(_RECORD.pack(_ADD, kind, label, length))
+            chunks.append(arrays['vertices'][offset:offset + length].tobytes())
+            offset += length
+        for index in store.removed[state.removed:]:
+            chunks.append(_RECORD.pack(_REMOVE, 0, index, 0))
+        appended = len(store.labels) - state.labels + store.capacity - state.rows + len(store.removed) - state.removed
+        if appended:
+            with span('save.annotations', records=appended):
+                with open(os.path.join(directory, 'journal.bin'), 'ab') as f:
+                    f.write(b''.join(chunks))
+        state.rows, state.labels, state.removed = store.capacity, len(store.labels), len(store.removed)
+        state.journal_records += appended
+        if state.journal_records > max(self.compact_min, self.compact_ratio * len(store)):
+            return self.compact(store, page)
+        return None
+
+    def compact(self, store, page=0):
+        directory = self._page_dir(page)
+        remap = store.compact()
+        tmp = directory + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        with span('save.compact', rows=len(store)):
+            for name, array in store.arrays().items():
+                np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array, _COLUMNS[name]))
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'version': VERSION, 'rows': len(store), 'labels': store.labels}, f, ensure_ascii=False)
+            if os.path.isdir(directory):
+                os.replace(directory, directory + '.old')
+            os.replace(tmp, directory)
+            shutil.rmtree(directory + '.old', ignore_errors=True)
+        self._pages[page] = _PageState(store.capacity, len(store.labels), 0, 0)
+        return remap
+
+
+def _records(store):
+    for index in store.ids().tolist():
+        yield index, _KIND_NAMES[store.kind(index)], store.label(index), store.points(index).tolist()
+
+
+def export_json(store, path):
+    # streamed one record at a time, the whole document is never built in memory
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for n, (index, kind, label, points) in enumerate(_records(store)):
+            f.write(',\n' if n else '\n')
+            f.write(json.dumps({'id': index, 'kind': kind, 'label': label, 'points': points}, ensure_ascii=False))
+        f.write('\n]\n')
+
+
+def export_csv(store, path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'kind', 'label', 'points'])
+        for index, kind, label, points in _records(store):
+            writer.writerow([index, kind, label, ';'.join(f'{x:g} {y:g}' for x, y in points)])
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+from bin.disk_cache import DiskCache, cache_root, file_key
+from bin.display_window import DisplayWindow
+from bin.tiff_reader import TiffStack, to_rgb
+from bin.tiff_writer import to_bgr
+from bin.tracing import span
+
+
+def default_cache_dir():
+    return cache_root('thumbnails')
+
+
+def make_thumbnail(path, size=128):
+    with span('thumbnail.make', path=path):
+        img = TiffStack(path).read_reduced(0, size)
+        window = DisplayWindow()
+        window.auto(img)
+        img = window.apply(img)
+        scale = size / max(img.shape[:2])
+        if scale < 1:
+            dsize = (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale)))
+            img = cv2.resize(img, dsize, interpolation=cv2.INTER_AREA)
+        return img
+
+
+class ThumbnailCache(DiskCache):
+    suffix = '.png'
+
+    def __init__(self, root=None, size=128, max_bytes=256 * 1024 * 1024):
+        super().__init__(root or default_cache_dir(), max_bytes)
+        self.size = size
+
+    def _entry(self, path):
+        return self.entry('\0'.join(str(v) for v in file_key(path) + [self.size]))
+
+    def get(self, path):
+        entry = self._entry(path)
+        try:
+            data = np.fromfile(entry, np.uint8)
+        except OSError:
+            return None
+        img = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            return None
+        self.touch(entry)
+        return to_rgb(img)
+
+    def put(self, path, thumb):
+        ok, data = cv2.imencode('.png', to_bgr(thumb))
+        if not ok:
+            raise ValueError("无法编码缩略图")
+        self.store(self._entry(path), data.tofile)
+
+    def thumbnail(self, path):
+        thumb = self.get(path)
+        if thumb is None:
+            thumb = make_thumbnail(path, self.size)
+            self.put(path, thumb)
+        return thumb
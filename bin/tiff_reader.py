@@ -0,0 +1,400 @@
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+from bin import memory
+from bin.tracing import span
+
+
+_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 5: 'II', 6: 'b', 7: 'B', 8: 'h', 9: 'i',
+          10: 'ii', 11: 'f', 12: 'd', 13: 'I', 16: 'Q', 17: 'q', 18: 'Q'}
+
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIG = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SUB_IFDS = 330
+SAMPLE_FORMAT = 339
+
+DEFLATE = (8, 32946)
+
+# cv2 decodes these at 1/n size directly, for files that are not parsed as TIFF
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                  (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+# the dtypes cv2.cvtColor accepts, the rest have their channels reordered by numpy
+_CVT_DTYPES = (np.uint8, np.uint16, np.float32)
+
+
+def swap_red_blue(img):
+    # RGB(A) <-> BGR(A), alpha stays last
+    if img.ndim != 3 or img.shape[2] not in (3, 4):
+        return img
+    if img.dtype in _CVT_DTYPES:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB if img.shape[2] == 3 else cv2.COLOR_BGRA2RGBA)
+    return img[..., [2, 1, 0, 3][:img.shape[2]]]
+
+
+def to_rgb(img):
+    # cv2 decodes to BGR(A), working images are RGB(A)
+    return swap_red_blue(img)
+
+
+class TiffPage:
+    def __init__(self, tags, byteorder):
+        self.tags = tags
+        self.byteorder = byteorder
+        self.width = tags[IMAGE_WIDTH][0]
+        self.height = tags[IMAGE_LENGTH][0]
+        self.samples = tags.get(SAMPLES_PER_PIXEL, (1,))[0]
+        self.bits = tags.get(BITS_PER_SAMPLE, (1,))[0]
+        self.compression = tags.get(COMPRESSION, (1,))[0]
+        self.photometric = tags.get(PHOTOMETRIC, (1,))[0]
+        self.planar = tags.get(PLANAR_CONFIG, (1,))[0]
+        self.sample_format = tags.get(SAMPLE_FORMAT, (1,))[0]
+        self.predictor = tags.get(PREDICTOR, (1,))[0]
+        self.is_reduced = bool(tags.get(NEW_SUBFILE_TYPE, (0,))[0] & 1)
+        self.sub_ifds = tags.get(SUB_IFDS, ())
+        # position in the file's main IFD chain, None for a SubIFD
+        self.ifd = None
+        self.is_tiled = TILE_OFFSETS in tags
+        if self.is_tiled:
+            self.offsets = tags[TILE_OFFSETS]
+            self.byte_counts = tags.get(TILE_BYTE_COUNTS, ())
+            self.chunk = (tags.get(TILE_LENGTH, (0,))[0], tags.get(TILE_WIDTH, (0,))[0])
+        else:
+            self.offsets = tags.get(STRIP_OFFSETS, ())
+            self.byte_counts = tags.get(STRIP_BYTE_COUNTS, ())
+            self.chunk = (min(tags.get(ROWS_PER_STRIP, (self.height,))[0], self.height), self.width)
+
+    @property
+    def shape(self):
+        if self.samples == 1:
+            return (self.height, self.width)
+        return (self.height, self.width, self.samples)
+
+    @property
+    def dtype(self):
+        kind = {1: 'u', 2: 'i', 3: 'f'}.get(self.sample_format)
+        if kind is None or self.bits not in (8, 16, 32, 64):
+            return None
+        return np.dtype(f"{self.byteorder}{kind}{self.bits // 8}")
+
+    @property
+    def is_mappable(self):
+        # uncompressed, chunky and stored as consecutive strips
+        if self.compression != 1 or self.dtype is None or self.is_tiled:
+            return False
+        if self.samples > 1 and self.planar != 1:
+            return False
+        if (self.photometric, self.samples) not in ((1, 1), (2, 3), (2, 4)) or not self.offsets:
+            return False
+        position = self.offsets[0]
+        for offset, count in zip(self.offsets, self.byte_counts):
+            if offset != position:
+                return False
+            position += count
+        return position - self.offsets[0] >= self.height * self.width * self.samples * self.dtype.itemsize
+
+    @property
+    def is_chunk_decodable(self):
+        # uncompressed or deflate strips/tiles this reader can decode one at a time
+        if self.compression not in (1,) + DEFLATE or self.predictor not in (1, 2) or self.dtype is None:
+            return False
+        if self.samples > 1 and self.planar != 1:
+            return False
+        if (self.photometric, self.samples) not in ((1, 1), (2, 3), (2, 4)) or min(self.chunk) <= 0:
+            return False
+        across = -(-self.width // self.chunk[1])
+        down = -(-self.height // self.chunk[0])
+        return len(self.offsets) == len(self.byte_counts) == across * down
+
+    @property
+    def nbytes(self):
+        return self.height * self.width * self.samples * max(self.bits // 8, 1)
+
+
+class TiffStack:
+    def __init__(self, path):
+        self.path = path
+        self.pages = []
+        # reduced-resolution versions of each page, never part of the stack itself
+        self.overviews = {}
+        self.byteorder = '<'
+        self._ifd_count = 0
+        with open(path, 'rb') as f:
+            header = f.read(16)
+            if header[:4] in (b'II*\x00', b'MM\x00*'):
+                self._parse(f, header, big=False)
+            elif header[:4] in (b'II+\x00', b'MM\x00+'):
+                self._parse(f, header, big=True)
+        if not self.pages:
+            count = cv2.imcount(path) if cv2.haveImageReader(path) else 0
+            if count == 0:
+                raise ValueError("无法读取图像文件")
+            self.pages = [None] * count
+
+    def _parse(self, f, header, big):
+        self.byteorder = '<' if header[:2] == b'II' else '>'
+        bo = self.byteorder
+        if big:
+            offset = struct.unpack(bo + 'Q', header[8:16])[0]
+            layout = ('Q', 20, 'Q', 'Q')
+        else:
+            offset = struct.unpack(bo + 'I', header[4:8])[0]
+            layout = ('H', 12, 'I', 'I')
+        seen = set()
+        ifd = 0
+        for page in self._chain(f, offset, layout, seen):
+            # cv2 numbers the top-level IFDs, reduced ones included
+            page.ifd = ifd
+            ifd += 1
+            if page.is_reduced and self.pages:
+                # a reduced IFD in the main chain belongs to the page before it
+                self.overviews.setdefault(len(self.pages) - 1, []).append(page)
+                continue
+            index = len(self.pages)
+            self.pages.append(page)
+            for sub in page.sub_ifds:
+                self.overviews.setdefault(index, []).extend(self._chain(f, sub, layout, seen))
+        self._ifd_count = ifd
+
+    def _chain(self, f, offset, layout, seen):
+        # the pages of an IFD chain starting at offset
+        pages = []
+        while offset and offset not in seen:
+            seen.add(offset)
+            tags, offset = self._read_ifd(f, offset, layout)
+            if IMAGE_WIDTH in tags and IMAGE_LENGTH in tags:
+                pages.append(TiffPage(tags, self.byteorder))
+        return pages
+
+    def _read_ifd(self, f, offset, layout):
+        bo = self.byteorder
+        count_fmt, entry_size, offset_fmt, number_fmt = layout
+        inline = struct.calcsize(offset_fmt)
+        f.seek(offset)
+        count = struct.unpack(bo + count_fmt, f.read(struct.calcsize(count_fmt)))[0]
+        data = f.read(count * entry_size + inline)
+        tags = {}
+        for i in range(count):
+            entry = data[i * entry_size:(i + 1) * entry_size]
+            code, kind = struct.unpack(bo + 'HH', entry[:4])
+            n = struct.unpack(bo + number_fmt, entry[4:4 + inline])[0]
+            fmt = _TYPES.get(kind)
+            if fmt is None:
+                continue
+            size = struct.calcsize(bo + fmt) * n
+            raw = entry[4 + inline:]
+            if size > inline:
+                f.seek(struct.unpack(bo + offset_fmt, raw)[0])
+                raw = f.read(size)
+            if kind == 2:
+                tags[code] = (raw[:n].rstrip(b'\x00').decode('latin-1'),)
+            elif len(fmt) == 1 and n > 16:
+                tags[code] = tuple(np.frombuffer(raw[:size], bo + fmt).tolist())
+            else:
+                tags[code] = struct.unpack(bo + fmt * n, raw[:size])
+        return tags, struct.unpack(bo + offset_fmt, data[count * entry_size:])[0]
+
+    def __len__(self):
+        return len(self.pages)
+
+    def is_mapped(self, index):
+        page = self.pages[index]
+        return page is not None and page.is_mappable
+
+    def _map(self, page):
+        arr = np.memmap(self.path, page.dtype, 'r', page.offsets[0], page.shape)
+        if not page.dtype.isnative:
+            arr = arr.astype(page.dtype.newbyteorder('='))
+        return arr
+
+    def read_page(self, index):
+        page = self.pages[index]
+        if page is not None and page.is_mappable:
+            with span('load.map', page=index):
+                return self._map(page)
+        with span('load.decode', page=index) as s:
+            img = self._decode(index)
+            s.set(shape=list(img.shape), dtype=str(img.dtype))
+        return img
+
+    def overview(self, index, max_side):
+        # the smallest stored reduced-resolution version of a page still covering max_side, or None
+        page = self.pages[index]
+        if page is None:
+            return None
+        candidates = [p for p in self.overviews.get(index, ()) if p.is_mappable
+                      and abs(p.width - round(page.width * p.height / page.height)) <= 1
+                      and max(p.width, p.height) >= max_side]
+        return min(candidates, key=lambda p: p.width) if candidates else None
+
+    def has_cheap_reduced(self, index, max_side):
+        return self.is_mapped(index) or self.overview(index, max_side) is not None
+
+    def read_reduced(self, index, max_side):
+        # cheapest readable version of a page that is still at least max_side wide or tall
+        reduced = self.overview(index, max_side)
+        if reduced is not None:
+            with span('load.map', page=index, overview=list(reduced.shape[:2])):
+                return self._map(reduced)
+        page = self.pages[index]
+        if page is None:
+            return self._decode_reduced(index, max_side)
+        step = max(1, max(page.height, page.width) // (2 * max_side))
+        if step > 1 and not page.is_mappable and page.is_chunk_decodable:
+            return self.read_strided(index, step)
+        img = self.read_page(index)
+        if self.is_mapped(index):
+            # striding the map only faults in the rows that are kept
+            img = np.ascontiguousarray(img[::step, ::step])
+        return img
+
+    def read_strided(self, index, step):
+        # every step-th row and column of a page, decoded one strip or tile at a time so
+        # the full page is never held; only for pages that are is_chunk_decodable
+        page = self.pages[index]
+        chunk_h, chunk_w = page.chunk
+        across = -(-page.width // chunk_w)
+        rows = np.arange(0, page.height, step)
+        extra = page.shape[2:]
+        out = np.empty((len(rows), -(-page.width // step)) + extra, page.dtype.newbyteorder('='))
+        done = 0
+        with open(self.path, 'rb') as f, span('load.strided', page=index, step=step):
+            for band in range(-(-page.height // chunk_h)):
+                top = band * chunk_h
+                height = chunk_h if page.is_tiled else min(chunk_h, page.height - top)
+                wanted = rows[(rows >= top) & (rows < top + height)] - top
+                if not len(wanted):
+                    continue
+                line = np.empty((len(wanted), across * chunk_w) + extra, page.dtype)
+                for col in range(across):
+                    chunk = self._chunk(f, page, band * across + col, (height, chunk_w) + extra)[wanted]
+                    if page.predictor == 2:
+                        # undo horizontal differencing, wrapping like the encoder did
+                        chunk = np.cumsum(chunk, axis=1, dtype=chunk.dtype)
+                    line[:, col * chunk_w:(col + 1) * chunk_w] = chunk
+                out[done:done + len(wanted)] = line[:, :page.width:step]
+                done += len(wanted)
+        return out
+
+    def _chunk(self, f, page, i, shape):
+        f.seek(page.offsets[i])
+        data = f.read(page.byte_counts[i])
+        if page.compression in DEFLATE:
+            data = zlib.decompress(data)
+        count = int(np.prod(shape))
+        if len(data) < count * page.dtype.itemsize:
+            raise ValueError("图像数据不完整")
+        return np.frombuffer(data, page.dtype, count).reshape(shape)
+
+    def _decode_reduced(self, index, max_side):
+        # cv2 scales JPEG and similar while decoding; the result is 8-bit colour, which is
+        # all a reduced read is used for. Too small a result means the next factor down
+        if len(self.pages) == 1:
+            for _, flags in _REDUCED_FLAGS:
+                img = cv2.imread(self.path, flags)
+                if img is not None and max(img.shape[:2]) >= max_side:
+                    return to_rgb(img)
+        return self.read_page(index)
+
+    def page_shape(self, index):
+        page = self.pages[index]
+        return page.shape[:2] if page is not None else None
+
+    def _decode(self, index):
+        flags = cv2.IMREAD_UNCHANGED
+        page = self.pages[index]
+        ifd = page.ifd if page is not None else index
+        if len(self.pages) == 1 and self._ifd_count <= 1:
+            img = cv2.imread(self.path, flags)
+        else:
+            ok, mats = cv2.imreadmulti(self.path, ifd, 1, flags=flags)
+            img = mats[0] if ok and mats else None
+        if img is None:
+            raise ValueError("无法读取图像文件")
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        if channels not in (1, 3, 4):
+            raise ValueError(f"不支持的通道数: {channels}")
+        return to_rgb(img)
+
+
+def _touch(arr):
+    # fault a memory-mapped page in by reading one byte per 4 KiB
+    flat = arr.reshape(-1).view(np.uint8)
+    return int(flat[::4096].sum())
+
+
+class PagePrefetcher:
+    # pages are cached as memory Buffers (so they come back read-only); a page that is
+    # also the viewer's original is held once and spilled like any other frame
+    def __init__(self, stack, cache_pages=8, ahead=2, workers=2):
+        self.stack = stack
+        self.cache_pages = cache_pages
+        self.ahead = ahead
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def _load(self, index):
+        try:
+            page = self.stack.read_page(index)
+            if self.stack.is_mapped(index):
+                _touch(page)
+            page = memory.track(page, 'page')
+        finally:
+            with self._lock:
+                self._pending.pop(index, None)
+        with self._lock:
+            self._cache[index] = page
+            self._cache.move_to_end(index)
+            while len(self._cache) > self.cache_pages:
+                self._cache.popitem(last=False)
+        return page.array
+
+    def _schedule(self, index):
+        if index < 0 or index >= len(self.stack) or index in self._cache or index in self._pending:
+            return
+        self._pending[index] = self._pool.submit(self._load, index)
+
+    def get(self, index):
+        with self._lock:
+            page = self._cache.get(index)
+            if page is not None:
+                self._cache.move_to_end(index)
+            future = self._pending.get(index)
+        if page is not None:
+            page = page.array
+        else:
+            page = future.result() if future is not None else self._load(index)
+        with self._lock:
+            for step in range(1, self.ahead + 1):
+                self._schedule(index + step)
+                self._schedule(index - step)
+        return page
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._cache.clear()
+            self._pending.clear()
@@ -0,0 +1,235 @@
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from bin.tiff_reader import swap_red_blue
+from bin.tracing import span
+
+
+COMPRESSIONS = ('none', 'lzw', 'deflate')
+# speed vs size presets: deflate level and whether the horizontal predictor is used
+PRESETS = {'fastest': (1, False), 'balanced': (6, True), 'smallest': (9, True)}
+BIGTIFF_THRESHOLD = 2 ** 32 - 2 ** 25
+
+_SHORT, _LONG, _LONG8 = 3, 4, 16
+
+
+def to_bgr(img):
+    # working images are RGB(A), cv2 encodes BGR(A)
+    return swap_red_blue(img)
+
+
+def write_pages(path, pages, params=()):
+    bgr = [to_bgr(page) for page in pages]
+    params = list(params)
+    ok = cv2.imwrite(path, bgr[0], params) if len(bgr) == 1 else cv2.imwritemulti(path, bgr, params)
+    if not ok:
+        raise ValueError("保存文件失败")
+
+
+def write_image(path, image, params=()):
+    write_pages(path, [image], params)
+
+
+def _sample_format(dtype):
+    if dtype.kind == 'u':
+        return 1
+    if dtype.kind == 'i':
+        return 2
+    if dtype.kind == 'f':
+        return 3
+    raise ValueError(f"不支持的数据类型: {dtype}")
+
+
+def _predict(block):
+    # horizontal differencing, integer wrap-around is what the TIFF predictor expects
+    out = block.copy()
+    out[:, 1:] -= block[:, :-1]
+    return out
+
+
+def _chunks(image, tile, rows_per_strip):
+    height, width = image.shape[:2]
+    if tile is None:
+        for top in range(0, height, rows_per_strip):
+            yield image[top:top + rows_per_strip]
+        return
+    for top in range(0, height, tile):
+        for left in range(0, width, tile):
+            block = image[top:top + tile, left:left + tile]
+            if block.shape[:2] != (tile, tile):
+                # edge tiles are stored full size
+                padded = np.zeros((tile, tile) + image.shape[2:], image.dtype)
+                padded[:block.shape[0], :block.shape[1]] = block
+                block = padded
+            yield block
+
+
+class _Writer:
+    def __init__(self, f, bigtiff):
+        self.f = f
+        self.bigtiff = bigtiff
+        self.offset_type = _LONG8 if bigtiff else _LONG
+        self.offset_fmt = '<Q' if bigtiff else '<I'
+        if bigtiff:
+            f.write(b'II+\x00' + struct.pack('<HHQ', 8, 0, 0))
+            self.next_pointer = 8
+        else:
+            f.write(b'II*\x00' + struct.pack('<I', 0))
+            self.next_pointer = 4
+
+    def _align(self):
+        if self.f.tell() % 2:
+            self.f.write(b'\x00')
+
+    def write_ifd(self, tags):
+        # tags: {code: (type, values)}, out-of-line values are written before the IFD
+        f = self.f
+        inline = 8 if self.bigtiff else 4
+        entries = []
+        for code in sorted(tags):
+            kind, values = tags[code]
+            fmt = {_SHORT: 'H', _LONG: 'I', _LONG8: 'Q'}[kind]
+            data = struct.pack('<' + fmt * len(values), *values)
+            if len(data) > inline:
+                self._align()
+                position = f.tell()
+                f.write(data)
+                data = struct.pack(self.offset_fmt, position)
+            entries.append((code, kind, len(values), data.ljust(inline, b'\x00')))
+        self._align()
+        position = f.tell()
+        count_fmt, number_fmt = ('<Q', '<Q') if self.bigtiff else ('<H', '<I')
+        f.write(struct.pack(count_fmt, len(entries)))
+        for code, kind, count, data in entries:
+            f.write(struct.pack('<HH', code, kind) + struct.pack(number_fmt, count) + data)
+        next_pointer = f.tell()
+        f.write(struct.pack(self.offset_fmt, 0))
+        f.seek(self.next_pointer)
+        f.write(struct.pack(self.offset_fmt, position))
+        f.seek(0, os.SEEK_END)
+        self.next_pointer = next_pointer
+
+
+def _page_tags(image, compression, predictor, tile, rows_per_strip, offsets, counts, offset_type):
+    height, width = image.shape[:2]
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    tags = {
+        256: (_LONG, [width]),
+        257: (_LONG, [height]),
+        258: (_SHORT, [image.dtype.itemsize * 8] * channels),
+        259: (_SHORT, [8 if compression == 'deflate' else 1]),
+        262: (_SHORT, [1 if channels == 1 else 2]),
+        277: (_SHORT, [channels]),
+        284: (_SHORT, [1]),
+        339: (_SHORT, [_sample_format(image.dtype)] * channels),
+    }
+    if channels == 4:
+        # unspecified rather than unassociated alpha, libtiff's RGBA path would premultiply it
+        tags[338] = (_SHORT, [0])
+    if predictor:
+        tags[317] = (_SHORT, [2])
+    if tile is None:
+        tags[273] = (offset_type, offsets)
+        tags[278] = (_LONG, [rows_per_strip])
+        tags[279] = (offset_type, counts)
+    else:
+        tags[322] = (_SHORT, [tile])
+        tags[323] = (_SHORT, [tile])
+        tags[324] = (offset_type, offsets)
+        tags[325] = (offset_type, counts)
+    return tags
+
+
+def _check_page(page):
+    page = np.ascontiguousarray(page)
+    channels = 1 if page.ndim == 2 else page.shape[2]
+    if channels not in (1, 3, 4):
+        raise ValueError(f"不支持的通道数: {channels}")
+    _sample_format(page.dtype)
+    return page
+
+
+def write_tiff(path, pages, compression='none', preset='balanced', tile=None, bigtiff=None,
+               progress=None, workers=None):
+    # native dtype and channel count, strips or tiles, chunks compressed in parallel.
+    # pages may be any iterable: each page is written and dropped before the next one is
+    # taken, so a generator keeps one page in memory. bigtiff=None decides from the size of
+    # a list of pages, an iterator is written as classic TIFF unless bigtiff is set
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"不支持的压缩方式: {compression}")
+    count = len(pages) if hasattr(pages, '__len__') else None
+    if bigtiff is None:
+        bigtiff = count is not None and sum(np.asarray(page).nbytes for page in pages) > BIGTIFF_THRESHOLD
+    level, predictor = PRESETS[preset]
+    if compression == 'lzw':
+        # LZW goes through libtiff, which only writes classic striped files here, all pages at once
+        if tile is not None or bigtiff:
+            raise ValueError("LZW 压缩不支持分块或 BigTIFF 输出")
+        pages = [_check_page(page) for page in pages]
+        params = [cv2.IMWRITE_TIFF_COMPRESSION, cv2.IMWRITE_TIFF_COMPRESSION_LZW]
+        if predictor and all(page.dtype.kind in 'ui' for page in pages):
+            params += [cv2.IMWRITE_TIFF_PREDICTOR, cv2.IMWRITE_TIFF_PREDICTOR_HORIZONTAL]
+        with span('save.write', compression=compression):
+            write_pages(path, pages, params)
+        if progress is not None:
+            progress(1.0)
+        return
+    workers = workers or os.cpu_count() or 1
+    tmp = path + '.part'
+    try:
+        with open(tmp, 'wb') as f, ThreadPoolExecutor(max_workers=workers) as pool, \
+                span('save.write', compression=compression, tiled=tile is not None, bigtiff=bigtiff):
+            writer = _Writer(f, bigtiff)
+            for done, page in enumerate(pages):
+                page = _check_page(page)
+                rows_per_strip = max(1, (1 << 20) // (page.nbytes // page.shape[0]))
+                if tile is None:
+                    total = -(-page.shape[0] // rows_per_strip)
+                else:
+                    total = -(-page.shape[0] // tile) * -(-page.shape[1] // tile)
+                use_predictor = compression == 'deflate' and predictor and page.dtype.kind in 'ui'
+
+                def encode(block):
+                    if compression == 'none':
+                        return block.tobytes()
+                    if use_predictor:
+                        block = _predict(block)
+                    return zlib.compress(block.tobytes(), level)
+
+                def report(written, done=done, total=total):
+                    if progress is not None and count:
+                        progress((done + written / total) / count)
+
+                offsets, counts = [], []
+                pending = []
+                for block in _chunks(page, tile, rows_per_strip):
+                    pending.append(pool.submit(encode, block))
+                    # write in order while keeping a bounded number of encoded chunks in memory
+                    while pending and (len(pending) > 2 * workers or pending[0].done()):
+                        _write_chunk(f, pending.pop(0), offsets, counts)
+                        report(len(offsets))
+                while pending:
+                    _write_chunk(f, pending.pop(0), offsets, counts)
+                    report(len(offsets))
+                writer.write_ifd(_page_tags(page, compression, use_predictor, tile, rows_per_strip,
+                                            offsets, counts, writer.offset_type))
+                if not bigtiff and f.tell() >= 2 ** 32:
+                    raise ValueError("文件超过 4GB, 请使用 BigTIFF")
+                del page
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _write_chunk(f, future, offsets, counts):
+    data = future.result()
+    offsets.append(f.tell())
+    counts.append(len(data))
+    f.write(data)
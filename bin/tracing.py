@@ -0,0 +1,146 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'attrs', 'start', 'cpu', 'memory')
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.memory = tracemalloc.get_traced_memory()[0] if self.tracer.track_memory else 0
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        allocated = tracemalloc.get_traced_memory()[0] - self.memory if self.tracer.track_memory else None
+        self.tracer._record({
+            'name': self.name,
+            'start': self.start,
+            'wall': wall,
+            'cpu': cpu,
+            'bytes': allocated,
+            'thread': threading.get_ident(),
+            'attrs': self.attrs,
+        })
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+def _describe(image):
+    if image is None or not hasattr(image, 'shape'):
+        return {}
+    return {'shape': list(image.shape), 'dtype': str(image.dtype)}
+
+
+class Tracer:
+    def __init__(self, max_spans=100000):
+        self.enabled = False
+        self.track_memory = False
+        self.spans = deque(maxlen=max_spans)
+        self.listeners = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def enable(self, track_memory=False):
+        self.track_memory = track_memory
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self.track_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.track_memory = False
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+    def span(self, name, image=None, **attrs):
+        # a shared no-op context manager when tracing is off
+        if not self.enabled:
+            return _NULL_SPAN
+        attrs.update(_describe(image))
+        return _Span(self, name, attrs)
+
+    def _record(self, record):
+        with self._lock:
+            self.spans.append(record)
+        for listener in self.listeners:
+            listener(record)
+
+    def export(self, path):
+        # Chrome trace event format, loadable in chrome://tracing or Perfetto
+        with self._lock:
+            spans = list(self.spans)
+        events = []
+        for record in spans:
+            args = dict(record['attrs'])
+            args['cpu_ms'] = round(record['cpu'] * 1000, 3)
+            if record['bytes'] is not None:
+                args['bytes'] = record['bytes']
+            events.append({
+                'name': record['name'],
+                'ph': 'X',
+                'ts': (record['start'] - self._origin) * 1e6,
+                'dur': record['wall'] * 1e6,
+                'pid': os.getpid(),
+                'tid': record['thread'],
+                'args': args,
+            })
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+tracer = Tracer()
+
+
+def span(name, image=None, **attrs):
+    return tracer.span(name, image, **attrs)
+
+
+def traced(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if os.environ.get('VIT_TRACE'):
+    tracer.enable(track_memory=os.environ.get('VIT_TRACE') == 'memory')
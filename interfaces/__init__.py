@@ -1,4 +1,23 @@
 #interfaces/__init__.py
+import importlib
 
-from .banpass_interface import BandpassFilterDialog
-from .contrast_interface import ContrastDialog
\ No newline at end of file
+#Submodules pull in numpy/cv2, they are only imported on first use
+_EXPORTS = {
+    'BandpassFilterDialog': '.banpass_interface',
+    'ContrastDialog': '.contrast_interface',
+    'DisplayRangeDialog': '.display_range_interface',
+    'SaveOptionsDialog': '.save_interface',
+    'TiledImageItem': '.tiled_view',
+    'AnnotationLayerItem': '.annotation_layer',
+    'FolderBrowser': '.folder_browser',
+    'HistogramWidget': '.histogram_widget',
+    'ThumbnailModel': '.folder_browser',
+}
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
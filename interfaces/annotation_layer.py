@@ -0,0 +1,166 @@
+from PyQt6.QtCore import QPointF, QRectF, Qt
+from PyQt6.QtGui import QColor, QPen, QPolygonF
+from PyQt6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+from bin.annotations import AnnotationStore, POINT, BOX, POLYGON, POLYLINE
+from bin.tracing import span
+
+
+def _label_color(label_id):
+    return QColor.fromHsvF((label_id * 0.618034) % 1.0, 0.9, 1.0)
+
+
+def _polygon(points):
+    return QPolygonF([QPointF(float(x), float(y)) for x, y in points])
+
+
+class AnnotationLayerItem(QGraphicsItem):
+    def __init__(self, store=None, parent=None):
+        super().__init__(parent)
+        self.store = store if store is not None else AnnotationStore()
+        self.selected = set()
+        self.draft = None
+        self.show_labels_below = 300
+        self._bounds = QRectF()
+        self._margin = 8.0
+        self.setZValue(1)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption, True)
+
+    def set_store(self, store):
+        self.store = store
+        self.selected = set()
+        self.draft = None
+        self.update()
+
+    def set_bounds(self, rect):
+        if rect != self._bounds:
+            self.prepareGeometryChange()
+            self._bounds = QRectF(rect)
+
+    def boundingRect(self):
+        return self._bounds
+
+    def _update_box(self, x0, y0, x1, y1):
+        m = self._margin
+        self.update(QRectF(float(x0) - m, float(y0) - m, float(x1 - x0) + 2 * m, float(y1 - y0) + 2 * m))
+
+    def add(self, kind, points, label=''):
+        index = self.store.add(kind, points, label)
+        self._update_box(*self.store.bbox(index))
+        return index
+
+    def remove(self, ids):
+        for index in ids:
+            self._update_box(*self.store.bbox(index))
+        self.store.remove(ids)
+        self.selected.difference_update(int(i) for i in ids)
+
+    def delete_selected(self):
+        ids = sorted(self.selected)
+        self.remove(ids)
+        return ids
+
+    def set_selection(self, ids):
+        changed = self.selected.symmetric_difference(int(i) for i in ids)
+        self.selected = {int(i) for i in ids}
+        for index in changed:
+            self._update_box(*self.store.bbox(index))
+
+    def select_at(self, point, tolerance, extend=False):
+        index = self.store.hit_test(point.x(), point.y(), tolerance)
+        ids = set(self.selected) if extend else set()
+        if index >= 0:
+            ids.symmetric_difference_update({index})
+        self.set_selection(ids)
+        return index
+
+    def select_rect(self, rect, extend=False):
+        rect = rect.normalized()
+        ids = self.store.query(rect.left(), rect.top(), rect.right(), rect.bottom())
+        bbox = self.store.bboxes(ids)
+        # only annotations fully inside the band are picked up
+        inside = ((bbox[:, 0] >= rect.left()) & (bbox[:, 2] <= rect.right())
+                  & (bbox[:, 1] >= rect.top()) & (bbox[:, 3] <= rect.bottom()))
+        ids = {int(i) for i in ids[inside]}
+        self.set_selection(ids | self.selected if extend else ids)
+
+    def set_draft(self, kind, points):
+        old = self.draft
+        self.draft = (kind, list(points)) if points else None
+        for draft in (old, self.draft):
+            if draft is not None:
+                xs = [p.x() for p in draft[1]]
+                ys = [p.y() for p in draft[1]]
+                self._update_box(min(xs), min(ys), max(xs), max(ys))
+
+    def paint(self, painter, option, widget=None):
+        with span('render.annotations') as s:
+            s.set(annotations=self._paint(painter, option))
+
+    def _paint(self, painter, option):
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        self._margin = 8.0 / max(lod, 1e-6)
+        exposed = option.exposedRect
+        store = self.store
+        ids = store.query(exposed.left(), exposed.top(), exposed.right(), exposed.bottom())
+        if len(ids):
+            kinds = store.kinds(ids)
+            labels = store.label_ids(ids)
+            bbox = store.bboxes(ids)
+            # anything under two screen pixels is drawn as a dot
+            tiny = ((bbox[:, 2] - bbox[:, 0]) * lod < 2) & ((bbox[:, 3] - bbox[:, 1]) * lod < 2)
+            for label_id in set(labels.tolist()):
+                group = labels == label_id
+                self._paint_group(painter, ids[group], kinds[group], bbox[group], tiny[group],
+                                  _label_color(label_id))
+            if self.selected:
+                picked = [i for i, index in enumerate(ids) if int(index) in self.selected]
+                self._paint_group(painter, ids[picked], kinds[picked], bbox[picked],
+                                  tiny[picked], QColor(Qt.GlobalColor.white), width=3)
+            if len(ids) <= self.show_labels_below:
+                self._paint_labels(painter, ids, bbox, lod)
+        if self.draft is not None:
+            pen = QPen(QColor(Qt.GlobalColor.yellow), 1, Qt.PenStyle.DashLine)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            kind, points = self.draft
+            if kind == BOX and len(points) == 2:
+                painter.drawRect(QRectF(points[0], points[1]).normalized())
+            else:
+                painter.drawPolyline(QPolygonF(points))
+        return len(ids)
+
+    def _paint_group(self, painter, ids, kinds, bbox, tiny, color, width=1):
+        store = self.store
+        pen = QPen(color, width)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        rects = [QRectF(float(x0), float(y0), float(x1 - x0), float(y1 - y0))
+                 for x0, y0, x1, y1 in bbox[(kinds == BOX) & ~tiny]]
+        if rects:
+            painter.drawRects(rects)
+        for index in ids[((kinds == POLYGON) | (kinds == POLYLINE)) & ~tiny]:
+            polygon = _polygon(store.points(index))
+            if store.kind(index) == POLYGON:
+                painter.drawPolygon(polygon)
+            else:
+                painter.drawPolyline(polygon)
+        dots = bbox[(kinds == POINT) | tiny]
+        if len(dots):
+            pen.setWidth(width + 4 if width > 1 else 5)
+            pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+            painter.setPen(pen)
+            painter.drawPoints(_polygon((dots[:, :2] + dots[:, 2:]) / 2))
+
+    def _paint_labels(self, painter, ids, bbox, lod):
+        store = self.store
+        painter.save()
+        painter.scale(1 / lod, 1 / lod)
+        for index, (x0, y0, _, _) in zip(ids, bbox):
+            text = store.label(index)
+            if text:
+                painter.setPen(_label_color(store.label_ids(index)))
+                painter.drawText(QPointF(float(x0) * lod, float(y0) * lod - 3), text)
+        painter.restore()
@@ -1,7 +1,9 @@
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, pyqtSignal
 from PyQt6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QDoubleSpinBox, QCheckBox, QPushButton, QGroupBox, QWidget
 
 class BandpassFilterDialog(QDialog):
+    values_changed = pyqtSignal()
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("FFT Bandpass Filter")
@@ -16,11 +18,14 @@ class BandpassFilterDialog(QDialog):
         self.small_spin.setRange(0, 10000)
         self.small_spin.setDecimals(0)
         self.small_spin.setSuffix("px")
+        self.large_spin.setValue(40)
+        self.small_spin.setValue(3)
         
         self.suppress_stripes = QCheckBox()
         self.tolearance_spin = QDoubleSpinBox()
+        self.tolearance_spin.setRange(0, 100)
         self.tolearance_spin.setValue(15)
-        self.tolearance_spin.setSuffix("")
+        self.tolearance_spin.setSuffix("%")
         
         self.autoscale_ab = QCheckBox("AutoScale After Filtering")
         self.autoscale_ab.setChecked(True)
@@ -48,7 +53,7 @@ class BandpassFilterDialog(QDialog):
         
         row4 = QHBoxLayout()
         row4.addWidget(QLabel("Tolerance of direction:"))
-        row4.addWidget(self.suppress_stripes)
+        row4.addWidget(self.tolearance_spin)
         params_layout.addLayout(row4)
         
         params_group.setLayout(params_layout)
@@ -72,6 +77,11 @@ class BandpassFilterDialog(QDialog):
         layout.addLayout(btn_layout)
         self.setLayout(layout)
         
+        for spin in (self.large_spin, self.small_spin, self.tolearance_spin):
+            spin.valueChanged.connect(self.values_changed)
+        for box in (self.suppress_stripes, self.autoscale_ab, self.saturated_cb):
+            box.toggled.connect(self.values_changed)
+        
     def get_values(self):
         return {
             "large_cutoff":self.large_spin.value(),
@@ -1,6 +1,8 @@
 from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import QSlider, QDialogButtonBox, QDialog, QVBoxLayout, QCheckBox, QGroupBox, QLabel
 
+from interfaces.histogram_widget import HistogramWidget
+
 class ContrastDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -8,6 +10,9 @@ class ContrastDialog(QDialog):
         
         layout = QVBoxLayout()
         
+        self.histogram = HistogramWidget()
+        layout.addWidget(self.histogram)
+        
         self.auto_contrast = QCheckBox("Auto Contrast")
         self.auto_contrast.setChecked(True)
         self.auto_contrast.toggled.connect(self.toggle_manual)
@@ -0,0 +1,61 @@
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QDoubleSpinBox, QPushButton, QDialogButtonBox
+
+class DisplayRangeDialog(QDialog):
+    def __init__(self, low, high, maximum, auto_range, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Display Range")
+        self.auto_range = auto_range
+        
+        layout = QVBoxLayout()
+        
+        self.min_spin = QDoubleSpinBox()
+        self.min_spin.setRange(0, maximum)
+        self.min_spin.setDecimals(0 if maximum > 1 else 4)
+        self.min_spin.setValue(low)
+        
+        self.max_spin = QDoubleSpinBox()
+        self.max_spin.setRange(0, maximum)
+        self.max_spin.setDecimals(0 if maximum > 1 else 4)
+        self.max_spin.setValue(high)
+        
+        row1 = QHBoxLayout()
+        row1.addWidget(QLabel("Minimum:"))
+        row1.addWidget(self.min_spin)
+        layout.addLayout(row1)
+        
+        row2 = QHBoxLayout()
+        row2.addWidget(QLabel("Maximum:"))
+        row2.addWidget(self.max_spin)
+        layout.addLayout(row2)
+        
+        btn_layout = QHBoxLayout()
+        self.auto_btn = QPushButton("Auto")
+        self.auto_btn.clicked.connect(self.set_auto)
+        self.full_btn = QPushButton("Full Range")
+        self.full_btn.clicked.connect(lambda: self.set_range(0, maximum))
+        btn_layout.addWidget(self.auto_btn)
+        btn_layout.addWidget(self.full_btn)
+        layout.addLayout(btn_layout)
+        
+        self.buttons = QDialogButtonBox(
+            QDialogButtonBox.StandardButton.Ok |
+            QDialogButtonBox.StandardButton.Cancel
+        )
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addWidget(self.buttons)
+        
+        self.setLayout(layout)
+        
+    def set_range(self, low, high):
+        self.min_spin.setValue(low)
+        self.max_spin.setValue(high)
+        
+    def set_auto(self):
+        self.set_range(*self.auto_range)
+        
+    def get_values(self):
+        return {
+            'min': self.min_spin.value(),
+            'max': self.max_spin.value()
+        }
@@ -0,0 +1,137 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, QObject, QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QColor, QPixmap
+from PyQt6.QtWidgets import QDockWidget, QListView, QPushButton, QVBoxLayout, QWidget, QFileDialog, QLabel
+
+from bin.image_buffer import array_to_pixmap
+from bin.thumbnails import ThumbnailCache
+
+
+class _Signals(QObject):
+    ready = pyqtSignal(int, str, object)
+
+
+class ThumbnailModel(QAbstractListModel):
+    def __init__(self, cache=None, workers=None, memory_items=1024, parent=None):
+        super().__init__(parent)
+        self.cache = cache or ThumbnailCache()
+        self.paths = []
+        self.memory_items = memory_items
+        self.workers = workers or min(8, max(2, (os.cpu_count() or 2) // 2))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._signals = _Signals(self)
+        self._signals.ready.connect(self._on_ready)
+        self._pixmaps = OrderedDict()
+        self._wanted = OrderedDict()
+        self._running = set()
+        self._generation = 0
+        self._placeholder = QPixmap(self.cache.size, self.cache.size)
+        self._placeholder.fill(QColor(60, 60, 60))
+
+    def set_folder(self, folder):
+        self.beginResetModel()
+        self._generation += 1
+        self._wanted.clear()
+        self._running.clear()
+        with os.scandir(folder) as it:
+            self.paths = sorted(e.path for e in it if e.is_file() and e.name.lower().endswith(('.tif', '.tiff')))
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return os.path.basename(path)
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return path
+        if role == Qt.ItemDataRole.DecorationRole:
+            pixmap = self._pixmaps.get(path)
+            if pixmap is not None:
+                self._pixmaps.move_to_end(path)
+                return pixmap
+            # the view only asks for visible rows, so scrolling drives the loading
+            self._request(index.row(), path)
+            return self._placeholder
+        return None
+
+    def _request(self, row, path):
+        if path in self._running:
+            return
+        self._wanted[path] = row
+        self._wanted.move_to_end(path)
+        self._pump()
+
+    def _pump(self):
+        # newest requests first, stale ones from rows scrolled past wait behind them
+        while self._wanted and len(self._running) < self.workers:
+            path, row = self._wanted.popitem(last=True)
+            self._running.add(path)
+            self._pool.submit(self._load, self._generation, row, path)
+
+    def _load(self, generation, row, path):
+        try:
+            thumb = self.cache.thumbnail(path)
+        except Exception:
+            thumb = None
+        self._signals.ready.emit(generation, path, (row, thumb))
+
+    def _on_ready(self, generation, path, result):
+        if generation != self._generation:
+            return
+        self._running.discard(path)
+        row, thumb = result
+        pixmap = array_to_pixmap(thumb) if thumb is not None else self._placeholder
+        self._pixmaps[path] = pixmap
+        while len(self._pixmaps) > self.memory_items:
+            self._pixmaps.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+        self._pump()
+
+    def close(self):
+        self._generation += 1
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class FolderBrowser(QDockWidget):
+    file_activated = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__("Folder", parent)
+        self.model = ThumbnailModel(parent=self)
+        self.folder = None
+
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        self.choose_button = QPushButton("Choose Folder...")
+        self.choose_button.clicked.connect(self.choose_folder)
+        self.folder_label = QLabel()
+        self.list_view = QListView()
+        self.list_view.setViewMode(QListView.ViewMode.IconMode)
+        self.list_view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setIconSize(QSize(self.model.cache.size, self.model.cache.size))
+        self.list_view.setGridSize(QSize(self.model.cache.size + 24, self.model.cache.size + 36))
+        self.list_view.setModel(self.model)
+        self.list_view.activated.connect(lambda index: self.file_activated.emit(self.model.paths[index.row()]))
+        layout.addWidget(self.choose_button)
+        layout.addWidget(self.folder_label)
+        layout.addWidget(self.list_view)
+        self.setWidget(widget)
+
+    def choose_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "打开文件夹", self.folder or "")
+        if folder:
+            self.set_folder(folder)
+
+    def set_folder(self, folder):
+        self.folder = folder
+        self.folder_label.setText(folder)
+        self.model.set_folder(folder)
@@ -0,0 +1,65 @@
+import numpy as np
+from PyQt6.QtCore import QPointF, Qt
+from PyQt6.QtGui import QColor, QPainter, QPen, QPolygonF
+from PyQt6.QtWidgets import QWidget
+
+_MONO = [QColor(200, 200, 200)]
+_RGB = [QColor(230, 70, 70), QColor(70, 200, 70), QColor(80, 120, 240)]
+
+
+class HistogramWidget(QWidget):
+    def __init__(self, columns=256, parent=None):
+        super().__init__(parent)
+        self.columns = columns
+        self.setMinimumSize(columns, 90)
+        self._curves = []
+        self._range = (0.0, 1.0)
+        self._window = None
+
+    def set_statistics(self, stats):
+        #Folds the bins into screen columns once, cost depends on the bin count only
+        low, high = stats.range()
+        span = max(high - low, 1e-12)
+        self._range = (low, high)
+        self._curves = []
+        for c in range(stats.channels):
+            values = stats.bin_values(c)
+            index = np.clip(((values - low) / span * self.columns).astype(np.int64), 0, self.columns - 1)
+            counts = np.bincount(index, weights=stats.counts[c], minlength=self.columns)
+            self._curves.append(np.log1p(counts))
+        top = max((curve.max() for curve in self._curves), default=0)
+        if top > 0:
+            self._curves = [curve / top for curve in self._curves]
+        self.update()
+
+    def set_window(self, low, high):
+        self._window = (low, high)
+        self.update()
+
+    def _x(self, value):
+        low, high = self._range
+        return (value - low) / max(high - low, 1e-12) * self.width()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(30, 30, 30))
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        width, height = self.width(), self.height()
+        colors = _MONO if len(self._curves) == 1 else _RGB
+        step = width / self.columns
+        for curve, color in zip(self._curves, colors):
+            points = [QPointF(0, height)]
+            points += [QPointF((i + 0.5) * step, height * (1 - v)) for i, v in enumerate(curve)]
+            points.append(QPointF(width, height))
+            fill = QColor(color)
+            fill.setAlpha(90 if len(self._curves) > 1 else 160)
+            painter.setPen(QPen(color, 1))
+            painter.setBrush(fill)
+            painter.drawPolygon(QPolygonF(points))
+        if self._window is not None:
+            painter.setPen(QPen(QColor(255, 210, 0), 1, Qt.PenStyle.DashLine))
+            for value in self._window:
+                x = self._x(value)
+                if 0 <= x <= width:
+                    painter.drawLine(QPointF(x, 0), QPointF(x, height))
+        painter.end()
@@ -0,0 +1,76 @@
+from PyQt6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QCheckBox, QDialogButtonBox, QGroupBox
+
+class SaveOptionsDialog(QDialog):
+    def __init__(self, image, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("TIFF Options")
+
+        layout = QVBoxLayout()
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        layout.addWidget(QLabel(f"{image.shape[1]} x {image.shape[0]}, {channels} channel(s), {image.dtype}"))
+
+        #Files that cannot fit in 4 GB are always written as BigTIFF
+        self.needs_bigtiff = image.nbytes > 2 ** 32 - 2 ** 25
+        self.compression_combo = QComboBox()
+        self.compression_combo.addItem("None", 'none')
+        if not self.needs_bigtiff:
+            self.compression_combo.addItem("LZW", 'lzw')
+        self.compression_combo.addItem("Deflate", 'deflate')
+
+        self.preset_combo = QComboBox()
+        self.preset_combo.addItem("Fastest", 'fastest')
+        self.preset_combo.addItem("Balanced", 'balanced')
+        self.preset_combo.addItem("Smallest", 'smallest')
+        self.preset_combo.setCurrentIndex(1)
+
+        self.tiled_cb = QCheckBox("Tiled (512 x 512)")
+        self.bigtiff_cb = QCheckBox("BigTIFF")
+        self.bigtiff_cb.setChecked(self.needs_bigtiff)
+
+        options_group = QGroupBox("Compression")
+        options_layout = QVBoxLayout()
+        row1 = QHBoxLayout()
+        row1.addWidget(QLabel("Method:"))
+        row1.addWidget(self.compression_combo)
+        options_layout.addLayout(row1)
+        row2 = QHBoxLayout()
+        row2.addWidget(QLabel("Speed / Size:"))
+        row2.addWidget(self.preset_combo)
+        options_layout.addLayout(row2)
+        options_group.setLayout(options_layout)
+        layout.addWidget(options_group)
+
+        layout_group = QGroupBox("Layout")
+        layout_layout = QVBoxLayout()
+        layout_layout.addWidget(self.tiled_cb)
+        layout_layout.addWidget(self.bigtiff_cb)
+        layout_group.setLayout(layout_layout)
+        layout.addWidget(layout_group)
+
+        self.compression_combo.currentIndexChanged.connect(self.update_options)
+        self.update_options()
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+
+    def update_options(self):
+        compression = self.compression_combo.currentData()
+        self.preset_combo.setEnabled(compression != 'none')
+        #LZW is written through libtiff, which only produces classic striped files here
+        lzw = compression == 'lzw'
+        self.tiled_cb.setEnabled(not lzw)
+        self.bigtiff_cb.setEnabled(not lzw and not self.needs_bigtiff)
+        if lzw:
+            self.tiled_cb.setChecked(False)
+            self.bigtiff_cb.setChecked(False)
+
+    def get_values(self):
+        return {
+            'compression': self.compression_combo.currentData(),
+            'preset': self.preset_combo.currentData(),
+            'tile': 512 if self.tiled_cb.isChecked() else None,
+            'bigtiff': True if self.bigtiff_cb.isChecked() else None,
+        }
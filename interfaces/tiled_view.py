@@ -0,0 +1,201 @@
+import math
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PyQt6.QtCore import QRectF
+from PyQt6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+from bin import memory
+from bin.image_buffer import array_to_pixmap
+from bin.tracing import span
+
+
+def half(image):
+    size = ((image.shape[1] + 1) // 2, (image.shape[0] + 1) // 2)
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def pyramid(image, max_side):
+    # image followed by its halvings down to max_side, built off the GUI thread by loaders
+    levels = [image]
+    while max(levels[-1].shape[:2]) > max_side:
+        levels.append(half(levels[-1]))
+    return levels
+
+
+class ViewportProxy:
+    # a pyramid level crop of the visible region; halo pixels around it feed
+    # neighbourhood ops and are cut off again by inner()
+    def __init__(self, image, rect, inner_box, scale, halo):
+        self.image = image
+        self.rect = rect
+        self.inner_box = inner_box
+        self.scale = scale
+        self.halo = halo
+
+    def inner(self, result):
+        top, left, height, width = self.inner_box
+        return result[top:top + height, left:left + width]
+
+
+class TiledImageItem(QGraphicsItem):
+    def __init__(self, tile_size=512, cache_bytes=256 * 1024 * 1024, parent=None):
+        super().__init__(parent)
+        self.tile_size = tile_size
+        self.cache_bytes = cache_bytes
+        self.image = None
+        self.render = None
+        self.levels = []
+        self.shape = None
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._overlay = None
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption, True)
+        memory.register_cache(self)
+
+    def set_image(self, image, render=None, levels=None, shape=None):
+        # shape is the size the image is shown at, a preview is stretched to cover it
+        self._overlay = None
+        if image is self.image:
+            self.render = render
+            self.invalidate()
+            return
+        shape = tuple(shape or image.shape[:2])
+        if shape != self.shape:
+            self.prepareGeometryChange()
+            self.shape = shape
+        self.image = image
+        self.render = render
+        self.levels = list(levels) if levels else [image]
+        self.invalidate()
+
+    def clear(self):
+        self.prepareGeometryChange()
+        self.image = None
+        self.render = None
+        self.levels = []
+        self.shape = None
+        self._overlay = None
+        self.invalidate()
+
+    @property
+    def is_preview(self):
+        return self.image is not None and self.image.shape[:2] != self.shape
+
+    def invalidate(self):
+        self._cache.clear()
+        self._cached_bytes = 0
+        self.update()
+
+    def boundingRect(self):
+        if self.image is None:
+            return QRectF()
+        return QRectF(0, 0, self.shape[1], self.shape[0])
+
+    def _level_index(self, lod):
+        return 0 if lod >= 1 else min(int(math.log2(1 / lod)), self._max_level())
+
+    def proxy(self, rect, lod, halo=0, margin=0.25):
+        # the visible rect plus a margin, taken from the pyramid level that is drawn at this zoom
+        if self.image is None:
+            return None
+        index = self._level_index(lod)
+        level = self.level(index)
+        height, width = self.shape
+        scale_x = width / level.shape[1]
+        scale_y = height / level.shape[0]
+        rect = rect.adjusted(-rect.width() * margin, -rect.height() * margin,
+                             rect.width() * margin, rect.height() * margin).intersected(self.boundingRect())
+        x0 = max(0, int(rect.left() / scale_x))
+        y0 = max(0, int(rect.top() / scale_y))
+        x1 = max(x0 + 1, min(level.shape[1], math.ceil(rect.right() / scale_x)))
+        y1 = max(y0 + 1, min(level.shape[0], math.ceil(rect.bottom() / scale_y)))
+        # context wider than the region itself changes little on screen
+        pad = min(math.ceil(halo / scale_x), max(x1 - x0, y1 - y0))
+        hx0, hy0 = max(0, x0 - pad), max(0, y0 - pad)
+        hx1, hy1 = min(level.shape[1], x1 + pad), min(level.shape[0], y1 + pad)
+        return ViewportProxy(np.ascontiguousarray(level[hy0:hy1, hx0:hx1]),
+                             QRectF(x0 * scale_x, y0 * scale_y, (x1 - x0) * scale_x, (y1 - y0) * scale_y),
+                             (y0 - hy0, x0 - hx0, y1 - y0, x1 - x0), scale_x, halo)
+
+    def set_overlay(self, image, rect, render=None):
+        # a processed proxy drawn over its rect until the next set_image
+        render = render or self.render
+        if render is not None:
+            image = render(image)
+        self._overlay = (array_to_pixmap(image), QRectF(rect))
+        self.update()
+
+    def clear_overlay(self):
+        if self._overlay is not None:
+            self._overlay = None
+            self.update()
+
+    def _max_level(self):
+        if self.is_preview:
+            return 0
+        height, width = self.shape
+        return max(0, math.ceil(math.log2(max(width, height) / self.tile_size)))
+
+    def level(self, index):
+        # levels past the ones passed to set_image are only built here, from the smallest held
+        while len(self.levels) <= index:
+            self.levels.append(half(self.levels[-1]))
+        return self.levels[index]
+
+    def memory_usage(self):
+        return sum(level.nbytes for level in self.levels[1:])
+
+    def release(self):
+        # under memory pressure, possibly from a worker thread: only references are dropped,
+        # the halvings come back when a zoomed out view is next drawn
+        self.levels = self.levels[:1]
+
+    def _tile(self, index, row, col):
+        key = (index, row, col)
+        pixmap = self._cache.get(key)
+        if pixmap is not None:
+            self._cache.move_to_end(key)
+            return pixmap
+        size = self.tile_size
+        tile = self.level(index)[row * size:(row + 1) * size, col * size:(col + 1) * size]
+        if self.render is not None:
+            tile = self.render(tile)
+        pixmap = array_to_pixmap(tile)
+        self._cache[key] = pixmap
+        self._cached_bytes += pixmap.width() * pixmap.height() * 4
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cached_bytes -= old.width() * old.height() * 4
+        return pixmap
+
+    def paint(self, painter, option, widget=None):
+        if self.image is None:
+            return
+        with span('render.paint') as s:
+            s.set(tiles=self._paint(painter, option))
+        if self._overlay is not None:
+            pixmap, target = self._overlay
+            painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+
+    def _paint(self, painter, option):
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        index = self._level_index(lod)
+        level = self.level(index)
+        height, width = self.shape
+        scale_x = width / level.shape[1]
+        scale_y = height / level.shape[0]
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        size = self.tile_size
+        col0 = max(0, int(exposed.left() / scale_x) // size)
+        col1 = min((level.shape[1] - 1) // size, int(exposed.right() / scale_x) // size)
+        row0 = max(0, int(exposed.top() / scale_y) // size)
+        row1 = min((level.shape[0] - 1) // size, int(exposed.bottom() / scale_y) // size)
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                pixmap = self._tile(index, row, col)
+                target = QRectF(col * size * scale_x, row * size * scale_y,
+                                pixmap.width() * scale_x, pixmap.height() * scale_y)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        return (row1 - row0 + 1) * (col1 - col0 + 1)
@@ -1,11 +1,44 @@
-import sys,os
-from PyQt6.QtWidgets import QApplication, QMainWindow, QGraphicsView, QGraphicsScene, QFileDialog, QMessageBox, QDialog
-from PyQt6.QtGui import QImage, QPixmap, QPainter, QKeySequence, QShortcut
-from PyQt6.QtCore import Qt
-import cv2
-import numpy as np
-import bin.image_processor as image_processor
-from interfaces import BandpassFilterDialog, ContrastDialog
+import sys,os,time,threading
+from PyQt6.QtWidgets import QApplication, QMainWindow, QGraphicsView, QGraphicsScene, QFileDialog, QMessageBox, QDialog, QLabel, QVBoxLayout, QProgressBar, QInputDialog
+from PyQt6.QtGui import QPainter, QKeySequence, QShortcut, QActionGroup
+from PyQt6.QtCore import Qt, QTimer, QRectF, QObject, QEvent
+from bin.history import OperationHistory
+from bin.job_runner import JobRunner
+from bin.tracing import tracer, span
+
+#numpy, cv2 and everything built on them are imported on first use, or by
+#preload_modules once the window is up, so they stay off the cold start path
+PRELOAD_MODULES = ('numpy', 'cv2', 'bin.image_processor', 'bin.display_window', 'bin.tiff_reader',
+                   'bin.sidecar', 'interfaces.tiled_view', 'interfaces.annotation_layer')
+
+#Pages larger than twice this are first shown from a reduced read
+PREVIEW_SIDE = 2048
+
+#Job targets Esc and closing the window may cancel, a running save is never among them
+PROCESSING_TARGETS = ('image', 'preview')
+
+def preload_modules():
+    import importlib
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+
+def report_startup(event, last=False):
+    #VIT_STARTUP_REPORT=1 prints startup milestones, =exit also quits after the last one
+    if os.environ.get('VIT_STARTUP_REPORT'):
+        print(f"startup {event} {time.time():.6f}", flush=True)
+        if last and os.environ.get('VIT_STARTUP_REPORT') == 'exit':
+            QApplication.quit()
+
+class _FirstPaint(QObject):
+    def __init__(self, viewer):
+        super().__init__(viewer)
+        self.viewer = viewer
+    
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and self.viewer.image is not None:
+            obj.removeEventFilter(self)
+            QTimer.singleShot(0, lambda: report_startup('pixels', last=True))
+        return False
 
 class TIFFViewer(QMainWindow):
     def __init__(self):
@@ -14,13 +47,40 @@ class TIFFViewer(QMainWindow):
         self.initUI()
         self.setWindowTitle("TIFF Viewer")
         self.resize(800, 600)
-        self.image_processor = image_processor.ImageProcessor()
+        self._image_processor = None
+        self.history = OperationHistory(lambda image, ops: self.image_processor.apply_operations(image, ops))
         self.zoom_factor = 1.1
+        self._image = None
+        self._display_window = None
+        self.stack = None
+        self.prefetcher = None
+        self.page_index = 0
+        self.annotation_stores = {}
+        self.sidecar = None
+        self.current_file_path = None
+        self._result_cache = None
+        self._close_after_save = False
+        #History index an undo/redo replay is heading to, None when none is running
+        self._history_target = None
         
     def initUI(self):
+        self.jobs = JobRunner(self)
+        self.jobs.progress.connect(lambda target, value: self.progress_bar.setValue(value))
+        self.jobs.busy_changed.connect(self._set_busy)
+        self.jobs.failed.connect(
+            lambda target, message: QMessageBox.critical(self, "错误", f"操作失败: {message}")
+        )
         self.view = QGraphicsView(self)
         self.scene = QGraphicsScene(self)
         self.view.setScene(self.scene)
+        self._image_item = None
+        self._annotations = None
+        self._folder_browser = None
+        self.annotate_mode = 'pan'
+        self.annotation_label = ''
+        self.draft_points = []
+        self._rubber_rect = None
+        self.view.rubberBandChanged.connect(self._on_rubber_band)
         self.setCentralWidget(self.view)
         self.dragging = False
         self.last_mouse_pos = None
@@ -30,21 +90,45 @@ class TIFFViewer(QMainWindow):
         
         #Create Menu
         file_menu = menubar.addMenu("Files")
+        edit_menu = menubar.addMenu("Edit")
         tool_menu = menubar.addMenu("Adjust")
+        stack_menu = menubar.addMenu("Stack")
+        annotate_menu = menubar.addMenu("Annotate")
         helps_menu = menubar.addMenu('Help')
     
         log_action = tool_menu.addAction("Log Transfer")
         log_action.triggered.connect(self.apply_log)
         
+        undo_action = edit_menu.addAction("Undo")
+        undo_action.setShortcut(QKeySequence("Ctrl+Z"))
+        undo_action.triggered.connect(self.undo)
+        
+        redo_action = edit_menu.addAction("Redo")
+        redo_action.setShortcuts([QKeySequence("Ctrl+Shift+Z"), QKeySequence("Ctrl+Y")])
+        redo_action.triggered.connect(self.redo)
+        
+        cancel_action = edit_menu.addAction("Cancel Operation")
+        cancel_action.setShortcut(QKeySequence("Esc"))
+        cancel_action.triggered.connect(self.cancel_operation)
+        
+        invert_action = tool_menu.addAction("Invert")
+        invert_action.triggered.connect(self.apply_invert)
+        
         reverse_action = tool_menu.addAction("Reverse Image")
         reverse_action.triggered.connect(self.reset)
         
         open_action = file_menu.addAction("Open TIF File")
         open_action.triggered.connect(self.open_tif_file)
         
+        open_folder = file_menu.addAction("Open Folder...")
+        open_folder.triggered.connect(self.open_folder)
+        
         save_action = file_menu.addAction("Save File")
         save_action.triggered.connect(self.save_action)
         
+        export_annotations = file_menu.addAction("Export Annotations...")
+        export_annotations.triggered.connect(self.export_annotations)
+        
         exit_action = file_menu.addAction("exit")
         exit_action.triggered.connect(self.close)
         
@@ -60,12 +144,75 @@ class TIFFViewer(QMainWindow):
         adjust_rest = tool_menu.addAction("Reset")
         adjust_rest.triggered.connect(self.rest_change)
         
+        next_page = stack_menu.addAction("Next Page")
+        next_page.setShortcut(QKeySequence("PgDown"))
+        next_page.triggered.connect(lambda: self.show_page(self.page_index + 1))
+        
+        prev_page = stack_menu.addAction("Previous Page")
+        prev_page.setShortcut(QKeySequence("PgUp"))
+        prev_page.triggered.connect(lambda: self.show_page(self.page_index - 1))
+        
+        mode_group = QActionGroup(self)
+        for name, shortcut in (('Pan', 'H'), ('Select', 'S'), ('Point', 'P'), ('Box', 'B'), ('Polygon', 'G'), ('Polyline', 'L')):
+            mode_action = annotate_menu.addAction(name)
+            mode_action.setCheckable(True)
+            mode_action.setChecked(name == 'Pan')
+            mode_action.setShortcut(QKeySequence(shortcut))
+            mode_action.setData(name.lower())
+            mode_group.addAction(mode_action)
+        mode_group.triggered.connect(lambda action: self.set_annotate_mode(action.data()))
+        annotate_menu.addSeparator()
+        
+        label_action = annotate_menu.addAction("Set Label...")
+        label_action.triggered.connect(self.set_annotation_label)
+        
+        finish_action = annotate_menu.addAction("Finish Shape")
+        finish_action.setShortcuts([QKeySequence("Return"), QKeySequence("Enter")])
+        finish_action.triggered.connect(self.finish_shape)
+        
+        delete_action = annotate_menu.addAction("Delete Selected")
+        delete_action.setShortcut(QKeySequence("Delete"))
+        delete_action.triggered.connect(self.delete_annotations)
+        
+        self.page_label = QLabel()
+        self.statusBar().addPermanentWidget(self.page_label)
+        self.memory_label = QLabel()
+        self.statusBar().addPermanentWidget(self.memory_label)
+        self.memory_timer = QTimer(self)
+        self.memory_timer.setInterval(1000)
+        self.memory_timer.timeout.connect(self._update_memory_label)
+        self.memory_timer.start()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.hide()
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        
+        self.trace_action = helps_menu.addAction("Enable Tracing")
+        self.trace_action.setCheckable(True)
+        self.trace_action.setChecked(tracer.enabled)
+        self.trace_action.toggled.connect(self.toggle_tracing)
+        
+        export_trace = helps_menu.addAction("Export Trace...")
+        export_trace.triggered.connect(self.export_trace)
+        
+        self.trace_label = QLabel()
+        self.statusBar().addWidget(self.trace_label)
+        self.trace_timer = QTimer(self)
+        self.trace_timer.setInterval(250)
+        self.trace_timer.timeout.connect(self._update_trace_label)
+        if tracer.enabled:
+            self.trace_timer.start()
+        
         about_action = helps_menu.addAction("About")
         about_action.triggered.connect(self.show_about)
         
         contrast_dialog = tool_menu.addAction("Contrast...")
         contrast_dialog.triggered.connect(self.adjust_contrast)
         
+        display_range = tool_menu.addAction("Display Range...")
+        display_range.triggered.connect(self.adjust_display_range)
+        
         #Hot Keys
         save_shortcut = QShortcut(QKeySequence("Ctrl+S"),self)
         save_shortcut.activated.connect(self.save_action)
@@ -75,7 +222,7 @@ class TIFFViewer(QMainWindow):
         self.view.wheelEvent = self.wheelEvent
         self.view.setDragMode(QGraphicsView.DragMode.ScrollHandDrag)
         self.view.setInteractive(True)
-        self.view.setRenderHint(QPainter.RenderHint.Antialiasing)
+        self.view.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
     
         tool_menu.addAction("Drag")
         tool_menu.triggered.connect(self.toggle_move)
@@ -87,57 +234,240 @@ class TIFFViewer(QMainWindow):
         self.view.mousePressEvent = self.mousePressEvent
         self.view.mouseMoveEvent = self.mouseMoveEvent 
         self.view.mouseReleaseEvent = self.mouseReleaseEvent
+        self.view.mouseDoubleClickEvent = self.mouseDoubleClickEvent
         
+    @property
+    def image(self):
+        return self._image.array if self._image is not None else None
+    
+    @image.setter
+    def image(self, img):
+        #Only the memory Buffer is kept, so spilling or deduplicating a frame really frees it;
+        #the frame on screen is pinned in memory
+        buffer = None
+        if img is not None:
+            from bin import memory
+            buffer = memory.track(img, 'state', pin=True)
+        if self._image is not None:
+            self._image.unpin()
+        self._image = buffer
+    
+    @property
+    def image_processor(self):
+        if self._image_processor is None:
+            import bin.image_processor as image_processor
+            self._image_processor = image_processor.ImageProcessor()
+        return self._image_processor
+    
+    @property
+    def display_window(self):
+        if self._display_window is None:
+            from bin.display_window import DisplayWindow
+            self._display_window = DisplayWindow(on_change=self._window_changed)
+        return self._display_window
+    
+    def _window_changed(self):
+        #Tiles rendered with the old window would not match new ones
+        if self._image_item is not None:
+            self._image_item.invalidate()
+    
+    @property
+    def result_cache(self):
+        #Processed pages persist on disk, revisiting a file with the same recipe maps them back in
+        if self._result_cache is None:
+            from bin.result_cache import ResultCache
+            self._result_cache = ResultCache()
+        return self._result_cache
+    
+    @property
+    def image_item(self):
+        if self._image_item is None:
+            from interfaces import TiledImageItem
+            self._image_item = TiledImageItem()
+            self.scene.addItem(self._image_item)
+        return self._image_item
+    
+    @property
+    def annotations(self):
+        #Annotations live in their own item, image updates never touch it
+        if self._annotations is None:
+            from interfaces import AnnotationLayerItem
+            self._annotations = AnnotationLayerItem()
+            self.scene.addItem(self._annotations)
+        return self._annotations
+    
+    @property
+    def folder_browser(self):
+        if self._folder_browser is None:
+            from interfaces import FolderBrowser
+            self._folder_browser = FolderBrowser(self)
+            self._folder_browser.file_activated.connect(self.open_path)
+            self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, self._folder_browser)
+        return self._folder_browser
+    
     def adjust_contrast(self):
-        if not self.scene.items():
+        if self.image is None:
             QMessageBox.warning(self, "Warning","No existing Image")
             return
         
-        dialog = ContrastDialog()
-        dialog.show()
-        orginal_img = self.scene.items()[0].pixmap()
-        dialog.brightness_slider.valueChanged.connect(
-            lambda: self.preview_contrast(orginal_img,dialog.get_value())
-        )
-        dialog.contrast_slider.valueChanged.connect(
-            lambda: self.preview_contrast(orginal_img,dialog.get_value())
-        )
-        dialog.auto_contrast.toggled.connect(
-            lambda: self.preview_contrast(orginal_img, dialog.get_value())
-        )
+        import bin.image_processor as image_processor
+        from bin.histogram import image_statistics
+        from interfaces import ContrastDialog
+        dialog = ContrastDialog(self)
+        orginal_img = self.image
+        orginal_range = self.display_window.range
+        self.display_window.full_range(orginal_img)
+        ranges = image_processor.channel_ranges(orginal_img)
+        #Both come from the same cached histogram, the markers follow the sliders
+        dialog.histogram.set_statistics(image_statistics(orginal_img))
+        def update_window():
+            dialog.histogram.set_window(*image_processor.contrast_window(orginal_img, dialog.get_value()))
+        update_window()
+        def schedule_preview():
+            update_window()
+            request_preview()
+        request_preview, preview_timer = self._preview_scheduler(
+            dialog, lambda: [('contrast', dialog.get_value())], ranges)
+        dialog.brightness_slider.valueChanged.connect(schedule_preview)
+        dialog.contrast_slider.valueChanged.connect(schedule_preview)
+        dialog.auto_contrast.toggled.connect(schedule_preview)
         
-        if dialog.exec() == QDialog.DialogCode.Accepted:
+        accepted = dialog.exec() == QDialog.DialogCode.Accepted
+        preview_timer.stop()
+        self.jobs.cancel('preview')
+        if accepted:
             params = dialog.get_value()
-            self.apply_contrast(orginal_img, params)
+            self.apply_contrast(orginal_img, params, ranges)
         else:
-            self.scene.clear()
-            self.scene.addPixmap(orginal_img)
-        
-            
+            self.display_window.set_range(*orginal_range)
+            self._show_image(orginal_img)
+    
+    def _viewport_proxy(self, halo=0):
+        #Previews only process what is on screen, at the pyramid level drawn at this zoom
+        rect = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+        return self.image_item.proxy(rect, self.view.transform().m11(), halo)
+    
+    def _preview_scheduler(self, dialog, operations, ranges=None, render=None):
+        #Coalesce changes, only the latest value gets rendered
+        import bin.image_processor as image_processor
+        timer = QTimer(dialog)
+        timer.setSingleShot(True)
+        timer.setInterval(15)
+        dirty = [False]
+        proxy = [None]
+        def run():
+            if self.jobs.is_busy('preview'):
+                dirty[0] = True
+                return
+            current = operations()
+            #The same proxy is reused while its halo suffices, which keeps the FFT spectrum cached
+            halo = image_processor.operations_halo(current)
+            if proxy[0] is None or proxy[0].halo < halo:
+                proxy[0] = self._viewport_proxy(halo)
+            self.preview_operations(proxy[0], current, ranges, done, render)
+        def done():
+            #Also called when a preview fails or is superseded, so a change made meanwhile is not lost;
+            #once the dialog is closed nothing is left to render
+            if dirty[0] and dialog.isVisible():
+                dirty[0] = False
+                run()
+        timer.timeout.connect(run)
+        def schedule():
+            if not timer.isActive():
+                timer.start()
+        return schedule, timer
             
-    def preview_contrast(self, img, params): 
-        processed = self.image_processor.adjust_contrast(img, params)
-        self.scene.clear()
-        self.scene.addPixmap(processed)
-        
-    def apply_contrast(self, img, params):
-        processed = self.image_processor.adjust_contrast(img, params)
-        self.scene.clear()
-        self.scene.addPixmap(processed)
+    def preview_operations(self, proxy, operations, ranges=None, on_done=None, render=None):
+        def show(processed):
+            self.image_item.set_overlay(processed, proxy.rect, render and render(operations))
+            if on_done is not None:
+                on_done()
+        self.jobs.submit('preview', lambda job: self.image_processor.preview(proxy, operations, ranges), show,
+                         on_abandoned=on_done)
+        
+    def apply_contrast(self, img, params, ranges=None):
+        self.jobs.submit(
+            'image',
+            self._pyramid_job(self._cached_job(
+                [('contrast', params)], lambda job: self.image_processor.adjust_contrast(img, params, ranges))),
+            lambda result: self._commit_image(result, 'contrast', params)
+        )
+    
+    def _cached_job(self, operations, compute):
+        #Keyed on the file, page and the whole chain since the last reset; captured here,
+        #on the GUI thread, because the history may move while the job runs
+        path = self.current_file_path
+        if path is None:
+            return compute
+        page = self.page_index
+        chain = self.history.entries[:self.history.cursor] + list(operations)
+        cache = self.result_cache
+        def run(job):
+            cached = cache.get(path, page, chain)
+            if cached is not None:
+                return cached
+            processed = compute(job)
+            cache.put_later(path, page, chain, processed)
+            return processed
+        return run
+    
+    def _pyramid_job(self, compute):
+        #The halvings are built on the worker, a zoomed out paint would build them on the GUI thread
+        from interfaces.tiled_view import pyramid
+        def run(job):
+            processed = compute(job)
+            return processed, pyramid(processed, PREVIEW_SIDE)
+        return run
 
         
     def apply_banpass_filter(self):
-        if not self.scene.items():
+        if self.image is None:
             QMessageBox.warning(self,"Warning", "No present image")
             return
-        dialog = BandpassFilterDialog()
-        if dialog.exec() == QDialog.DialogCode.Accepted:
+        from interfaces import BandpassFilterDialog
+        dialog = BandpassFilterDialog(self)
+        img = self.image
+        from bin.display_window import DisplayWindow
+        def render(operations):
+            #Autoscaled results are committed unwindowed, the preview is shown the same way
+            if not operations[0][1]['autoscale']:
+                return None
+            window = DisplayWindow()
+            window.full_range(img)
+            return window.apply
+        schedule_preview, preview_timer = self._preview_scheduler(
+            dialog, lambda: [('bandpass', dialog.get_values())], render=render)
+        dialog.values_changed.connect(schedule_preview)
+        accepted = dialog.exec() == QDialog.DialogCode.Accepted
+        preview_timer.stop()
+        self.jobs.cancel('preview')
+        if not accepted:
+            self.image_item.clear_overlay()
+        else:
             params = dialog.get_values()
-            pixmap = self.scene.items()[0].pixmap()
-            processed = self.image_processor.apply_banpass_filter(pixmap, params)
-            self.scene.clear()
-            self.scene.addPixmap(processed)
-            #Diplay Filter Not Implmented
+            #The overlay stays up until the full resolution result replaces it
+            filtered = self._pyramid_job(self._cached_job(
+                [('bandpass', params)], lambda job: self.image_processor.apply_banpass_filter(img, params, job.set_progress)))
+            def run(job):
+                processed = filtered(job)
+                mask = self.image_processor.bandpass_filter_image(img, params) if params['display_filter'] else None
+                return processed, mask
+            def done(result):
+                processed, mask = result
+                self._commit_image(processed, 'bandpass', params, full_range=params['autoscale'])
+                if mask is not None:
+                    self._show_filter(mask)
+            self.jobs.submit('image', run, done)
+    
+    def _show_filter(self, mask):
+        from bin.image_buffer import array_to_pixmap
+        window = QDialog(self)
+        window.setWindowTitle("Filter")
+        label = QLabel(window)
+        label.setPixmap(array_to_pixmap(mask))
+        layout = QVBoxLayout(window)
+        layout.addWidget(label)
+        window.show()
             
     def toggle_move(self, checked):
         self.move_mode = checked
@@ -149,33 +479,251 @@ class TIFFViewer(QMainWindow):
             self.view.setCursor(Qt.CursorShape.ArrowCursor)
         
     def mousePressEvent(self, a0):
+        if self._is_drawing() and a0.button() == Qt.MouseButton.LeftButton:
+            point = self._scene_point(a0)
+            if self.annotate_mode == 'point':
+                self._add_annotation('point', [point])
+            elif self.annotate_mode == 'box':
+                self.draft_points = [point, point]
+                self.annotations.set_draft('box', self.draft_points)
+            else:
+                self.draft_points.append(point)
+                self.annotations.set_draft(self.annotate_mode, self.draft_points + [point])
+            return
         if self.move_mode and a0.button()==Qt.MouseButton.LeftButton:
             self.view.setCursor(Qt.CursorShape.ClosedHandCursor)
             self.orginal_mousePress(a0)
         else:
             self.orginal_mousePress(a0)
     def mouseMoveEvent(self, a0):
+        if self._is_drawing() and self.draft_points:
+            point = self._scene_point(a0)
+            if self.annotate_mode == 'box':
+                self.draft_points[1] = point
+                self.annotations.set_draft('box', self.draft_points)
+            else:
+                self.annotations.set_draft(self.annotate_mode, self.draft_points + [point])
+            return
         self.orginal_mouseMove(a0)
     def mouseReleaseEvent(self, a0):
+        if self._is_drawing():
+            if self.annotate_mode == 'box' and len(self.draft_points) == 2:
+                self._add_annotation('box', self.draft_points)
+            return
         if self.move_mode and a0.button() == Qt.MouseButton.LeftButton:
             self.view.setCursor(Qt.CursorShape.OpenHandCursor)
         self.orginal_mouseRelease(a0)
+        if self.annotate_mode == 'select' and a0.button() == Qt.MouseButton.LeftButton:
+            rect, self._rubber_rect = self._rubber_rect, None
+            #A preview shows the new file's annotations while sidecar and page still belong to the old one
+            if self.image is None:
+                return
+            if rect is not None:
+                self.annotations.select_rect(rect, self._extend_selection(a0))
+            else:
+                self.annotations.select_at(self._scene_point(a0), self._pick_tolerance(), self._extend_selection(a0))
+    def mouseDoubleClickEvent(self, a0):
+        if self._is_drawing():
+            self.finish_shape()
+    
+    def _is_drawing(self):
+        return self.annotate_mode not in ('pan', 'select') and self.image is not None
+    
+    def _scene_point(self, event):
+        point = self.view.mapToScene(event.position().toPoint())
+        bounds = self.image_item.boundingRect()
+        point.setX(min(max(point.x(), bounds.left()), bounds.right()))
+        point.setY(min(max(point.y(), bounds.top()), bounds.bottom()))
+        return point
+    
+    def _pick_tolerance(self):
+        return 5 / max(self.view.transform().m11(), 1e-6)
+    
+    def _extend_selection(self, event):
+        return bool(event.modifiers() & Qt.KeyboardModifier.ShiftModifier)
+    
+    def _on_rubber_band(self, rect, from_scene, to_scene):
+        if not rect.isNull():
+            self._rubber_rect = QRectF(from_scene, to_scene)
+    
+    def set_annotate_mode(self, mode):
+        self.draft_points = []
+        self.annotations.set_draft(None, [])
+        self.annotate_mode = mode
+        if mode == 'pan':
+            self.view.setDragMode(QGraphicsView.DragMode.ScrollHandDrag)
+            self.view.setCursor(Qt.CursorShape.OpenHandCursor)
+        elif mode == 'select':
+            self.view.setDragMode(QGraphicsView.DragMode.RubberBandDrag)
+            self.view.setCursor(Qt.CursorShape.ArrowCursor)
+        else:
+            self.view.setDragMode(QGraphicsView.DragMode.NoDrag)
+            self.view.setCursor(Qt.CursorShape.CrossCursor)
+    
+    def set_annotation_label(self):
+        label, ok = QInputDialog.getText(self, "Label", "Label for new annotations:", text=self.annotation_label)
+        if ok:
+            self.annotation_label = label.strip()
+    
+    def finish_shape(self):
+        minimum = {'polygon': 3, 'polyline': 2}.get(self.annotate_mode)
+        if minimum is None:
+            return
+        #A double click also delivers a press, drop the duplicate vertex
+        points = [p for i, p in enumerate(self.draft_points) if i == 0 or p != self.draft_points[i - 1]]
+        if len(points) >= minimum:
+            self._add_annotation(self.annotate_mode, points)
+        else:
+            self.draft_points = []
+            self.annotations.set_draft(None, [])
+    
+    def _add_annotation(self, kind, points):
+        self.draft_points = []
+        self.annotations.set_draft(None, [])
+        self.annotations.add(kind, [(p.x(), p.y()) for p in points], self.annotation_label)
+        self._autosave_annotations()
+    
+    def delete_annotations(self):
+        if self.image is None:
+            return
+        if self.annotations.delete_selected():
+            self._autosave_annotations()
+    
+    def _autosave_annotations(self):
+        #Only the edits since the last save are appended to the sidecar journal
+        if self.sidecar is None or self.image is None:
+            return
+        try:
+            if self.sidecar.save(self.annotations.store, self.page_index) is not None:
+                self.annotations.set_selection([])
+        except Exception as e:
+            self.statusBar().showMessage(f"标注自动保存失败: {e}", 5000)
+    
+    def cancel_operation(self):
+        if self.draft_points:
+            self.draft_points = []
+            self.annotations.set_draft(None, [])
+            return
+        for target in PROCESSING_TARGETS:
+            self.jobs.cancel(target)
+    
+    def _annotation_store(self, index):
+        if index not in self.annotation_stores:
+            from bin.annotations import AnnotationStore
+            self.annotation_stores[index] = AnnotationStore()
+        return self.annotation_stores[index]
+    
+    def export_annotations(self):
+        filepath, filetype = QFileDialog.getSaveFileName(self, "Export Annotations", self.cwd, "JSON Files(*.json);;CSV Files(*.csv)")
+        if not filepath:
+            return
+        if not filepath.lower().endswith(('.json', '.csv')):
+            filepath += '.csv' if filetype.startswith('CSV') else '.json'
+        try:
+            from bin.sidecar import export_json, export_csv
+            export = export_csv if filepath.lower().endswith('.csv') else export_json
+            export(self.annotations.store, filepath)
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"保存文件时出错:\n{str(e)}")
         
     def reset(self):
+        if self.image is None:
+            return
         orginal = self.image_processor.reset_image()
-        if orginal:
-            self.scene.clear()
-            self.scene.addPixmap(orginal)
+        if orginal is None:
+            return
+        from interfaces.tiled_view import pyramid
+        def done(levels):
+            self.image = orginal
+            self.display_window.auto(self.image)
+            self.history.push('reset', {}, self.image, self.display_window.range)
+            self._show_image(self.image, levels)
+        self.jobs.submit('image', lambda job: pyramid(orginal, PREVIEW_SIDE), done)
+    
+    def undo(self):
+        #Steps from where a running replay is going, so quick presses each count
+        index = self._history_index()
+        if index > 0:
+            self._move_history(index - 1)
+    
+    def redo(self):
+        index = self._history_index()
+        if index < len(self.history.entries):
+            self._move_history(index + 1)
+    
+    def _history_index(self):
+        if self._history_target is not None and self.jobs.is_busy('image'):
+            return self._history_target
+        return self.history.cursor
+    
+    def _move_history(self, index):
+        from interfaces.tiled_view import pyramid
+        def replay(job):
+            img = self.history.state(index)
+            return img, pyramid(img, PREVIEW_SIDE)
+        def done(result):
+            img, levels = result
+            self._history_target = None
+            self._show_history_state(self.history.move_to(index, img), levels)
+        def abandoned():
+            if self._history_target == index:
+                self._history_target = None
+        self._history_target = index
+        self.jobs.submit('image', replay, done, on_abandoned=abandoned)
+    
+    def _show_history_state(self, img, levels=None):
+        #Each state comes back with the window it was shown with, however it is reached
+        self.image = img
+        window = self.history.window
+        if window is None:
+            self.display_window.auto(img)
+        else:
+            self.display_window.set_range(*window)
+        self._show_image(img, levels)
     
     def apply_log(self):
-        if not self.scene.items():
+        if self.image is None:
             QMessageBox.warning(self, "Warning", "No available Image")
             return
-        pixmap_item = self.scene.items()[0]
-        processed = self.image_processor.apply_log_transform(pixmap_item.pixmap())
-        if processed:
-            self.scene.clear()
-            self.scene.addPixmap(processed)
+        img = self.image
+        self.jobs.submit(
+            'image',
+            self._pyramid_job(self._cached_job(
+                [('log', {})], lambda job: self.image_processor.apply_operations(img, [('log', {})], job.set_progress))),
+            lambda result: self._commit_image(result, 'log', {})
+        )
+    
+    def apply_invert(self):
+        if self.image is None:
+            QMessageBox.warning(self, "Warning", "No available Image")
+            return
+        img = self.image
+        self.jobs.submit(
+            'image',
+            self._pyramid_job(self._cached_job([('invert', {})], lambda job: self.image_processor.apply_invert(img))),
+            lambda result: self._commit_image(result, 'invert', {})
+        )
+    
+    def adjust_display_range(self):
+        if self.image is None:
+            QMessageBox.warning(self, "Warning", "No available Image")
+            return
+        import numpy as np
+        from bin.display_window import histogram_range
+        from interfaces import DisplayRangeDialog
+        img = self.image
+        maximum = np.iinfo(img.dtype).max if np.issubdtype(img.dtype, np.integer) else histogram_range(img)[1]
+        orginal_range = self.display_window.range
+        dialog = DisplayRangeDialog(*orginal_range, maximum, histogram_range(img), self)
+        def rewindow():
+            values = dialog.get_values()
+            self.display_window.set_range(values['min'], values['max'])
+        dialog.min_spin.valueChanged.connect(rewindow)
+        dialog.max_spin.valueChanged.connect(rewindow)
+        if dialog.exec() == QDialog.DialogCode.Accepted:
+            self.history.window = self.display_window.range
+        else:
+            self.display_window.set_range(*orginal_range)
             
     def open_tif_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -184,111 +732,224 @@ class TIFFViewer(QMainWindow):
         self.cwd = os.path.dirname(file_path)
         if not file_path:
             return
-        try:
-            # 使用OpenCV读取图像
-            img = cv2.imread(file_path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
-            
-            if img is None:
-                raise ValueError("无法读取图像文件")
-                
-            height, width = img.shape[:2]
-            channels = 1 if len(img.shape) == 2 else img.shape[2]
-
-            if img.dtype == np.uint16:
-                img = self._convert_16bit_to_8bit(img)
-            
-            if channels == 1:
-                bytes_per_line = width
-                qimage = QImage(img.data, width, height, bytes_per_line, 
-                            QImage.Format.Format_Grayscale8)
-            elif channels == 3:
-                img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                bytes_per_line = 3 * width
-                qimage = QImage(img_rgb.data, width, height, bytes_per_line, 
-                            QImage.Format.Format_RGB888)
-            elif channels == 4:
-                img_rgba = cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA)
-                bytes_per_line = 4 * width
-                qimage = QImage(img_rgba.data, width, height, bytes_per_line, 
-                            QImage.Format.Format_RGBA8888)
-            else:
-                raise ValueError(f"不支持的通道数: {channels}")
-            self._display_image(qimage, file_path)
-            
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"无法打开文件: {str(e)}")
+        self.open_path(file_path)
+    
+    def open_folder(self):
+        self.folder_browser.show()
+        self.folder_browser.choose_folder()
+    
+    def open_path(self, file_path):
+        self.cwd = os.path.dirname(file_path)
+        #Pages are memory-mapped when uncompressed, decoded otherwise
+        def load(job):
+            from bin.display_window import histogram_range
+            from bin.tiff_reader import TiffStack, PagePrefetcher
+            from bin.sidecar import AnnotationSidecar, sidecar_path
+            from interfaces.tiled_view import pyramid
+            with span('load.open', path=file_path):
+                stack = TiffStack(file_path)
+                prefetcher = PagePrefetcher(stack)
+                try:
+                    sidecar = AnnotationSidecar(sidecar_path(file_path))
+                    store = sidecar.load(0)
+                    shape = stack.page_shape(0)
+                    #Overview pages and strided maps are cheap, a full decode is not worth doing twice
+                    if shape is not None and max(shape) > 2 * PREVIEW_SIDE and stack.has_cheap_reduced(0, PREVIEW_SIDE):
+                        with span('load.preview'):
+                            preview = stack.read_reduced(0, PREVIEW_SIDE)
+                        job.publish((preview, histogram_range(preview), shape, store))
+                    job.set_progress(0.5)
+                    img = prefetcher.get(0)
+                    job.check()
+                    window = histogram_range(img)
+                    levels = pyramid(img, PREVIEW_SIDE)
+                except Exception:
+                    prefetcher.close()
+                    raise
+                return stack, prefetcher, img, window, sidecar, store, levels
+        shown = [None]
+        def show_preview(result):
+            img, window, shape, store = result
+            #What was on screen, put back if the load never finishes
+            if shown[0] is None:
+                shown[0] = (self._image, self.display_window.range, self.annotations.store,
+                            self.image_item.levels)
+            #Nothing can be processed until the full data is in
+            self.image = None
+            self.annotations.set_store(store)
+            self.display_window.set_range(*window)
+            self._show_image(img, shape=shape)
+            self.view.fitInView(self.scene.itemsBoundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
+        def loaded(result):
+            stack, prefetcher, img, window, sidecar, store, levels = result
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+            self.stack = stack
+            self.prefetcher = prefetcher
+            self.page_index = 0
+            self.sidecar = sidecar
+            self.annotation_stores = {0: store}
+            self.annotations.set_store(store)
+            self._display_image(img, file_path, window, levels, fit=shown[0] is None)
+            self._update_page_label()
+        def abandoned():
+            #The preview belongs to a file that was not opened, the old one is still current
+            if shown[0] is None:
+                return
+            buffer, window, store, levels = shown[0]
+            self.image = buffer
+            self.annotations.set_store(store)
+            if buffer is None:
+                self.image_item.clear()
+                return
+            self.display_window.set_range(*window)
+            self._show_image(self.image, levels)
+            self.view.fitInView(self.scene.itemsBoundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
+        self.jobs.submit('image', load, loaded, show_preview, abandoned)
+    
+    def show_page(self, index):
+        if self.stack is None or not 0 <= index < len(self.stack):
+            return
+        prefetcher = self.prefetcher
+        sidecar = self.sidecar
+        store = self.annotation_stores.get(index)
+        def load(job):
+            from bin.display_window import histogram_range
+            from interfaces.tiled_view import pyramid
+            img = prefetcher.get(index)
+            page_store = store
+            if page_store is None and sidecar is not None:
+                page_store = sidecar.load(index)
+            return img, histogram_range(img), page_store, pyramid(img, PREVIEW_SIDE)
+        def loaded(result):
+            img, window, page_store, levels = result
+            self.page_index = index
+            if page_store is not None:
+                self.annotation_stores[index] = page_store
+            self.annotations.set_store(self._annotation_store(index))
+            self.image = img
+            img = self.image
+            self.display_window.set_range(*window)
+            self.image_processor.set_orginal_image(img)
+            self.history.reset(img, self.display_window.range)
+            self._show_image(img, levels)
+            self._update_page_label()
+        self.jobs.submit('image', load, loaded)
+    
+    def _update_page_label(self):
+        if self.stack is not None and len(self.stack) > 1:
+            self.page_label.setText(f"Page {self.page_index + 1}/{len(self.stack)}")
+        else:
+            self.page_label.setText("")
             
-    def _display_image(self, qimage, file_path):
-        self.scene.clear()
-        pixmap = QPixmap.fromImage(qimage)
-        self.scene.addPixmap(pixmap)
-        self.view.fitInView(self.scene.itemsBoundingRect(), 
-                        Qt.AspectRatioMode.KeepAspectRatio)
-        self.image_processor.set_orginal_image(pixmap)
+    def _display_image(self, img, file_path, window=None, levels=None, fit=True):
+        #The tracked frame may be an identical one already held, show that and let img go
+        self.image = img
+        img = self.image
+        if window is None:
+            self.display_window.auto(img)
+        else:
+            self.display_window.set_range(*window)
+        self._show_image(img, levels)
+        #After a preview the user may already be panning, keep their transform
+        if fit:
+            with span('display.fit'):
+                self.view.fitInView(self.scene.itemsBoundingRect(), 
+                                Qt.AspectRatioMode.KeepAspectRatio)
+        self.image_processor.set_orginal_image(img)
+        self.history.reset(img, self.display_window.range)
         self.current_file_path = file_path   
-        
-    def _convert_16bit_to_8bit(self, img):
-        min_val = np.min(img)
-        max_val = np.max(img)
-        if max_val > min_val:
-            img_8bit = ((img - min_val) * (255.0 / (max_val - min_val))).astype(np.uint8)
+    
+    def _show_image(self, img, levels=None, shape=None):
+        #Only the tiles intersecting the viewport are converted to QPixmaps
+        if levels:
+            #The tracked frame may be an identical one already held, it replaces the level it matches
+            levels = [img] + list(levels[1:])
+        with span('display.show', img):
+            self.image_item.set_image(img, self.display_window.apply, levels, shape)
+            self.scene.setSceneRect(self.image_item.boundingRect())
+            self.annotations.set_bounds(self.image_item.boundingRect())
+    
+    def toggle_tracing(self, checked):
+        if checked:
+            tracer.enable()
+            self.trace_timer.start()
         else:
-            img_8bit = np.zeros_like(img, dtype=np.uint8)
-        return img_8bit
+            tracer.disable()
+            self.trace_timer.stop()
+            self.trace_label.setText("")
+    
+    def _update_trace_label(self):
+        if not tracer.spans:
+            return
+        record = tracer.spans[-1]
+        self.trace_label.setText(
+            f"{record['name']}: {record['wall'] * 1000:.1f} ms (cpu {record['cpu'] * 1000:.1f} ms)"
+        )
+    
+    def _update_memory_label(self):
+        #Nothing is tracked before the first image, so the manager is not imported for it
+        memory = sys.modules.get('bin.memory')
+        if memory is None:
+            return
+        manager = memory.manager()
+        #Caches grow without tracking anything, check the budget here as well
+        manager.enforce()
+        usage = manager.usage()
+        gb = 1024 ** 3
+        text = f"Memory {(usage['resident'] + usage['caches']) / gb:.1f}/{usage['budget'] / gb:.1f} GB"
+        if usage['spilled']:
+            text += f", on disk {usage['spilled'] / gb:.1f} GB"
+        self.memory_label.setText(text)
+    
+    def export_trace(self):
+        filepath, _ = QFileDialog.getSaveFileName(self, "Export Trace", self.cwd, "JSON Files(*.json)")
+        if not filepath:
+            return
+        try:
+            tracer.export(filepath)
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"保存文件时出错:\n{str(e)}")
     
+    def _commit_image(self, result, operation, params, full_range=True):
+        #Ops that rescale to the full value range are shown unwindowed
+        img, levels = result
+        self.image = img
+        img = self.image
+        if full_range:
+            self.display_window.full_range(img)
+        self.history.push(operation, params, img, self.display_window.range)
+        self._show_image(img, levels)
+        
     def save_action(self):
+        if self.image is None:
+            QMessageBox.critical(self, "错误", "保存文件时出错:\n场景中没有图像")
+            return
         filepath, filetype = QFileDialog.getSaveFileName(self, "",self.cwd, "TIFF Files(*tif)")
-        print(filepath, filetype)
         if not filepath:
             return
         if not filepath.lower().endswith(('.tif','.tiff')):
             filepath+='.tif'
-        try: 
-            if not self.scene.items():
-                raise ValueError("场景中没有图像")
-            
-            pixmap_item = self.scene.items()[0]
-            qimage = pixmap_item.pixmap().toImage()
-
-            if qimage.format() not in (QImage.Format.Format_RGB888, QImage.Format.Format_RGBA8888):
-                qimage = qimage.convertToFormat(QImage.Format.Format_RGB888)
-            
-
-            width = qimage.width()
-            height = qimage.height()
-            bytes_per_line = qimage.bytesPerLine()
-            channels = 4 if qimage.hasAlphaChannel() else 3
-            
-            ptr = qimage.bits()
-            ptr.setsize(height * bytes_per_line)
-            arr = np.frombuffer(ptr, np.uint8)
-            
-            if bytes_per_line == width * channels:
-                arr = arr.reshape((height, width, channels))
-            else:
-                arr = arr.reshape((height, bytes_per_line))[:, :width*channels]
-                arr = arr.reshape((height, width, channels))
-
-            if channels == 3:
-                cv_image = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-            elif channels == 4:
-                cv_image = cv2.cvtColor(arr, cv2.COLOR_RGBA2BGRA)
-            else:
-                cv_image = arr
-            if not cv2.imwrite(filepath, cv_image):
-                raise ValueError("保存文件失败")
-                
-            QMessageBox.information(self, "成功", f"图像已保存为:\n{filepath}")
-            self.cwd = os.path.dirname(filepath)
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"保存文件时出错:\n{str(e)}")
-            
-                
-        
-        
-        
-        
-        
+        from interfaces import SaveOptionsDialog
+        from bin.tiff_writer import write_tiff
+        dialog = SaveOptionsDialog(self.image, self)
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        options = dialog.get_values()
+        img = self.image
+        #Working data is written at its own dtype and channel count, off the GUI thread
+        def save(job):
+            write_tiff(filepath, [img], progress=job.set_progress, **options)
+            return filepath
+        def saved(path):
+            QMessageBox.information(self, "成功", f"图像已保存为:\n{path}")
+            self.cwd = os.path.dirname(path)
+            if self._close_after_save:
+                self.close()
+        def abandoned():
+            if self._close_after_save:
+                self.close()
+        self.jobs.submit('save', save, saved, on_abandoned=abandoned)
     
     def zoom_in(self):
         self.view.scale(self.zoom_factor, self.zoom_factor)
@@ -298,17 +959,45 @@ class TIFFViewer(QMainWindow):
     
     def rest_change(self):
         self.view.resetTransform()
-        if hasattr(self, 'scene') and self.scene.items():
+        if self.image is not None:
             self.view.fitInView(self.scene.itemsBoundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
     
     def show_about(self):
         QMessageBox.about(self, "About", "TIF 文件查看器\n 使用PyQt6和Pillow库创建。")
     
     def resizeEvent(self, event):
-        if hasattr(self, 'scene') and self.scene.items():
+        if getattr(self, 'image', None) is not None:
             self.view.fitInView(self.scene.itemsBoundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
             super().resizeEvent(event)
             
+    def _set_busy(self, busy):
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(busy)
+    
+    def closeEvent(self, a0):
+        if self.jobs.is_busy('save'):
+            #Aborting a save deletes the partial file, so the user decides
+            buttons = QMessageBox.StandardButton
+            answer = QMessageBox.question(self, "正在保存", "文件仍在保存，是否等待保存完成后关闭？\n选择“否”将中止保存。",
+                                          buttons.Yes | buttons.No | buttons.Cancel, buttons.Yes)
+            if answer != buttons.No:
+                self._close_after_save = answer == buttons.Yes
+                if self._close_after_save:
+                    for target in PROCESSING_TARGETS:
+                        self.jobs.cancel(target)
+                a0.ignore()
+                return
+        self.jobs.cancel()
+        if self._folder_browser is not None:
+            self._folder_browser.model.close()
+        self.jobs.wait(2000)
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self._result_cache is not None:
+            self._result_cache.close()
+        self.memory_timer.stop()
+        super().closeEvent(a0)
+            
     def wheelEvent(self, a0):
         if a0.modifiers() & Qt.KeyboardModifier.ControlModifier:
             #Preseeed Ctrl
@@ -320,7 +1009,20 @@ class TIFFViewer(QMainWindow):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    viewer = TIFFViewer()
-    viewer.show()
+    #Each file given on the command line ("open with") gets its own window
+    paths = [p for p in sys.argv[1:] if os.path.isfile(p)]
+    viewers = []
+    for i in range(max(1, len(paths))):
+        viewer = TIFFViewer()
+        if os.environ.get('VIT_STARTUP_REPORT'):
+            viewer.view.viewport().installEventFilter(_FirstPaint(viewer))
+        viewer.move(viewer.pos().x() + 30 * i, viewer.pos().y() + 30 * i)
+        viewer.show()
+        viewers.append(viewer)
+    QTimer.singleShot(0, lambda: report_startup('window', last=not paths))
+    #Decoding runs on the job pool while the window is already on screen
+    for viewer, path in zip(viewers, paths):
+        viewer.open_path(path)
+    threading.Thread(target=preload_modules, daemon=True).start()
     sys.exit(app.exec())
             
\ No newline at end of file
@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+import sys
+
+from bin import parallel
+from bin.processing_server import ProcessingServer, default_socket_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve ImageProcessor op chains to local scripts over a Unix socket")
+    parser.add_argument("--socket", default=default_socket_path(), help="socket path (default %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="jobs processed at once (default min(4, cores))")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="threads for band-split ops inside a job (default VIT_THREADS or the core count)")
+    args = parser.parse_args(argv)
+
+    parallel.set_threads(args.threads)
+    server = ProcessingServer(args.socket, args.workers)
+    try:
+        asyncio.run(server.serve(lambda: print(f"listening on {server.path} with {server.workers} workers", flush=True)))
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
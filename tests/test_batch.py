@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+import batch
+import bin.image_processor as image_processor
+from bin.tiff_reader import TiffStack
+from bin.tiff_writer import write_tiff
+
+
+def _ops(name):
+    return [(name, dict(image_processor.DEFAULT_PARAMS[name]))]
+
+
+def test_pages_are_written_as_they_are_produced(tmp_path):
+    path = str(tmp_path / 'stream.tif')
+    sizes = []
+
+    def pages():
+        for value in range(3):
+            # what is on disk when the next page is asked for
+            sizes.append(os.path.getsize(path + '.part'))
+            yield np.full((40, 30), value, np.uint16)
+
+    write_tiff(path, pages(), compression='deflate')
+    assert sizes[0] < sizes[1] < sizes[2]
+    stack = TiffStack(path)
+    assert [int(stack.read_page(i)[0, 0]) for i in range(len(stack))] == [0, 1, 2]
+
+
+def test_process_file_writes_every_page(tmp_path):
+    rng = np.random.default_rng(0)
+    pages = [rng.integers(0, 65535, size=(48, 32, 3), dtype=np.uint16) for _ in range(4)]
+    src = str(tmp_path / 'in.tif')
+    dst = str(tmp_path / 'out' / 'in.tif')
+    write_tiff(src, pages)
+    batch._init_worker()
+    result = batch.process_file(src, dst, _ops('invert'))
+    assert result['pages'] == 4
+    stack = TiffStack(dst)
+    assert stack.pages[0].compression == 8
+    for index, page in enumerate(pages):
+        assert np.array_equal(stack.read_page(index), image_processor.apply_operations(page, _ops('invert')))
@@ -0,0 +1,40 @@
+import numpy as np
+
+from bin.display_window import DisplayWindow
+from bin.history import OperationHistory
+
+
+def _history():
+    history = OperationHistory(lambda image, ops: image)
+    history.reset(np.zeros((8, 8), np.uint16), (10.0, 900.0))
+    return history
+
+
+def test_each_state_keeps_its_window():
+    history = _history()
+    history.push('log', {}, np.ones((8, 8), np.uint16), (0.0, 65535.0))
+    # a bandpass without autoscale keeps whatever window was on screen
+    history.push('bandpass', {'autoscale': False}, np.ones((8, 8), np.uint16), (0.0, 65535.0))
+    history.move_to(1)
+    history.window = (5.0, 500.0)
+    assert [history.windows[i] for i in range(3)] == [(10.0, 900.0), (5.0, 500.0), (0.0, 65535.0)]
+    history.move_to(0)
+    assert history.window == (10.0, 900.0)
+
+
+def test_a_new_branch_drops_the_windows_after_the_cursor():
+    history = _history()
+    for value in range(3):
+        history.push('invert', {}, np.full((8, 8), value, np.uint16), (0.0, float(value)))
+    history.move_to(1)
+    history.push('log', {}, np.ones((8, 8), np.uint16), (1.0, 2.0))
+    assert history.windows == [(10.0, 900.0), (0.0, 0.0), (1.0, 2.0)]
+
+
+def test_window_reports_only_real_changes():
+    changes = []
+    window = DisplayWindow(on_change=lambda: changes.append(window.range))
+    window.set_range(0, 255)
+    window.full_range(np.zeros((4, 4), np.uint16))
+    window.set_range(0, 65535)
+    assert changes == [(0.0, 65535.0)]
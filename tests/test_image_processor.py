@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import bin.image_processor as image_processor
+
+
+def _ops(name, **params):
+    return [(name, dict(image_processor.DEFAULT_PARAMS[name], **params))]
+
+
+def _expected(image, name):
+    # the ops written out in float64 on the whole image
+    values = image.astype(np.float64)
+    info = np.iinfo(image.dtype)
+    peak = float(info.max)
+    if name == 'invert':
+        result = peak - values
+    elif name == 'log':
+        result = np.log1p(np.maximum(values, 0)) * (peak / np.log1p(values.max()))
+    else:
+        result = (values - values.min()) * (peak / (values.max() - values.min()))
+    return np.clip(np.rint(result), info.min, info.max).astype(image.dtype)
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.int32, np.uint32])
+@pytest.mark.parametrize('name', ['invert', 'log', 'contrast'])
+def test_wide_and_signed_integers(dtype, name):
+    info = np.iinfo(dtype)
+    rng = np.random.default_rng(0)
+    image = rng.integers(max(info.min, -30000), info.max, size=(64, 48), dtype=dtype, endpoint=True)
+    image[0, 0] = max(info.min, -30000)
+    result = image_processor.apply_operations(image, _ops(name, auto=True) if name == 'contrast' else _ops(name))
+    assert result.dtype == image.dtype
+    # 32-bit values are computed in float64, so at most one step of rounding apart
+    assert np.abs(result.astype(np.int64) - _expected(image, name).astype(np.int64)).max() <= 1
+
+
+def test_int16_negative_values_keep_their_order():
+    image = np.array([[-300, -5, 0, 100, 1000]], np.int16)
+    result = image_processor.apply_operations(image, _ops('contrast', auto=True))
+    assert result[0, 0] == 0
+    assert np.all(np.diff(result[0].astype(np.int64)) > 0)
+
+
+def test_int32_does_not_build_a_full_table():
+    image = np.array([[0, 1, 2**31 - 1]], np.int32)
+    assert image_processor.apply_operations(image, _ops('invert')).tolist() == [[2**31 - 1, 2**31 - 2, 0]]
+
+
+def test_lut_matches_float_path_for_uint16():
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 65535, size=(40, 30), dtype=np.uint16)
+    for name in ('invert', 'log', 'contrast'):
+        ops = _ops(name, auto=True) if name == 'contrast' else _ops(name)
+        assert np.abs(image_processor.apply_operations(image, ops).astype(np.int64)
+                      - _expected(image, name).astype(np.int64)).max() <= 1
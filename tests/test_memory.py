@@ -0,0 +1,84 @@
+import gc
+import os
+
+import numpy as np
+import pytest
+
+from bin import memory
+from bin.history import OperationHistory
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    manager = memory.MemoryManager(budget=1, spill_dir=str(tmp_path))
+    monkeypatch.setattr(memory, '_manager', manager)
+    yield manager
+    manager.wait()
+
+
+def _anonymous_rss():
+    # resident memory not backed by a file, spilled pages read back through the map do not count
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) * 1024
+    pytest.skip('RssAnon not reported')
+
+
+def test_spill_releases_memory(manager):
+    if not os.path.exists('/proc/self/status'):
+        pytest.skip('needs /proc')
+    array = np.random.default_rng(0).random((4096, 4096), np.float32)
+    expected = array[::512, ::512].copy()
+    buffer = manager.track(array)
+    del array
+    gc.collect()
+    before = _anonymous_rss()
+    manager.wait()
+    usage = manager.usage()
+    assert usage['resident'] == 0
+    assert usage['spilled'] == buffer.nbytes
+    assert before - _anonymous_rss() > buffer.nbytes * 0.8
+    assert np.array_equal(buffer.array[::512, ::512], expected)
+
+
+def test_pinned_buffers_stay_resident(manager):
+    buffer = manager.track(np.zeros((512, 512), np.uint16), pin=True)
+    manager.enforce()
+    manager.wait()
+    assert buffer.resident
+    buffer.unpin()
+    manager.wait()
+    assert not buffer.resident
+
+
+def test_identical_copies_share_a_buffer(manager):
+    manager.budget = 1 << 30
+    array = np.arange(1 << 20, dtype=np.uint32).reshape(1024, 1024)
+    buffer = manager.track(array)
+    copy = array.copy()
+    assert manager.track(copy) is buffer
+    del copy
+    gc.collect()
+    assert manager.usage()['resident'] == array.nbytes
+    assert manager.usage()['shared'] == array.nbytes
+
+
+def test_tracking_freezes_the_array(manager):
+    manager.budget = 1 << 30
+    array = np.zeros((64, 64), np.uint8)
+    manager.track(array)
+    with pytest.raises(ValueError):
+        array[0, 0] = 1
+
+
+def test_history_reads_spilled_states(manager):
+    history = OperationHistory(lambda image, ops: image, checkpoint_interval=1)
+    states = [np.full((256, 256), i, np.uint16) for i in range(4)]
+    history.reset(states[0])
+    for state in states[1:]:
+        history.push('invert', {}, state)
+    manager.wait()
+    assert manager.usage()['resident'] == 0
+    for index in (2, 0, 3):
+        assert np.array_equal(history.move_to(index), states[index])
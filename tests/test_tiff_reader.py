@@ -0,0 +1,141 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from bin.tiff_reader import TiffStack
+from bin.tiff_writer import write_tiff
+
+
+def _ifd(entries, next_offset=0):
+    # entries: (code, type, value) with one inline value each; type 3 SHORT, 4 LONG
+    data = struct.pack('<H', len(entries))
+    for code, kind, value in sorted(entries):
+        packed = struct.pack('<H', value) + b'\x00\x00' if kind == 3 else struct.pack('<I', value)
+        data += struct.pack('<HHI', code, kind, 1) + packed
+    return data + struct.pack('<I', next_offset)
+
+
+def _entries(image, offset, reduced=False, sub_ifd=None):
+    entries = [(254, 4, 1 if reduced else 0), (256, 4, image.shape[1]), (257, 4, image.shape[0]),
+               (258, 3, 16), (259, 3, 1), (262, 3, 1), (273, 4, offset), (277, 3, 1),
+               (278, 4, image.shape[0]), (279, 4, image.nbytes)]
+    if sub_ifd is not None:
+        entries.append((330, 4, sub_ifd))
+    return entries
+
+
+def _write(path, pages, overview, as_sub_ifd):
+    # uncompressed uint16 pages, the first with a half size overview stored either as
+    # a SubIFD or as a reduced IFD right after it in the main chain
+    data = b''
+    offsets = []
+    for image in pages + [overview]:
+        offsets.append(8 + len(data))
+        data += image.tobytes()
+    ifd_size = 2 + 12 * 11 + 4
+    start = 8 + len(data)
+    chain = [(pages[0], offsets[0], False)]
+    if not as_sub_ifd:
+        chain.append((overview, offsets[-1], True))
+    chain += [(image, offset, False) for image, offset in zip(pages[1:], offsets[1:-1])]
+    sub_position = start + ifd_size * len(chain)
+    blob = b''
+    for i, (image, offset, reduced) in enumerate(chain):
+        following = start + ifd_size * (i + 1) if i + 1 < len(chain) else 0
+        sub = sub_position if as_sub_ifd and i == 0 else None
+        entries = _entries(image, offset, reduced, sub)
+        blob += _ifd(entries, following).ljust(ifd_size, b'\x00')
+    if as_sub_ifd:
+        blob += _ifd(_entries(overview, offsets[-1], True))
+    with open(path, 'wb') as f:
+        f.write(b'II*\x00' + struct.pack('<I', start) + data + blob)
+
+
+def _pages():
+    rng = np.random.default_rng(0)
+    pages = [rng.integers(0, 65535, size=(64, 96), dtype=np.uint16) for _ in range(2)]
+    return pages, np.ascontiguousarray(pages[0][::2, ::2])
+
+
+def test_reduced_ifds_are_not_pages(tmp_path):
+    pages, overview = _pages()
+    path = str(tmp_path / 'chain.tif')
+    _write(path, pages, overview, as_sub_ifd=False)
+    stack = TiffStack(path)
+    assert len(stack) == 2
+    for index, page in enumerate(pages):
+        assert np.array_equal(stack.read_page(index), page)
+    assert np.array_equal(stack.read_reduced(0, 40), overview)
+    assert stack.overview(1, 40) is None
+
+
+def test_sub_ifd_overviews(tmp_path):
+    pages, overview = _pages()
+    path = str(tmp_path / 'sub.tif')
+    _write(path, pages, overview, as_sub_ifd=True)
+    stack = TiffStack(path)
+    assert len(stack) == 2
+    assert np.array_equal(stack.read_page(1), pages[1])
+    assert stack.has_cheap_reduced(0, 40)
+    assert np.array_equal(stack.read_reduced(0, 40), overview)
+    # too small to cover the requested size, the page itself is strided instead
+    assert stack.overview(0, 64) is None
+
+
+@pytest.mark.parametrize('tile', [None, 64])
+@pytest.mark.parametrize('dtype,channels', [(np.uint8, 3), (np.uint16, 1), (np.uint16, 4), (np.float32, 1)])
+def test_strided_deflate_read_matches_full_page(tmp_path, tile, dtype, channels):
+    rng = np.random.default_rng(2)
+    shape = (301, 257) + ((channels,) if channels > 1 else ())
+    image = (rng.random(shape) * (255 if dtype == np.uint8 else 65535 if dtype == np.uint16 else 1)).astype(dtype)
+    path = str(tmp_path / 'deflate.tif')
+    write_tiff(path, [image], compression='deflate', tile=tile)
+    stack = TiffStack(path)
+    assert stack.pages[0].is_chunk_decodable
+    for step in (1, 3, 16):
+        assert np.array_equal(stack.read_strided(0, step), image[::step, ::step])
+
+
+@pytest.mark.parametrize('compression', ['none', 'deflate', 'lzw'])
+@pytest.mark.parametrize('dtype', [np.int8, np.int16, np.int32, np.uint32])
+@pytest.mark.parametrize('channels', [3, 4])
+def test_signed_and_wide_colour_pages_round_trip(tmp_path, compression, dtype, channels):
+    # cv2.cvtColor does not take these, the channels are reordered by numpy
+    info = np.iinfo(dtype)
+    image = np.random.default_rng(6).integers(info.min, info.max, size=(37, 29, channels), dtype=dtype,
+                                              endpoint=True)
+    path = str(tmp_path / 'colour.tif')
+    write_tiff(path, [image], compression=compression)
+    result = TiffStack(path).read_page(0)
+    assert result.dtype == image.dtype
+    assert np.array_equal(result, image)
+
+
+def test_reduced_read_of_a_deflate_page_skips_the_full_decode(tmp_path, monkeypatch):
+    image = np.random.default_rng(3).integers(0, 65535, size=(600, 400), dtype=np.uint16)
+    path = str(tmp_path / 'big.tif')
+    write_tiff(path, [image], compression='deflate')
+    stack = TiffStack(path)
+    monkeypatch.setattr(stack, '_decode', lambda index: pytest.fail('full decode'))
+    reduced = stack.read_reduced(0, 100)
+    assert np.array_equal(reduced, image[::3, ::3])
+
+
+def test_lzw_pages_fall_back_to_a_full_decode(tmp_path):
+    # libtiff's LZW is not decoded chunk by chunk here, reduced reads decode the page
+    image = np.random.default_rng(4).integers(0, 255, size=(600, 400), dtype=np.uint8)
+    path = str(tmp_path / 'lzw.tif')
+    write_tiff(path, [image], compression='lzw')
+    stack = TiffStack(path)
+    assert not stack.pages[0].is_chunk_decodable
+    assert np.array_equal(stack.read_reduced(0, 100), image)
+
+
+def test_other_formats_are_decoded_reduced(tmp_path):
+    image = np.random.default_rng(5).integers(0, 255, size=(800, 600, 3), dtype=np.uint8)
+    path = str(tmp_path / 'big.png')
+    cv2.imwrite(path, image)
+    reduced = TiffStack(path).read_reduced(0, 100)
+    assert max(reduced.shape[:2]) == 100